@@ -3,6 +3,7 @@ from flask_cors import CORS
 from flask_socketio import SocketIO
 
 from .config import Config
+from .utils.serializer import JSONProvider
 
 def create_app():
     """
@@ -15,8 +16,12 @@ def create_app():
     Returns:
         The app object
     """
+    if not Config.SECRET_KEY:
+        raise RuntimeError("SECRET_KEY must be set, it signs the tokens of socket connections")
+
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = JSONProvider(app)
     CORS_ALLOW_ORIGIN = "*,*"
     CORS_EXPOSE_HEADERS = "*,*"
     CORS_ALLOW_HEADERS = "content-type,*"
@@ -30,23 +35,83 @@ def create_app():
     
     # SocketIO documentation : https://flask-socketio.readthedocs.io/en/latest/api.html
     socketio = SocketIO(
-        app, cors_allowed_origins="*", async_mode="threading", async_handlers=True
+        app, 
+        cors_allowed_origins="*", 
+        async_mode=Config.SOCKETIO_ASYNC_MODE, 
+        async_handlers=True, 
+        message_queue=Config.SOCKETIO_MESSAGE_QUEUE
     ) 
     
     with app.app_context():
-        from app.models.elasticClient import ElasticClient
-        from app.models.mongoClient import MongoClient
+        # Databases are connected on first use and checked in the background, so that starting a
+        # worker does not wait for them
+        from app.utils.health import HealthCheck
+
+        HealthCheck.start()
+
+        if Config.BOOTSTRAP_ON_STARTUP:
+            from app.utils.bootstrap import Bootstrap
+
+            Bootstrap.start()
+
+        from app.utils.invalidation import InvalidationBus
 
-        ElasticClient.connect()
-        MongoClient.connect()
+        InvalidationBus.start()
 
+        from app.utils.cancellation import Cancellations
+
+        Cancellations.listen()
+
+        from app.utils.reaper import GeneratedDeckReaper
+
+        GeneratedDeckReaper.start()
+
+        from app.utils.metrics import Metrics
+
+        Metrics.start()
 
         return app, socketio
     
 app, socketio = create_app()
 
 # Register blueprints
+from app.routes.health.routes import health
+from app.routes.metrics.routes import metrics
 from app.routes.user.presentation.routes import presentation
 
+app.register_blueprint(health)
+app.register_blueprint(metrics)
 app.register_blueprint(presentation)
+
+
+@app.cli.command("bootstrap")
+def bootstrap():
+    """Create MongoDB indexes and the ElasticSearch index template and mappings"""
+    from app.utils.bootstrap import Bootstrap
+
+    print(Bootstrap.run())
+
+
+@app.cli.command("collect-blobs")
+def collect_blobs():
+    """Delete stored files that are no longer referenced"""
+    from app.utils.blobstore import BlobStore
+
+    print("Deleted blobs:", BlobStore.connect().collect_garbage(Config.BLOB_GRACE_SECONDS))
+
+
+@app.cli.command("reap-generated")
+def reap_generated():
+    """Delete expired generated presentations and those over quota"""
+    from app.utils.reaper import GeneratedDeckReaper
+
+    print("Reclaimed bytes:", GeneratedDeckReaper.sweep())
+
+
+@app.cli.command("migrate-routing")
+def migrate_routing():
+    """Reindex ElasticSearch documents indexed before routing by user_id"""
+    from app.utils.bootstrap import Bootstrap
+
+    Bootstrap.migrate_to_routing()
    
@@ -14,11 +14,104 @@ class Config(object):
     ELASTIC_USER = os.getenv('ELASTIC_USER')
     ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
     ELASTIC_INDEX = "docs"
+    ELASTIC_REFRESH_INTERVAL = os.getenv("ELASTIC_REFRESH_INTERVAL", "10s")
     
     REQUEST_TIMEOUT = 900
     MAX_RETRIES = 10
 
+    # Connection pools of each process
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    ELASTIC_CONNECTIONS_PER_NODE = int(os.getenv("ELASTIC_CONNECTIONS_PER_NODE", 10))
+
+    # Timeout in seconds and retries of each class of ElasticSearch requests
+    ELASTIC_SEARCH_TIMEOUT = int(os.getenv("ELASTIC_SEARCH_TIMEOUT", 30))
+    ELASTIC_SEARCH_RETRIES = int(os.getenv("ELASTIC_SEARCH_RETRIES", 2))
+    ELASTIC_BULK_TIMEOUT = int(os.getenv("ELASTIC_BULK_TIMEOUT", 120))
+    ELASTIC_BULK_RETRIES = int(os.getenv("ELASTIC_BULK_RETRIES", 3))
+    ELASTIC_ADMIN_TIMEOUT = int(os.getenv("ELASTIC_ADMIN_TIMEOUT", 300))
+    ELASTIC_ADMIN_RETRIES = int(os.getenv("ELASTIC_ADMIN_RETRIES", 1))
+
+    # Signs the tokens with which users connect to the socket, the same in every worker
+    SECRET_KEY = os.getenv("SECRET_KEY")
+    SOCKET_TOKEN_MAX_AGE = int(os.getenv("SOCKET_TOKEN_MAX_AGE", 3600))
+
+    # Parsing of uploaded files, shared fairly between users
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 8))
+    INGEST_USER_MAX_IN_FLIGHT = int(os.getenv("INGEST_USER_MAX_IN_FLIGHT", 4))
+
+    # Admission control of presentation generation, shared fairly between users
+    GENERATION_USER_MAX_IN_FLIGHT = int(os.getenv("GENERATION_USER_MAX_IN_FLIGHT", 1))
+    GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", 4))
+    GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", 16))
+    GENERATION_QUEUE_TIMEOUT = int(os.getenv("GENERATION_QUEUE_TIMEOUT", 30))
+    GENERATION_MEMORY_PER_REQUEST = int(os.getenv("GENERATION_MEMORY_PER_REQUEST", 512 * 1024 ** 2))
+    GENERATION_MEMORY_RESERVE = int(os.getenv("GENERATION_MEMORY_RESERVE", 512 * 1024 ** 2))
+
+    # Seconds between progress events of a job; intermediate states in between are dropped
+    PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.5))
+
+    # Socket.IO server. The async mode is "threading" for the development server and "gevent" under gunicorn
+    SOCKETIO_ASYNC_MODE = os.getenv("SOCKETIO_ASYNC_MODE", "threading")
+    # Redis URL through which every worker process emits to the clients connected to the others
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+
+    # Folder shared by the worker processes, where each writes its metrics for `/metrics` to sum them.
+    # gunicorn sets it when it runs more than one worker; unset, a scrape returns those of one process
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+    # Seconds between background checks that the databases are reachable
+    HEALTH_CHECK_INTERVAL = int(os.getenv("HEALTH_CHECK_INTERVAL", 30))
+    HEALTH_CHECK_TIMEOUT = int(os.getenv("HEALTH_CHECK_TIMEOUT", 5))
+
+    # Create database indexes and mappings when the app starts, in the background
+    BOOTSTRAP_ON_STARTUP = os.getenv("BOOTSTRAP_ON_STARTUP", "true").lower() == "true"
+
     GCP_PROD_ENV = False
     USER_FOLDER = os.getcwd() + "/assets/users"
     GENERATED_FOLDER_NAME = "generated_ppt"
     MONGO_DOCUMENT_MASTER_COLLECTION = "DOCUMENTS_MASTER"
+    MONGO_FILENAME_COUNTER_COLLECTION = "FILENAME_COUNTERS"
+    MONGO_DOCUMENT_CONTENT_COLLECTION = "DOCUMENTS_CONTENT"
+    MONGO_BLOB_REFS_COLLECTION = "BLOB_REFS"
+    MONGO_BLOB_NAMES_COLLECTION = "BLOB_NAMES"
+    MONGO_GENERATED_DECKS_COLLECTION = "GENERATED_DECKS"
+    MONGO_GENERATED_USAGE_COLLECTION = "GENERATED_USAGE"
+    MONGO_UPLOADS_COLLECTION = "UPLOADS"
+
+    # Content-addressed store of uploaded and generated presentations
+    BLOB_STORE_FOLDER = os.getenv("BLOB_STORE_FOLDER", os.getcwd() + "/assets/blobs")
+    BLOB_GRACE_SECONDS = int(os.getenv("BLOB_GRACE_SECONDS", 3600))
+
+    # Resumable uploads, sent in chunks
+    UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024 ** 3))
+    UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", 16 * 1024 ** 2))
+    UPLOAD_EXPIRY_SECONDS = int(os.getenv("UPLOAD_EXPIRY_SECONDS", 24 * 3600))
+    UPLOAD_LOCK_SECONDS = int(os.getenv("UPLOAD_LOCK_SECONDS", 300))
+    # Longest time to finalize an upload, after which it can be finalized again
+    UPLOAD_FINALIZE_SECONDS = int(os.getenv("UPLOAD_FINALIZE_SECONDS", 1800))
+
+    # Deletion of generated presentations
+    REAPER_ENABLED = os.getenv("REAPER_ENABLED", "true").lower() == "true"
+    REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", 300))
+    REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 100))
+    GENERATED_TTL_SECONDS = int(os.getenv("GENERATED_TTL_SECONDS", 24 * 3600))
+    GENERATED_LEASE_SECONDS = int(os.getenv("GENERATED_LEASE_SECONDS", 600))
+    GENERATED_USER_QUOTA_BYTES = int(os.getenv("GENERATED_USER_QUOTA_BYTES", 500 * 1024 ** 2))
+    GENERATED_GLOBAL_QUOTA_BYTES = int(os.getenv("GENERATED_GLOBAL_QUOTA_BYTES", 10 * 1024 ** 3))
+
+    # In-process cache of document records
+    METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 10000))
+    METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 300))
+
+    # Invalidate the caches of every process from a change stream on DOCUMENTS_MASTER (requires a replica set)
+    INVALIDATION_BUS_ENABLED = os.getenv("INVALIDATION_BUS_ENABLED", "true").lower() == "true"
+
+    # On-disk cache of parsed presentations, shared by all workers
+    ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+    ARTIFACT_CACHE_PATH = os.getenv("ARTIFACT_CACHE_PATH", os.getcwd() + "/assets/cache/artifacts.sqlite3")
+    ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
@@ -1,4 +1,5 @@
 import sys
+import threading
 
 from elasticsearch import Elasticsearch
 
@@ -6,14 +7,34 @@ from app.config import Config
 
 class ElasticClient:
     __db = None
+    __lock = threading.Lock()
     REQUEST_TIMEOUT = Config.REQUEST_TIMEOUT
-    MAX_RETRIES = Config.REQUEST_TIMEOUT
+    MAX_RETRIES = Config.MAX_RETRIES
+
+    # Operation classes, each with its own timeout and retries
+    SEARCH = "search"
+    BULK = "bulk"
+    ADMIN = "admin"
+    POLICIES = {
+        SEARCH: {"request_timeout": Config.ELASTIC_SEARCH_TIMEOUT, "max_retries": Config.ELASTIC_SEARCH_RETRIES},
+        BULK: {"request_timeout": Config.ELASTIC_BULK_TIMEOUT, "max_retries": Config.ELASTIC_BULK_RETRIES},
+        ADMIN: {"request_timeout": Config.ELASTIC_ADMIN_TIMEOUT, "max_retries": Config.ELASTIC_ADMIN_RETRIES},
+    }
 
     @staticmethod
-    def connect():
+    def connect(operation=None):
+        """
+        Returns the client of this process. Given an operation class, the client uses the timeout and
+        retries of that class; all share the same connection pool.
+        """
         if not ElasticClient.__db:
-            ElasticClient()
+            # Connected on first use, possibly from several threads at once
+            with ElasticClient.__lock:
+                if not ElasticClient.__db:
+                    ElasticClient()
         
+        if operation:
+            return ElasticClient.__db.options(retry_on_timeout=True, **ElasticClient.POLICIES[operation])
         return ElasticClient.__db
         
     
@@ -26,11 +47,7 @@ class ElasticClient:
                     ElasticClient.__db = self.connect_to_local()
             except Exception as e:
                 raise Exception("Error connecting to elasticsearch", e)
-            
-            if not ElasticClient.__db.ping():
-                raise Exception("Could not connect to ElasticSearch. Ping failed")
-            
-            print("elastic server_info:", ElasticClient.__db.info())
+            # Connections are opened on the first request. Reachability is checked by HealthCheck
                 
             
     def connect_to_local(self):
@@ -39,7 +56,8 @@ class ElasticClient:
             "http://localhost:9200",
             max_retries=self.MAX_RETRIES, 
             retry_on_timeout=True,
-            request_timeout=self.REQUEST_TIMEOUT
+            request_timeout=self.REQUEST_TIMEOUT,
+            connections_per_node=Config.ELASTIC_CONNECTIONS_PER_NODE
         )
     
     def connect_to_cloud(self):
@@ -48,9 +66,33 @@ class ElasticClient:
                     basic_auth=(Config.ELASTIC_USER, Config.ELASTIC_PASSWORD),
                     max_retries=Config.MAX_RETRIES, 
                     retry_on_timeout=True,
-                    request_timeout=Config.REQUEST_TIMEOUT                    
+                    request_timeout=Config.REQUEST_TIMEOUT,
+                    connections_per_node=Config.ELASTIC_CONNECTIONS_PER_NODE
                 )
     
     def check_connection(self):
         print("elastic server_info:", self.__db.info())
-        return self.__db.ping()
\ No newline at end of file
+        return self.__db.ping()
+
+    @staticmethod
+    def pool_metrics():
+        """
+        Returns the size and usage of the connection pool of every node. Unlike MongoDB, the
+        transport does not report the time spent waiting for a connection: a pool whose
+        connections are all in use is the sign that requests wait.
+        """
+        if not ElasticClient.__db:
+            return []
+        metrics = []
+        for node in ElasticClient.__db.transport.node_pool.all():
+            pool = getattr(node, "pool", None)
+            if pool is None:
+                continue
+            metrics.append({
+                "node": node.base_url,
+                "size": pool.pool.maxsize,
+                "in_use": pool.pool.maxsize - pool.pool.qsize(),
+                "connections_total": pool.num_connections,
+                "requests_total": pool.num_requests,
+            })
+        return metrics
@@ -1,11 +1,97 @@
 import sys
+import threading
+import time
 
 import pymongo
 
+from pymongo import monitoring
+
 from app.config import Config
+from app.utils.metrics import Metrics
+
+CHECKOUTS = Metrics.counter("mongo_pool_checkouts_total", "Connections checked out of the MongoDB pool")
+CHECKOUT_FAILURES = Metrics.counter(
+    "mongo_pool_checkout_failures_total", "Check outs of the MongoDB pool that failed", ("reason",)
+)
+CHECKOUT_WAIT_SECONDS = Metrics.histogram(
+    "mongo_pool_checkout_wait_seconds", "Seconds waited to check a connection out of the MongoDB pool"
+)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Counts the connections of the pool and the time spent waiting to check one out, for
+    `/api/health`, and exports the check outs to `/metrics`
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self.metrics = {
+            "open": 0,
+            "in_use": 0,
+            "checkouts_total": 0,
+            "checkout_failures_total": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def to_metrics(self):
+        """Returns a copy of the counts, consistent with each other"""
+        with self._lock:
+            return dict(self.metrics)
+
+    def _add(self, **counts):
+        with self._lock:
+            for key, count in counts.items():
+                self.metrics[key] += count
+
+    def connection_check_out_started(self, event):
+        self._started.value = time.monotonic()
+
+    def connection_checked_out(self, event):
+        wait = time.monotonic() - getattr(self._started, "value", time.monotonic())
+        with self._lock:
+            self.metrics["in_use"] += 1
+            self.metrics["checkouts_total"] += 1
+            self.metrics["wait_seconds_total"] += wait
+            self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], wait)
+        CHECKOUTS.inc()
+        CHECKOUT_WAIT_SECONDS.observe(wait)
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures_total=1)
+        CHECKOUT_FAILURES.inc(reason=event.reason)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
 
 class MongoClient:
     __MongoDB = None
+    __lock = threading.Lock()
+    pool_metrics = PoolMetrics()
 
     def __init__(self):
         """
@@ -25,9 +111,16 @@ class MongoClient:
             sys.stdout.flush()
 
             try:
-                client = pymongo.MongoClient(connection_string, maxPoolSize=None)
-                print('mongo server_info: ', client.server_info(), file=sys.stdout)
-                sys.stdout.flush()
+                # Connects in the background. Reachability is checked by HealthCheck
+                client = pymongo.MongoClient(
+                    connection_string,
+                    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                    waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                    event_listeners=[MongoClient.pool_metrics],
+                )
 
                 database = client[Config.MONGO_DB]
 
@@ -50,6 +143,9 @@ class MongoClient:
                 A mongodb instance
         """
         if MongoClient.__MongoDB is None:
-            MongoClient()
+            # Connected on first use, possibly from several threads at once
+            with MongoClient.__lock:
+                if MongoClient.__MongoDB is None:
+                    MongoClient()
 
         return MongoClient.__MongoDB
\ No newline at end of file
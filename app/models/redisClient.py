@@ -0,0 +1,34 @@
+import threading
+
+from app.config import Config
+
+
+class RedisClient:
+    """
+    Client of the Redis server of `SOCKETIO_MESSAGE_QUEUE`, through which the worker processes
+    also share state of their own, e.g. cancellations. Without it the app runs in one process and
+    there is nothing to share.
+    """
+    __client = None
+    __lock = threading.Lock()
+
+    # Seconds to wait for the server before giving up on a command
+    SOCKET_TIMEOUT = 5
+
+    @staticmethod
+    def connect():
+        """Returns the Redis client of this process, or None without `SOCKETIO_MESSAGE_QUEUE`"""
+        if not Config.SOCKETIO_MESSAGE_QUEUE:
+            return None
+        if RedisClient.__client is None:
+            with RedisClient.__lock:
+                if RedisClient.__client is None:
+                    import redis
+
+                    RedisClient.__client = redis.Redis.from_url(
+                        Config.SOCKETIO_MESSAGE_QUEUE,
+                        socket_timeout=RedisClient.SOCKET_TIMEOUT,
+                        socket_connect_timeout=RedisClient.SOCKET_TIMEOUT,
+                        health_check_interval=30,
+                    )
+        return RedisClient.__client
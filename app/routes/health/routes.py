@@ -0,0 +1,22 @@
+from flask import Blueprint
+
+from app.utils.common import Common
+from app.utils.health import HealthCheck
+from app.utils.messages import Messages
+from app.utils.response import Response
+
+health = Blueprint("health", __name__, url_prefix="/api/health")
+
+@health.route("", methods=["GET"])
+def get_health():
+    try:
+        healthy = all(status["healthy"] for status in HealthCheck.status.values())
+        data = {"databases": HealthCheck.status, "pools": HealthCheck.pools()}
+
+        if healthy:
+            return Response.custom_response(data, Messages.OK_HEALTH, True, 200)
+        return Response.custom_response(data, Messages.ERROR_HEALTH, False, 503)
+
+    except Exception as e:
+        Common.exception_details("health.py : get_health", e)
+        return Response.server_error()
@@ -0,0 +1,54 @@
+from flask import Blueprint
+
+from app.services.myDocumentsService import MyDocumentsService
+from app.utils.common import Common
+from app.utils.health import HealthCheck
+from app.utils.metrics import Metrics
+from app.utils.response import Response
+
+metrics = Blueprint("metrics", __name__)
+
+SCHEDULERS = [MyDocumentsService.ingest_scheduler, MyDocumentsService.generation_scheduler]
+ADMISSION_CONTROLLERS = [MyDocumentsService.generation_admission]
+
+# State read when scraped, summed over the workers unless aggregated otherwise
+Metrics.gauge(
+    "scheduler_queued", "Tasks waiting in a scheduler", ("scheduler",),
+    lambda: [((scheduler.name,), scheduler.to_metrics()["queued"]) for scheduler in SCHEDULERS]
+)
+Metrics.gauge(
+    "scheduler_in_flight", "Tasks running in a scheduler", ("scheduler",),
+    lambda: [((scheduler.name,), scheduler.to_metrics()["in_flight"]) for scheduler in SCHEDULERS]
+)
+Metrics.gauge(
+    "admission_active", "Requests admitted and running", ("controller",),
+    lambda: [((controller.name,), controller.active) for controller in ADMISSION_CONTROLLERS]
+)
+Metrics.gauge(
+    "admission_limit", "Requests that may run at once, lower when memory is short", ("controller",),
+    lambda: [((controller.name,), controller.to_metrics()["limit"]) for controller in ADMISSION_CONTROLLERS]
+)
+Metrics.gauge(
+    "pool_connections_in_use", "Connections checked out of the pool of a database", ("database", "node"),
+    lambda: [
+        ((HealthCheck.ELASTIC, pool["node"]), pool["in_use"]) for pool in HealthCheck.pools()[HealthCheck.ELASTIC]
+    ] + [((HealthCheck.MONGO, ""), HealthCheck.pools()[HealthCheck.MONGO]["in_use"])]
+)
+Metrics.gauge(
+    "pool_connections_open", "Connections open in the pool of a database", ("database",),
+    lambda: [((HealthCheck.MONGO,), HealthCheck.pools()[HealthCheck.MONGO]["open"])]
+)
+Metrics.gauge(
+    "database_healthy", "Whether a database was reachable at the last health check of every worker", ("database",),
+    lambda: [((name,), int(bool(status["healthy"]))) for name, status in HealthCheck.status.items()],
+    aggregate="min"
+)
+
+@metrics.route("/metrics", methods=["GET"])
+def get_metrics():
+    try:
+        return Metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    except Exception as e:
+        Common.exception_details("metrics.py : get_metrics", e)
+        return Response.server_error()
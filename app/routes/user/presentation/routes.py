@@ -2,9 +2,13 @@ from flask import Blueprint, request, send_file
 
 from app.services.elasticService import ElasticService
 from app.services.myDocumentsService import MyDocumentsService
+from app.services.uploadService import UploadError, UploadService
+from app.utils.admission import AdmissionRejected
+from app.utils.cancellation import Cancellations, Cancelled
 from app.utils.common import Common
 from app.utils.messages import Messages
 from app.utils.response import Response
+from app.utils.socket import create_socket_token
 
 presentation = Blueprint("presentation", __name__, url_prefix="/api/presentation")
 TEST_USER = {"_id": "65700cee327beccab31fc13b"}
@@ -15,12 +19,13 @@ def upload_documents():
         logged_in_user = TEST_USER
         files = request.files.getlist("files[]")
         path = request.form.get("path", "/ppt")
+        replace = request.form.get("replace", "false").lower() == "true"
 
         if not files:
             return Response.missing_required_parameter("Files")
 
         # Upload files
-        MyDocumentsService.upload_documents(logged_in_user, files, path)
+        MyDocumentsService.upload_documents(logged_in_user, files, path, replace)
         
         return Response.custom_response([], Messages.OK_FILE_UPLOAD_STARTED, True, 200)
 
@@ -31,6 +36,132 @@ def upload_documents():
 
 
 
+@presentation.route("/uploads", methods=["POST"])
+def create_upload():
+    try:
+        logged_in_user = TEST_USER
+        request_body = request.get_json(silent=True) or {}
+
+        for param in ("filename", "size"):
+            if param not in request_body:
+                return Response.missing_required_parameter(param)
+
+        upload = UploadService.create_upload(
+            logged_in_user,
+            filename=str(request_body["filename"]),
+            size=parse_int(request_body["size"], Messages.ERROR_UPLOAD_SIZE),
+            path=request_body.get("path", "/ppt"),
+            replace=bool(request_body.get("replace", False)),
+            )
+        return Response.custom_response(upload, Messages.OK_UPLOAD_CREATED, True, 201)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        Common.exception_details("mydocuments.py : create_upload", e)
+        return Response.server_error()
+
+
+@presentation.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    try:
+        logged_in_user = TEST_USER
+
+        upload = UploadService.get_upload(logged_in_user, upload_id)
+        return Response.custom_response(upload, Messages.OK_UPLOAD_RETRIEVAL, True, 200)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        Common.exception_details("mydocuments.py : get_upload", e)
+        return Response.server_error()
+
+
+@presentation.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    try:
+        logged_in_user = TEST_USER
+
+        offset = request.headers.get("Upload-Offset", request.args.get("offset"))
+        if offset is None:
+            return Response.missing_required_parameter("Upload-Offset")
+
+        # The body is streamed to the blob store, never held in memory
+        upload = UploadService.append_chunk(
+            logged_in_user, upload_id, parse_int(offset, Messages.ERROR_UPLOAD_OFFSET), request.content_length,
+            request.stream
+            )
+        return Response.custom_response(upload, Messages.OK_UPLOAD_CHUNK, True, 200)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        Common.exception_details("mydocuments.py : upload_chunk", e)
+        return Response.server_error()
+
+
+@presentation.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    try:
+        logged_in_user = TEST_USER
+
+        document_id = UploadService.finalize_upload(logged_in_user, upload_id)
+        return Response.custom_response(
+            {"documentId": str(document_id)}, Messages.OK_UPLOAD_FINALIZED, True, 200
+            )
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        Common.exception_details("mydocuments.py : finalize_upload", e)
+        return Response.server_error()
+
+
+@presentation.route("/uploads/<upload_id>", methods=["DELETE"])
+def delete_upload(upload_id):
+    try:
+        logged_in_user = TEST_USER
+
+        UploadService.delete_upload(logged_in_user, upload_id)
+        return Response.custom_response([], Messages.OK_UPLOAD_DELETED, True, 200)
+
+    except UploadError as e:
+        return upload_error_response(e)
+    except Exception as e:
+        Common.exception_details("mydocuments.py : delete_upload", e)
+        return Response.server_error()
+
+
+def parse_int(value, message):
+    """Returns `value` as an integer, refusing the request with `message` if it is not one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise UploadError(message, 400)
+
+
+def upload_error_response(error):
+    """Responds with the error and, when known, the current state of the upload to resume from"""
+    data = UploadService.to_response(error.upload) if error.upload else []
+    response, status = Response.custom_response(data, error.message, False, error.status)
+    if error.upload:
+        response.headers["Upload-Offset"] = str(error.upload["offset"])
+    return response, status
+
+
+@presentation.route("/socket-token", methods=["GET"])
+def socket_token():
+    try:
+        logged_in_user = TEST_USER
+
+        token = create_socket_token(logged_in_user["_id"])
+        return Response.custom_response({"token": token}, Messages.OK_SOCKET_TOKEN, True, 200)
+
+    except Exception as e:
+        Common.exception_details("mydocuments.py : socket_token", e)
+        return Response.server_error()
+
+
 @presentation.route("/download/<ppt_name>", methods=["GET"])
 def download_documents():
     try:
@@ -52,16 +183,15 @@ def search_and_generate():
             return Response.missing_required_parameter("query")
         query = str(request_params.get("query", ""))    
 
-        results = ElasticService().search_in_index_all(
-            query=query, 
-            user_id=logged_in_user["_id"]
-            )
-        
-        file_path = MyDocumentsService().generate_pptx_from_search(
-            elastic_results=results, 
-            user_id=logged_in_user["_id"], 
-            query=query
-            )
+        # Cancels the previous generation of the user, whose result nobody waits for anymore
+        cancellation = Cancellations.start(logged_in_user["_id"], "generation")
+        try:
+            # Waits for its turn among the generations of all users
+            file_path = MyDocumentsService.generation_scheduler.run(
+                logged_in_user["_id"], generate_from_search, query, logged_in_user["_id"], cancellation
+                )
+        finally:
+            Cancellations.finish(cancellation)
         if not file_path:
             return Response.server_error()
         
@@ -71,11 +201,61 @@ def search_and_generate():
             file_path, as_attachment=True, download_name=download_name
         )
 
+    except AdmissionRejected as e:
+        return Response.server_busy(e.status, e.retry_after)
+    except Cancelled as e:
+        return Response.custom_response({"reason": str(e)}, Messages.ERROR_GENERATION_CANCELLED, False, 409)
     except Exception as e:
         Common.exception_details("mydocuments.py : search_and_generate", e)
         return Response.server_error()
 
 
+def generate_from_search(query, user_id, cancellation=None):
+    """Generates a presentation of the slides found by `query`"""
+    results = ElasticService().search_in_index_all(
+        query=query, 
+        user_id=user_id,
+        cancellation=cancellation
+        )
+    
+    return MyDocumentsService().generate_pptx_from_search(
+        elastic_results=results, 
+        user_id=user_id, 
+        query=query,
+        cancellation=cancellation
+        )
+
+
+@presentation.route("/search/generate/cancel", methods=["POST"])
+def cancel_generation():
+    try:
+        logged_in_user = TEST_USER
+        job_id = request.args.get("job_id")
+
+        job_ids = Cancellations.cancel(logged_in_user["_id"], "generation", job_id)
+        return Response.custom_response({"jobIds": job_ids}, Messages.OK_GENERATION_CANCELLED, True, 200)
+
+    except Exception as e:
+        Common.exception_details("mydocuments.py : cancel_generation", e)
+        return Response.server_error()
+
+
+@presentation.route("/queue", methods=["GET"])
+def get_queue():
+    try:
+        logged_in_user = TEST_USER
+
+        data = {
+            "ingest": MyDocumentsService.ingest_scheduler.user_state(logged_in_user["_id"]),
+            "generation": MyDocumentsService.generation_scheduler.user_state(logged_in_user["_id"]),
+        }
+        return Response.custom_response(data, Messages.OK_QUEUE_RETRIEVAL, True, 200)
+
+    except Exception as e:
+        Common.exception_details("mydocuments.py : get_queue", e)
+        return Response.server_error()
+
+
 @presentation.route("/search", methods=["GET"])
 def search_documents():
     try:
@@ -86,6 +266,14 @@ def search_documents():
             return Response.missing_required_parameter("query")
         query = str(request_params.get("query", ""))    
 
+        # Stream all hits as NDJSON while they are fetched
+        if request_params.get("stream", "false").lower() == "true":
+            hits = ElasticService().iter_search(
+                query=query, 
+                user_id=logged_in_user["_id"]
+                )
+            return Response.ndjson_response(item['_source'] for item in hits)
+
         resp = ElasticService().search_in_index(
             query=query, 
             user_id=logged_in_user["_id"]
@@ -9,79 +9,125 @@ from elasticsearch.exceptions import BadRequestError, NotFoundError
 
 from app.config import Config
 from app.models.elasticClient import ElasticClient
+from app.utils.bootstrap import Bootstrap
+from app.utils.cache import TTLCache
+from app.utils.health import HealthCheck
+from app.utils.metrics import COUNT_BUCKETS, Metrics
 from app.utils.presentationmanager import PresentationManager
 
+SEARCH_SECONDS = Metrics.histogram("elastic_search_seconds", "Seconds per search request to Elasticsearch")
+SEARCH_HITS = Metrics.histogram(
+    "elastic_search_hits", "Hits fetched per search for a generated presentation", buckets=COUNT_BUCKETS
+)
+BULK_SECONDS = Metrics.histogram("elastic_bulk_seconds", "Seconds per bulk indexing of a batch of slides")
+
+
 class ElasticService:
 
     INDEX = Config.ELASTIC_INDEX
     REQUEST_TIMEOUT = Config.REQUEST_TIMEOUT
-    MAX_RETRIES = Config.REQUEST_TIMEOUT
+    MAX_RETRIES = Config.MAX_RETRIES
     BATCH = 1000
     MAX_RESULT = 1000
+    # Deepest hit reachable with from/size paging (`index.max_result_window`)
+    MAX_RESULT_WINDOW = 10000
+    # Fields needed to copy a slide found by search into a generated presentation
+    GENERATE_FIELDS = ["virtualFileName", "root", "slide_index"]
     pp = pprint.PrettyPrinter(depth=6)  
 
-    def search_in_index(self, query, user_id, index=None, from_i=0, size=10):
-        es = ElasticClient.connect()
+    # Whether each index requires routing, checked again after `ttl` seconds to see `migrate-routing`
+    routed_indexes = TTLCache("elastic_routed_indexes", maxsize=16, ttl=60)
+
+    def search_in_index(self, query, user_id, index=None, from_i=0, size=10, source=True, highlight=True):
+        es = ElasticClient.connect(ElasticClient.SEARCH)
         index = index or self.INDEX
-        from_i = 0
 
         try:
-            resp = es.search(
-                        index=index,
-                        size=size,
-                        from_=from_i,
-                        query={"bool": {
-                            "must": [
-                                {"match" : {
-                                    "content": {
-                                        "query": query,
-                                        "fuzziness": "AUTO"
-                                    }                        
-                                }},
-                                {"term": {
-                                    "user_id": str(user_id)
-                                }}                                    
-                            ]
-                        }},
-                        highlight={"fields": {
-                            "content": {}
+            with SEARCH_SECONDS.time():
+                resp = es.search(
+                            index=index,
+                            routing=self._routing(index, user_id),
+                            size=size,
+                            from_=from_i,
+                            query={"bool": {
+                                "must": [
+                                    {"match" : {
+                                        "content": {
+                                            "query": query,
+                                            "fuzziness": "AUTO"
+                                        }                        
+                                    }},
+                                    {"term": {
+                                        "user_id": str(user_id)
+                                    }}                                    
+                                ]
                             }},
-                    )
+                            highlight={"fields": {
+                                "content": {}
+                                }} if highlight else None,
+                            source=source,
+                        )
         except BadRequestError as e:
             print(f"{e} at {index}")
             return None
         
         return resp['hits']
     
-    def search_in_index_all(self, query, user_id, index=None):
+    def search_in_index_all(self, query, user_id, index=None, cancellation=None):
+        hits = self.iter_search(
+            query=query,
+            user_id=user_id,
+            index=index,
+            source=self.GENERATE_FIELDS,
+            highlight=False,
+            cancellation=cancellation
+        )
+        hits = [item['_source'] for item in hits]
+        SEARCH_HITS.observe(len(hits))
+        return hits
+
+    def iter_search(self, query, user_id, index=None, page_size=None, source=True, highlight=True, cancellation=None):
+        """ 
+        Yields the hits of a search one by one, fetching the next page of size `page_size` only
+        once the previous one has been consumed. Stops at `MAX_RESULT_WINDOW` hits, or with
+        `Cancelled` before the next page once `cancellation` is cancelled.
+        """
+        page_size = page_size or self.MAX_RESULT
         from_i = 0
-        results = []
-        while True:
+        while from_i < self.MAX_RESULT_WINDOW:
+            if cancellation:
+                cancellation.raise_if_cancelled()
             hits = self.search_in_index(
                 query=query,
                 user_id=user_id,
                 index=index,
-                from_i=0,
-                size=self.MAX_RESULT
+                from_i=from_i,
+                size=min(page_size, self.MAX_RESULT_WINDOW - from_i),
+                source=source,
+                highlight=highlight
             )
-            total = hits['total']['value']
-            batch_results = [item['_source'] for item in hits['hits']]
-            results.extend(batch_results)
-            from_i += self.MAX_RESULT
-            if from_i >= total:
-                break
-        return results
+            if not hits:
+                return
+            yield from hits['hits']
+            from_i += len(hits['hits'])
+            if not hits['hits'] or from_i >= hits['total']['value']:
+                return
 
 
 
     def index_single(self, data, index=None):
-        es = ElasticClient.connect()
+        es = ElasticClient.connect(ElasticClient.BULK)
         index = index or self.INDEX
         # Get only relevant fields from document
         doc = self._strip_document(data)
         if not doc:
             return []        
-        resp = es.index(index=index, document=doc) 
+        resp = es.index(
+            index=index, 
+            id=self._doc_id(doc), 
+            routing=self._routing(index, doc["user_id"]), 
+            document=doc
+            ) 
         success_count = resp['_shards']['successful']
         success = True if success_count >= 1 else False
         if not success:
@@ -93,16 +139,17 @@ class ElasticService:
         """ Index documents in `index` in bulk in batches of size `BATCH`"""
 
         try:
-            es = ElasticClient.connect()
-            if not es.ping():
+            # State of the last background check, instead of a ping before every bulk
+            if HealthCheck.is_healthy(HealthCheck.ELASTIC) is False:
                 raise Exception("Could not connect to ElasticSearch")
+            es = ElasticClient.connect(ElasticClient.BULK)
             
             index = index or self.INDEX
             print(f"Indexing to {index}")
+            routed = self._is_routed(index)
             requests = []
             
             # Make list of requests
-            total = len(docs)
             pbar = tqdm(docs)
             for doc in pbar:
                 pbar.set_description(doc["title"])     
@@ -111,42 +158,145 @@ class ElasticService:
                 request = doc
                 request["_op_type"] = "index"
                 request["_index"] = index
+                request["_id"] = self._doc_id(doc)
+                if routed:
+                    request["_routing"] = str(doc["user_id"])
                 requests.append(request)
             
-            success = 0
-            errors = []
-            # Index docs in batches of size BATCH
-            for batch_request in self._chunks(requests, n=self.BATCH):
-                try:
-                    count, e = bulk(client=es.options(
-                                        request_timeout=self.REQUEST_TIMEOUT,
-                                        max_retries=self.MAX_RETRIES, 
-                                        retry_on_timeout=True), 
-                                    actions=batch_request, 
-                                    request_timeout=self.REQUEST_TIMEOUT
-                                    )
-                
-                except BulkIndexError as e:
-                    # Print errors in detail
-                    traceback.print_exc()
-                    for item in e.errors:
-                        for key in item['index']:
-                            if key != "data":
-                                print(item['index'][key])
-                        print("\n")
-                    # Set number of successfully indexed documents        
-                    count = total - len(e.errors)
-                    errors.extend(e.errors)
-                
-                # Update number of indexed docs
-                success += count
-
-            return success, errors
+            return self._bulk(es, requests)
         
         except Exception as e:
             traceback.print_exc()
             return 0, []
 
+    def reindex_changed(self, docs, previous_slides, virtual_filename, user_id, index=None):
+        """ 
+        Re-index a re-uploaded presentation, touching only the slides that changed.
+
+        `docs` are the slide documents of the new version and `previous_slides` the
+        `slide_id`, `slide_index` and `content_hash` of each slide of the old version.
+        New or edited slides are indexed, removed slides are deleted and slides that
+        only moved get a partial update of `slide_index`. Without `previous_slides`
+        (files uploaded before hashes were stored) all old slides are deleted and the
+        whole presentation is indexed again.
+        """
+
+        try:
+            es = ElasticClient.connect(ElasticClient.BULK)
+            index = index or self.INDEX
+            routing = self._routing(index, user_id)
+
+            if not previous_slides:
+                es.options(ignore_status=[400, 404]).delete_by_query(
+                    index=index,
+                    routing=routing,
+                    query={"term": {"virtualFileName": virtual_filename}},
+                    refresh=True
+                )
+                return self.index_batch(docs, index=index)
+
+            previous = {slide["slide_id"]: slide for slide in previous_slides}
+            current_ids = set()
+            requests = []
+
+            for doc in docs:
+                current_ids.add(doc["slide_id"])
+                old = previous.get(doc["slide_id"])
+                if old and old.get("content_hash") == doc["content_hash"]:
+                    if old["slide_index"] != doc["slide_index"]:
+                        requests.append({
+                            "_op_type": "update",
+                            "_index": index,
+                            "_id": self._doc_id(doc),
+                            **self._routing_action(routing),
+                            "doc": {"slide_index": doc["slide_index"]},
+                        })
+                    continue
+                request = doc
+                request["_op_type"] = "index"
+                request["_index"] = index
+                request["_id"] = self._doc_id(doc)
+                request.update(self._routing_action(routing))
+                requests.append(request)
+
+            for slide_id in previous.keys() - current_ids:
+                requests.append({
+                    "_op_type": "delete",
+                    "_index": index,
+                    "_id": self._doc_id({
+                        "virtualFileName": virtual_filename, 
+                        "slide_id": slide_id
+                        }),
+                    **self._routing_action(routing),
+                })
+
+            print(f"Re-indexing {len(requests)} of {len(docs)} slides in {index}")
+            return self._bulk(es, requests)
+
+        except Exception as e:
+            traceback.print_exc()
+            return 0, []
+
+    def _is_routed(self, index):
+        """
+        Whether the slides in `index` are routed by `user_id`. An index created before routing and
+        not migrated yet has every slide on the default shard, where routed searches miss them.
+        """
+        routed = self.routed_indexes.get(index)
+        if routed is None:
+            try:
+                routed = Bootstrap.is_routed(ElasticClient.connect(ElasticClient.ADMIN), index)
+            except NotFoundError:
+                # Created with routing from the index template on first write
+                routed = True
+            if not routed:
+                print(f"⚠️ Index {index} is not routed, searching all shards until `migrate-routing` is run")
+            self.routed_indexes.set(index, routed)
+        return routed
+
+    def _routing(self, index, user_id):
+        """Returns the routing of the slides of a user in `index`, or None if the index is not routed"""
+        return str(user_id) if self._is_routed(index) else None
+
+    @staticmethod
+    def _routing_action(routing):
+        """Returns the routing field of a bulk action, if any"""
+        return {"_routing": routing} if routing is not None else {}
+
+    def _bulk(self, es, requests):
+        """ Send `requests` to ElasticSearch in batches of size `BATCH` """
+        success = 0
+        errors = []
+        # Index docs in batches of size BATCH
+        for batch_request in self._chunks(requests, n=self.BATCH):
+            try:
+                # Timeout and retries of the bulk operation class, set on `es`
+                with BULK_SECONDS.time():
+                    count, e = bulk(client=es, actions=batch_request)
+            
+            except BulkIndexError as e:
+                # Print errors in detail
+                traceback.print_exc()
+                for item in e.errors:
+                    for op in item.values():
+                        for key in op:
+                            if key != "data":
+                                print(op[key])
+                    print("\n")
+                # Set number of successfully indexed documents        
+                count = len(batch_request) - len(e.errors)
+                errors.extend(e.errors)
+            
+            # Update number of indexed docs
+            success += count
+
+        return success, errors
+
+    @staticmethod
+    def _doc_id(doc):
+        """ Stable id of a slide document so that re-indexing a slide overwrites it """
+        return f"{doc['virtualFileName']}_{doc['slide_id']}"
+
     @staticmethod
     def _chunks(data, n):
         """ Generates chunks of given list """
@@ -161,6 +311,7 @@ class ElasticService:
             'content',
             'slide_id',
             'slide_index',
+            'content_hash',
             'virtualFileName',
             'originalFileName',
             'root'
@@ -1,30 +1,98 @@
-import concurrent.futures
+import copy
 import datetime
 import os
 import pprint
 import uuid
 
-from bson import ObjectId
+from bson import Binary, ObjectId
 from pathlib import Path
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from app.config import Config
 from app.models.mongoClient import MongoClient
 from app.services.elasticService import ElasticService
+from app.utils.admission import AdmissionController
+from app.utils.artifactcache import ArtifactCache
+from app.utils.cancellation import Cancelled
+from app.utils.blobstore import BlobStore
+from app.utils.bootstrap import Bootstrap
+from app.utils.cache import TTLCache
+from app.utils.invalidation import InvalidationBus, InvalidationEvent
+from app.utils.metrics import BYTES_BUCKETS, COUNT_BUCKETS, Metrics
 from app.utils.common import Common
 from app.utils.pipeline import PipelineStages
 from app.utils.presentationmanager import PresentationManager
+from app.utils.progress import ProgressChannel
+from app.utils.reaper import GeneratedDeckReaper
+from app.utils.scheduler import FairScheduler
+from app.utils.slidebundle import SlideBundle
 from app.utils.socket import socket_error, socket_info, socket_success
 
 pp = pprint.PrettyPrinter(depth=6) 
 
+INGEST_SECONDS = Metrics.histogram("ingest_stage_seconds", "Seconds per stage of the ingest of uploaded files", ("stage",))
+GENERATION_SECONDS = Metrics.histogram("generation_seconds", "Seconds to generate a presentation from search results")
+GENERATION_STAGE_SECONDS = Metrics.histogram(
+	"generation_stage_seconds", "Seconds per stage of the generation of a presentation", ("stage",)
+)
+GENERATION_DECKS = Metrics.histogram(
+	"generation_decks_loaded", "Source presentations per generated presentation", buckets=COUNT_BUCKETS
+)
+GENERATION_OUTPUT_BYTES = Metrics.histogram(
+	"generation_output_bytes", "Size of generated presentations", buckets=BYTES_BUCKETS
+)
+
 class MyDocumentsService:  
 
+	# Number of names tried before giving up on finding a unique filename
+	MAX_FILENAME_ATTEMPTS = 100
+
+	# Fields of a record never returned by metadata reads
+	EXCLUDED_FIELDS = {"embeddings": 0, "highlightsSummary": 0, "slides": 0, "description": 0}
+
+	# Records by ("_id", file_id) and file ids by ("virtualFileName", virtual_name)
+	metadata_cache = TTLCache(
+		"file_metadata", 
+		maxsize=Config.METADATA_CACHE_SIZE, 
+		ttl=Config.METADATA_CACHE_TTL
+	)
+
+	# Whether the unique index on file names exists, checked at most once a minute
+	unique_filename_index = TTLCache("unique_filename_index", maxsize=1, ttl=60)
+
+	# Parsing of uploaded files, shared fairly between users
+	ingest_scheduler = FairScheduler(
+		"ingest",
+		workers=Config.INGEST_WORKERS,
+		user_max_in_flight=Config.INGEST_USER_MAX_IN_FLIGHT
+	)
+
+	# Generations running at once in this process, fewer when memory is short. Only the workers of
+	# `generation_scheduler` wait to be admitted, so at most GENERATION_MAX_CONCURRENCY wait here;
+	# requests beyond them wait in the queue of the scheduler, bounded by GENERATION_MAX_QUEUE
+	generation_admission = AdmissionController(
+		"generation",
+		max_concurrency=Config.GENERATION_MAX_CONCURRENCY,
+		max_queue=Config.GENERATION_MAX_CONCURRENCY,
+		queue_timeout=Config.GENERATION_QUEUE_TIMEOUT,
+		memory_per_request=Config.GENERATION_MEMORY_PER_REQUEST,
+		memory_reserve=Config.GENERATION_MEMORY_RESERVE
+	)
+	generation_scheduler = FairScheduler(
+		"generation",
+		workers=Config.GENERATION_MAX_CONCURRENCY,
+		user_max_in_flight=Config.GENERATION_USER_MAX_IN_FLIGHT,
+		max_queue=Config.GENERATION_MAX_QUEUE,
+		queue_timeout=Config.GENERATION_QUEUE_TIMEOUT,
+		admission=generation_admission
+	)
+
 	@staticmethod
-	def upload_document(logged_in_user, file, path):
+	def upload_document(logged_in_user, file, path, replace=False):
 		"""
 		The `upload_document` function uploads a file to a specified path, parses and inserts the
-		document into a database, updates the virtual filename, and saves the file on disk or a cloud
-		bucket.
+		document into a database, and saves the file on disk or a cloud bucket.
 		
 		Args:
 		  logged_in_user: The logged_in_user parameter is an object that represents the currently logged
@@ -34,83 +102,76 @@ class MyDocumentsService:
 		  path: The `path` parameter represents the directory path where the document should be
 		uploaded. It is a string that specifies the location within the file system or cloud storage
 		where the document should be saved.
+		  replace: If True and a file with the same name already exists in `path`, the existing
+		document is updated in place and only its changed slides are re-indexed.
 		
 		Returns:
 		  a tuple containing two values: 1) an integer indicating the success or failure of the upload
 		process (1 for success, 0 for failure), and 2) the inserted ID of the document in the database.
 		"""
-		user_id = str(logged_in_user["_id"])
-		if not user_id:
-			raise Exception("User ID is missing")
-		
-		filename = Path(file.filename)
-		new_path = Path(user_id) / Path(path)
-		file_extension = filename.suffix.strip(".")
-		new_path = str(new_path)
-		print(f"New path: {new_path}")
-		print(f"File: {filename}")
-		print(f"File extension: {file_extension}")
-
-		if file_extension not in ["pptx"]:
-			socket_info(
-				user_id,
-				f"Skipping upload of {filename} due to incompatible file format",
-			)
-			return 0, None
-
-		# Parse and insert document into database
-		inserted_id = MyDocumentsService().parse_document(
-			logged_in_user, file, new_path
+		# Parse document
+		parsed_document = MyDocumentsService.ingest_scheduler.run(
+			logged_in_user["_id"], MyDocumentsService().parse_document, logged_in_user, file, path, replace
 		)
-
-		if not inserted_id:
-			socket_error(
-				user_id,
-				f"Failed to save {filename} to database due to some error...",
-			)
+		if not parsed_document:
 			return 0, None
 
-		# Update the virtual filename of the file based on its inserted ID
-		update_response = MyDocumentsService().update_virtual_filename(
-			inserted_id, file_extension
+		# Insert document into database and save file on disk or cloud bucket
+		inserted_ids = MyDocumentsService().store_documents(
+			logged_in_user, [parsed_document], path
 		)
-
-		# Save file on disk or cloud bucket
-		MyDocumentsService().save_file(file, inserted_id, logged_in_user, path)
+		if not inserted_ids:
+			return 0, None
 		
-		return 1, inserted_id           
+		return 1, inserted_ids[0]           
 
 
 	@staticmethod
-	def upload_documents(logged_in_user, files, path):
+	def upload_documents(logged_in_user, files, path, replace=False):
 		"""
-		The function `upload_documents` uploads multiple files to a specified path, using a
-		ThreadPoolExecutor to execute the upload process concurrently, and updates the document
-		vectorstore for each successfully uploaded file.
+		The function `upload_documents` uploads multiple files to a specified path. Files are parsed
+		concurrently by `ingest_scheduler`, which shares its threads fairly with the uploads of other
+		users, then all new documents are written to the database in a single bulk insert and their
+		slides indexed in a single bulk request.
 		
 		Args:
 		  logged_in_user: The logged_in_user parameter is the user object of the currently logged in
 		user. It contains information about the user, such as their ID, name, email, etc.
 		  files: The `files` parameter is a list of files that you want to upload. Each file should be
-		in a format that can be processed by the `upload_document` method of the `MyDocumentsService`
+		in a format that can be processed by the `parse_document` method of the `MyDocumentsService`
 		class.
 		  path: The `path` parameter is the directory path where the documents will be uploaded to.
+		  replace: If True, files that already exist in `path` are replaced by the new version.
 		"""
 		user_id = str(logged_in_user["_id"])
 		print("User:", user_id)
+		progress = ProgressChannel.start(user_id, "upload", len(files), "parsing")
 		
-		# Create a ThreadPoolExecutor with a specified number of threads (e.g., 4)
-		with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-			# Submit the function with arguments to the thread pool
-			results = [executor.submit(MyDocumentsService().upload_document, logged_in_user, file, path) for file in files]
+		# Queue every file for parsing, taking turns with the uploads of other users
+		results = [
+			MyDocumentsService.ingest_scheduler.submit(
+				user_id, MyDocumentsService().parse_document, logged_in_user, file, path, replace
+			)
+			for file in files
+		]
+		for result in results:
+			result.add_done_callback(lambda _: progress.advance())
 		
-		# Getting function returns from all function calls from threadpool
-		outputs = [result.result() for result in results]
+		# Getting function returns from all parsed files
+		parsed_documents = [result.result() for result in results]
+		parsed_documents = [document for document in parsed_documents if document]
+
 		# All document _ids inserted
-		uploaded_documents_ids = [output[1] for output in outputs if output[1]]
+		progress.update(stage="storing")
+		uploaded_documents_ids = MyDocumentsService().store_documents(
+			logged_in_user, parsed_documents, path
+		)
 		# Number of documents successfully uploaded
-		uploaded_documents_num = sum([output[0] for output in outputs])
-		
+		uploaded_documents_num = len(uploaded_documents_ids)
+		progress.finish(
+			f"Uploaded {uploaded_documents_num} of {len(files)} documents",
+			failed=uploaded_documents_num == 0,
+		)
 		
 		# Calculating number of documents successfully uploaded
 		if uploaded_documents_num > 0:
@@ -118,6 +179,69 @@ class MyDocumentsService:
 				user_id, f"Successfully uploaded {uploaded_documents_num} documents!"
 			)
 
+	@Metrics.timed(INGEST_SECONDS, stage="store")
+	def store_documents(self, logged_in_user, parsed_documents, path):
+		"""
+		The function `store_documents` writes documents returned by `parse_document` to the database,
+		indexes their slides and saves their files. New documents already carry their `_id` and
+		`virtualFileName`, so they are written with one bulk insert and their save path is known
+		without reading them back.
+
+		Args:
+		  logged_in_user: The user object of the currently logged in user.
+		  parsed_documents: List of documents returned by `parse_document`.
+		  path: The directory path where the files are saved.
+
+		Returns:
+		  list of the ids of the documents stored.
+		"""
+		user_id = str(logged_in_user["_id"])
+
+		new_documents = [document for document in parsed_documents if not document["existing"]]
+		stored_documents = MyDocumentsService._insert_my_documents(new_documents)
+		MyDocumentsService._save_descriptions(stored_documents)
+		for document in stored_documents:
+			MyDocumentsService._cache_file(document["record"])
+
+		# Index slides of all new documents in one bulk request
+		docs = []
+		for document in stored_documents:
+			record = document["record"]
+			docs.extend(MyDocumentsService._create_my_ppt_index_struct(
+				slide_content=document["slides"],
+				filename=record["originalFileName"],
+				user_id=logged_in_user["_id"],
+				root=record["root"],
+				virtual_filename=record["virtualFileName"]
+			))
+		if docs:
+			with INGEST_SECONDS.time(stage="index"):
+				success, errors = ElasticService().index_batch(docs=docs)
+			print(f"\nIndexed: {success} documents \nErrors: {len(errors)}")
+
+		# Replaced documents are updated in place
+		for document in parsed_documents:
+			if document["existing"]:
+				try:
+					self._reparse_pptx(document, logged_in_user)
+					stored_documents.append(document)
+				except Exception as e:
+					Common.exception_details("myDocumentsService.store_documents", e)
+
+		stored = set(id(document) for document in stored_documents)
+		for document in parsed_documents:
+			if id(document) not in stored:
+				socket_error(
+					user_id,
+					f"Failed to save {document['file'].filename} to database due to some error...",
+				)
+
+		# Save file in the blob store
+		for document in stored_documents:
+			self._save_file(document["file"], document["record"]["virtualFileName"])
+
+		return [str(document["record"]["_id"]) for document in stored_documents]
+
 	@staticmethod
 	def get_file_save_path(filename, user, path):
 		"""
@@ -134,26 +258,21 @@ class MyDocumentsService:
         Returns:
           the file save path.
         """
+		file_save_path = BlobStore.connect().resolve_path(filename)
+		if file_save_path:
+			return file_save_path
+
+		# Files saved before the blob store are in the folder of the user who created them
 		# key = '_id'
 		# user_id = user[key]
-		file = MyDocumentsService().get_file_by_virtual_name(filename)
+		file = MyDocumentsService().get_file_by_virtual_name(filename, ["createdBy", "root"])
 		file_created_by = file["createdBy"]["_id"]
 		# print(
 		#     f"File {filename} is created by {file_created_by} and the user is {user}. Path is {path}!"
 		# )
 		# Check if file is created by user
 		if str(user) == str(file_created_by):
-			user_folder_path = os.path.join(Config.USER_FOLDER, str(user))
-			new_path = path[1:]
-			# print("NEW PATH : " + new_path)
-			if path != None:
-				user_folder_path = os.path.join(user_folder_path, new_path)
-				# print("USER FOLDER : ", user_folder_path)
-			# if(folder_name != None):
-			#     folder_save_path = os.path.join(user_folder_path, folder_name)
-			# else:
-			#     folder_save_path = user_folder_path
-			file_save_path = os.path.join(user_folder_path, filename)
+			file_save_path = MyDocumentsService._get_user_file_path(user, path, filename)
 			# print("File save path to return : ", file_save_path)
 		# If not then the file is shared
 		else:
@@ -169,41 +288,82 @@ class MyDocumentsService:
 			file_save_path = os.path.join(user_folder_path, filename)
 		return file_save_path
 
+	@staticmethod
+	def get_stored_file_path(virtual_filename, user_id, root):
+		"""
+		Returns the path of a stored file from its virtual filename and the user and folder it was
+		uploaded to, as found in search results. Needs no database lookup.
+		"""
+		file_path = BlobStore.connect().resolve_path(virtual_filename)
+		if file_path:
+			return file_path
+		return MyDocumentsService._get_user_file_path(user_id, root, virtual_filename)
 
-	def parse_document(self, logged_in_user, file, new_path):
+	@staticmethod
+	def _get_user_file_path(user_id, path, filename):
+		"""
+		Returns the path of `filename` in the folder `path` of the user who created it. Needs no
+		database lookup.
 		"""
-		The function `parse_document` takes in a logged-in user, a file, and a new path, and based on
-		the file extension, it calls different parsing functions to process the file and returns an
-		inserted ID.
+		user_folder_path = os.path.join(Config.USER_FOLDER, str(user_id))
+		if path != None:
+			user_folder_path = os.path.join(user_folder_path, path[1:])
+		return os.path.join(user_folder_path, filename)
+
+
+	@Metrics.timed(INGEST_SECONDS, stage="parse")
+	def parse_document(self, logged_in_user, file, path, replace=False):
+		"""
+		The function `parse_document` takes in a logged-in user, a file, and a path, and based on
+		the file extension, it calls different parsing functions to process the file. Nothing is
+		written to the database; the result is passed to `store_documents`.
 
 		Args:
 		  logged_in_user: The logged_in_user parameter is the user who is currently logged in and
 		performing the document parsing operation.
 		  file: The `file` parameter is the file object that represents the document to be parsed. It is
 		passed to the `parse_document` method as an argument.
-		  new_path: The `new_path` parameter is the path where the parsed document will be saved. It
-		specifies the location where the parsed document will be stored after it has been processed.
+		  path: The `path` parameter is the directory path where the document is uploaded to.
+		  replace: Whether an existing file with the same name should be updated instead of renamed.
 
 		Returns:
-		  the variable "inserted_id".
+		  dict with the uploaded `file`, its database `record` with `_id` and `virtualFileName` already
+		set, its `slides` and the `existing` record it replaces, or None if the file was not parsed.
 		"""
-		try:
-			filename = file.filename
-			file_extension = filename.rsplit(".", 1)[-1]
+		user_id = str(logged_in_user["_id"])
+		if not user_id:
+			raise Exception("User ID is missing")
+		
+		filename = Path(file.filename)
+		new_path = Path(user_id) / Path(path)
+		file_extension = filename.suffix.strip(".")
+		new_path = str(new_path)
+		print(f"New path: {new_path}")
+		print(f"File: {filename}")
+		print(f"File extension: {file_extension}")
 
+		try:
 			# PPT
 			if file_extension == "pptx":
 				print("Parsing pptx...")
-				inserted_id = self._parse_pptx(file, filename, logged_in_user, new_path)
+				parsed_document = self._parse_pptx(file, file.filename, logged_in_user, new_path, replace)
 
 			else:
 				print("Failed to parse invalid file format...")
-				inserted_id = None
+				socket_info(
+					user_id,
+					f"Skipping upload of {filename} due to incompatible file format",
+				)
+				return None
 
-			return inserted_id
+			return parsed_document
 
 		except Exception as e:
 			Common.exception_details("myDocumentsService.parse_document", e)
+			socket_error(
+				user_id,
+				f"Failed to save {filename} to database due to some error...",
+			)
 			return None
 
 	def update_virtual_filename(self, file_id, file_extension):
@@ -216,51 +376,153 @@ class MyDocumentsService:
 		response = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].update_one(
 			{"_id": ObjectId(file_id)}, {"$set": {"virtualFileName": virtual_filename}}
 		)
+		MyDocumentsService.invalidate_file(file_id)
 		return response.modified_count
 
 
-	def get_file(self, file_id):
+	def get_file(self, file_id, fields=None):
 		"""
-		The function `get_file` retrieves a file from a MongoDB database based on its ID.
+		The function `get_file` retrieves a file from a MongoDB database based on its ID. Records are
+		read with a single `find_one` and cached; the result has the same shape as the My Documents
+		pipeline.
 
 		Args:
 		  file_id: The `file_id` parameter is the unique identifier of the file that you want to
 		retrieve from the database.
+		  fields: Optional list of the fields to return. All fields are returned if None.
 
 		Returns:
-		  the first document that matches the given file_id.
+		  the document that matches the given file_id, or None.
 		"""
-		m_db = MongoClient.connect()
-
-		pipeline = [
-			PipelineStages.stage_match({"_id": ObjectId(file_id)})
-		] + MyDocumentsService._get_my_documents_pipeline()
+		document = MyDocumentsService._get_cached_file({"_id": ObjectId(file_id)})
+		if not document:
+			return None
 
-		response = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].aggregate(pipeline)
+		document = MyDocumentsService._to_my_document(document)
 
-		return Common.cursor_to_dict(response)[0]
+		return MyDocumentsService._project(document, fields)
 
 
-	def get_file_by_virtual_name(self, virtual_name):
+	def get_file_by_virtual_name(self, virtual_name, fields=None):
 		"""
 		The function retrieves a document from a MongoDB collection based on its virtual file name.
 
 		Args:
 		  virtual_name: The virtual name is a parameter that represents the name of the file you want to
 		retrieve from the database.
+		  fields: Optional list of the fields to return. All fields are returned if None.
 
 		Returns:
 		  the document that matches the given virtual name from the specified collection in the MongoDB
 		database.
 		"""
+		document = MyDocumentsService._get_cached_file({"virtualFileName": virtual_name})
+		if not document:
+			return None
+
+		return MyDocumentsService._project(copy.deepcopy(document), fields)
+
+	@staticmethod
+	def invalidate_file(file_id, virtual_name=None):
+		"""Removes the record of a file from the metadata cache after it was modified"""
+		MyDocumentsService.metadata_cache.invalidate(("_id", str(file_id)))
+		if virtual_name:
+			MyDocumentsService.metadata_cache.invalidate(("virtualFileName", virtual_name))
+
+	@staticmethod
+	def _on_invalidation(event):
+		"""Drops a record modified by any process from the metadata cache"""
+		if event.type == InvalidationEvent.DECK_UPDATED:
+			MyDocumentsService.invalidate_file(event.file_id, event.virtual_filename)
+
+	@staticmethod
+	def _get_cached_file(query):
+		"""
+		Returns the record matching `query`, which is either an `_id` or a `virtualFileName`, from the
+		metadata cache, reading it from the database on a miss. The returned record is shared with the
+		cache and must not be modified.
+		"""
+		cache = MyDocumentsService.metadata_cache
+
+		if "_id" in query:
+			file_id = str(query["_id"])
+		else:
+			file_id = cache.get(("virtualFileName", query["virtualFileName"]))
+
+		document = cache.get(("_id", file_id)) if file_id else None
+		# The virtual filename may have changed since it was cached
+		if document and all(document.get(key) == value for key, value in query.items()):
+			return document
+
 		m_db = MongoClient.connect()
 
 		document = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].find_one(
-			{"virtualFileName": virtual_name}
+			query, MyDocumentsService.EXCLUDED_FIELDS
 		)
+		if document:
+			MyDocumentsService._cache_file(document)
 
 		return document
 
+	@staticmethod
+	def _cache_file(document):
+		"""Stores a record in the metadata cache, without the fields metadata reads never return"""
+		cache = MyDocumentsService.metadata_cache
+
+		document = {
+			key: value for key, value in document.items() 
+			if key not in MyDocumentsService.EXCLUDED_FIELDS
+		}
+		cache.set(("_id", str(document["_id"])), document)
+		if document.get("virtualFileName"):
+			cache.set(("virtualFileName", document["virtualFileName"]), str(document["_id"]))
+
+	@staticmethod
+	def _to_my_document(document):
+		"""Converts a record to the format returned by the My Documents pipeline"""
+		document = dict(document)
+		document["_id"] = str(document["_id"])
+		if "createdBy" in document:
+			document["createdBy"] = dict(document["createdBy"], _id=str(document["createdBy"]["_id"]))
+		if isinstance(document.get("createdOn"), datetime.datetime):
+			created_on = document["createdOn"]
+			document["createdOn"] = created_on.strftime("%Y-%m-%dT%H:%M:%S.") + f"{created_on.microsecond // 1000:03d}Z"
+		if "usersWithAccess" in document:
+			document["usersWithAccess"] = [str(user) for user in document["usersWithAccess"]]
+
+		return Common.cursor_to_dict([document])[0]
+
+	@staticmethod
+	def _project(document, fields):
+		"""Keeps only `_id` and the top level `fields` of `document`, or all fields if None"""
+		if not fields:
+			return document
+		return {key: document[key] for key in ["_id", *fields] if key in document}
+
+	def get_file_description(self, file_id):
+		"""
+		The function `get_file_description` retrieves the full text of a file, which is stored
+		compressed outside of the file's record.
+
+		Args:
+		  file_id: The unique identifier of the file.
+
+		Returns:
+		  the text of the file, or None if the file has no stored text.
+		"""
+		m_db = MongoClient.connect()
+
+		content = m_db[Config.MONGO_DOCUMENT_CONTENT_COLLECTION].find_one({"_id": ObjectId(file_id)})
+		if content:
+			return Common.decompress_text(content["description"])
+
+		# Files uploaded before the text was moved out of the record
+		document = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].find_one(
+			{"_id": ObjectId(file_id)},
+			{"description": 1}
+		)
+		return document.get("description") if document else None
+
 	def save_file(self, original_file, file_id, user, path):
 		"""
 		The `save_file` function saves a file either to a cloud storage bucket or to a local folder,
@@ -275,52 +537,24 @@ class MyDocumentsService:
 		  path: The `path` parameter is a string that represents the path where the file should be
 		saved. It can be an absolute path or a relative path.
 		"""
-		key = "_id"
-		user_id = user[key]
 		# Get virtual filename from DB
-		file = self.get_file(file_id)
+		file = self.get_file(file_id, ["virtualFileName"])
 		virtual_file_name = file["virtualFileName"]
-		file_root = file["root"]
-
-		if Config.GCP_PROD_ENV:
-			pass
-			# # print("PATH : ", path)
-			# # print("Original file :", original_file)
 
-			# if path == "/":
-			#     folder_name = str(user_id) + path
-			# else:
-			#     folder_name = file_root[1:] + "/"
-
-			# bucket = Production.get_users_bucket()
-			# file_blob = bucket.blob(folder_name + virtual_file_name)
-
-			# # finding the file extension
-			# extension = virtual_file_name[virtual_file_name.rfind(".") + 1 :]
-
-			# original_file.stream.seek(0)
-			# if extension == "pdf":
-			#     file_blob.upload_from_string(
-			#         original_file.read(), content_type="application/pdf"
-			#     )
-			# else:
-			#     file_blob.upload_from_string(original_file.read())
-
-			# print(f"File {virtual_file_name} uploaded to {folder_name} successfully.")
-			# print("Path sent to get_file_save_path: ", path)
+		self._save_file(original_file, virtual_file_name)
 
+	def _save_file(self, original_file, virtual_file_name):
+		"""
+		Saves `original_file` in the blob store under the name `virtual_file_name`. Uploading the
+		same content again, under any name, does not store it twice. A file uploaded in chunks is
+		already in the blob store and is only linked.
+		"""
+		blob_hash = getattr(original_file, "blob_hash", None)
+		if blob_hash:
+			BlobStore.connect().link(virtual_file_name, blob_hash)
 		else:
-			# Ensure that the user image upload folder exists
-			folder_path = os.path.join(Config.USER_FOLDER, str(user_id))
-			os.makedirs(folder_path, exist_ok=True)
-
-			# Save file
-			file_save_path = self.get_file_save_path(virtual_file_name, user_id, path)
-			print(type(original_file))
-			original_file.stream.seek(0)
-			original_file.save(file_save_path)
-
-			print("Saved file!")
+			BlobStore.connect().store(virtual_file_name, original_file.stream)
+		print("Saved file!")
 
 
 	@staticmethod
@@ -347,21 +581,19 @@ class MyDocumentsService:
 					},
 				}
 			),
-			PipelineStages.stage_unset(["embeddings", "highlightsSummary"]),
+			PipelineStages.stage_unset(["embeddings", "highlightsSummary", "slides", "description"]),
 		]
 
 		return my_documents_pipeline
 
 	@staticmethod
-	def _create_my_document_db_struct(title, description, filename, user, root):
+	def _create_my_document_db_struct(title, filename, user, root):
 		"""
 		The function `_create_my_document_db_struct` creates a document structure for a file in a
 		document database.
 
 		Args:
 		  title: The title of the document.
-		  description: The "description" parameter is a string that represents the description of the
-		document. It provides additional information or details about the document.
 		  filename: The `filename` parameter is the name of the file that you want to create a document
 		database structure for.
 		  user: The "user" parameter is a dictionary that represents the user who is creating the
@@ -372,38 +604,20 @@ class MyDocumentsService:
 		the root directory ("/").
 
 		Returns:
-		  a document (doc) with various fields such as title, description, itemizedSummary,
-		highlightsSummary, originalFileName, virtualFileName, createdBy, createdOn, embeddings, type,
-		root, usersWithAccess, and storedOnCloud.
+		  a document (doc) with various fields such as title, itemizedSummary, highlightsSummary,
+		originalFileName, virtualFileName, createdBy, createdOn, embeddings, type, root,
+		usersWithAccess, and storedOnCloud.
+		The originalFileName is made unique within the folder by `_insert_my_document`. The text of
+		the document is stored separately by `_save_descriptions`.
 		"""
 		if root == "":
 			root = "/"
 
-		m_db = MongoClient.connect()
-		# Check if the file with the same name already exists in the collection
-		existing_files = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].find(
-			{"root": str(root)},
-			{"_id": 0, "originalFileName": 1}
-		)
-
-		# Create a set of existing filenames for efficient lookup
-		existing_filenames = set(file["originalFileName"] for file in existing_files)
-
-		# If the filename already exists, increment the index count
-		index = 1
-		new_filename = filename
-		while new_filename in existing_filenames:
-			file_name_without_extension, file_extension = os.path.splitext(filename)
-			print("File name without extension:", file_name_without_extension)
-			new_filename = f"{file_name_without_extension}({index}){file_extension}"
-			index = index + 1
-
 		doc = {
 			"title": title,
-			"description": description,
 			"itemizedSummary": "",  # update when itemized summary of this record is generated
 			"highlightsSummary": "",  # update when highlight summary of this record is generated
-			"originalFileName": str(new_filename),  # Use the unique filename
+			"originalFileName": str(filename),  # Made unique on insert
 			"virtualFileName": "",
 			"createdBy": {"_id": ObjectId(user["_id"]), "ref": "user"},
 			"createdOn": datetime.datetime.utcnow(),
@@ -415,6 +629,120 @@ class MyDocumentsService:
 
 		return doc
 
+	@staticmethod
+	def _unique_filenames_enforced():
+		"""
+		Whether the unique index on file names exists. It is not created while files uploaded before
+		it share names, and then names are checked before each insert instead.
+		"""
+		enforced = MyDocumentsService.unique_filename_index.get("enforced")
+		if enforced is None:
+			m_db = MongoClient.connect()
+			indexes = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].index_information()
+			enforced = Bootstrap.UNIQUE_FILENAME_INDEX in indexes
+			if not enforced:
+				print(f"⚠️ Index {Bootstrap.UNIQUE_FILENAME_INDEX} is missing, file names are checked before insert")
+			MyDocumentsService.unique_filename_index.set("enforced", enforced)
+		return enforced
+
+	@staticmethod
+	def _filename_exists(doc):
+		m_db = MongoClient.connect()
+		return m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].find_one(
+			{
+				"createdBy._id": doc["createdBy"]["_id"],
+				"root": doc["root"],
+				"originalFileName": doc["originalFileName"],
+			},
+			{"_id": 1}
+		) is not None
+
+	@staticmethod
+	def _insert_my_document(doc):
+		"""
+		Inserts `doc` into the documents collection, renaming its `originalFileName` to
+		`name(n).ext` if a file with that name already exists in the same folder.
+
+		The name is first tried as is. On a collision, `n` is taken from a per-folder, per-filename
+		counter that is incremented atomically, so a free name is normally found in one more round
+		trip however many files the folder holds. The unique index created by `Bootstrap`
+		catches names taken by other uploads (or files uploaded before the counters existed), in
+		which case the next counter value is tried. While that index is missing, each name is
+		looked up before it is inserted.
+
+		Returns:
+			The InsertOneResult of the insert
+		"""
+		m_db = MongoClient.connect()
+
+		filename = doc["originalFileName"]
+		file_name_without_extension, file_extension = os.path.splitext(filename)
+		check_filename = not MyDocumentsService._unique_filenames_enforced()
+
+		for _ in range(MyDocumentsService.MAX_FILENAME_ATTEMPTS):
+			if not (check_filename and MyDocumentsService._filename_exists(doc)):
+				try:
+					return m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].insert_one(doc)
+				except DuplicateKeyError:
+					pass
+
+			counter = m_db[Config.MONGO_FILENAME_COUNTER_COLLECTION].find_one_and_update(
+				{
+					"createdBy": doc["createdBy"]["_id"],
+					"root": doc["root"],
+					"fileName": filename,
+				},
+				{"$inc": {"count": 1}},
+				upsert=True,
+				return_document=ReturnDocument.AFTER
+			)
+			doc["originalFileName"] = f"{file_name_without_extension}({counter['count']}){file_extension}"
+
+		raise Exception(f"Could not find a unique name for {filename} in {doc['root']}")
+
+	@staticmethod
+	def _insert_my_documents(documents):
+		"""
+		Inserts the records of `documents` returned by `parse_document` with a single unordered
+		`insert_many`. Records whose filename already exists in their folder are retried one by one
+		with `_insert_my_document`, which renames them. While the unique index on names is missing,
+		every record is inserted by `_insert_my_document`.
+
+		Returns:
+			list of the documents whose records were inserted
+		"""
+		if not documents:
+			return []
+
+		m_db = MongoClient.connect()
+
+		failed = set()
+		duplicates = []
+		if not MyDocumentsService._unique_filenames_enforced():
+			# Without the unique index duplicates are not refused, so every name is checked
+			duplicates = list(range(len(documents)))
+		else:
+			try:
+				m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].insert_many(
+					[document["record"] for document in documents], ordered=False
+				)
+			except BulkWriteError as e:
+				for error in e.details["writeErrors"]:
+					if error["code"] == 11000:
+						duplicates.append(error["index"])
+					else:
+						print("Failed to insert document:", error["errmsg"])
+						failed.add(error["index"])
+
+		for i in duplicates:
+			try:
+				MyDocumentsService._insert_my_document(documents[i]["record"])
+			except Exception as e:
+				Common.exception_details("myDocumentsService._insert_my_documents", e)
+				failed.add(i)
+
+		return [document for i, document in enumerate(documents) if i not in failed]
+
 	@staticmethod
 	def _create_my_ppt_index_struct(slide_content, filename, user_id, root, virtual_filename):
 		docs = []
@@ -430,22 +758,22 @@ class MyDocumentsService:
 		return docs
 
 
-	def _parse_pptx(self, file, filename, user, root):
+	def _parse_pptx(self, file, filename, user, root, replace=False):
 		"""
-		The _parse_pptx function extracts content from the file and inserts a new record corresponding to the file.
-			Args:
-				file (file storage) : The file to be parsed
-				original_filename (str) : The name of this file to be parsed
-				user (dict): Identifies the user uploading the file.
+		The _parse_pptx function extracts content from the file and creates the record corresponding to the file.
+		The `_id` and `virtualFileName` of the record are generated here so that the record can be inserted in
+		a single write and the file saved without reading the record back.
 
 		Args:
 			self: Represent the instance of the class
 			file : The file to be parsed
 			original_filename (str) : The name of this file to be parsed
 			user (str): Corresponds to the user uploading the file.
+			replace (bool): Update the existing record with the same name instead of inserting a new one
 
 		Returns:
-			The Objectid of the newly inserted record
+			dict with the `file`, its `record`, its `slides`, its text as `description` and whether it
+			replaces an `existing` record
 			:param user:
 			:param file:
 			:param filename:
@@ -455,74 +783,260 @@ class MyDocumentsService:
 		m_db = MongoClient.connect()
 
 
-		ppt = PresentationManager(file)
+		title, slide_texts = MyDocumentsService._extract_pptx(file)
+		ppt_content = "\n".join([slide["content"] for slide in slide_texts if slide["content"]])
+		slides = MyDocumentsService._create_slides_manifest(slide_texts)
+
+		existing_file = None
+		if replace:
+			existing_file = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].find_one(
+				{
+					"root": str(root or "/"),
+					"originalFileName": filename,
+					"createdBy._id": ObjectId(user["_id"]),
+				},
+				{"_id": 1, "originalFileName": 1, "virtualFileName": 1, "root": 1, "slides": 1}
+			)
+
+		if existing_file:
+			file_data = existing_file
+			file_data["virtualFileName"] = file_data.get("virtualFileName") or str(file_data["_id"]) + ".pptx"
+			file_data["title"] = title
+		else:
+			file_data = MyDocumentsService._create_my_document_db_struct(
+				title, filename, user, root
+			)
+			file_data["_id"] = ObjectId()
+			file_data["virtualFileName"] = str(file_data["_id"]) + ".pptx"
+			file_data["slides"] = slides
+
+		return {
+			"file": file,
+			"record": file_data,
+			"slides": slide_texts,
+			"description": ppt_content,
+			"existing": existing_file is not None,
+		}
+
+	@staticmethod
+	@Metrics.timed(INGEST_SECONDS, stage="extract")
+	def _extract_pptx(file):
+		"""
+		Returns the title and slide records of a pptx file, from the artifact cache if the same file
+		was parsed before by any worker.
+		"""
+		artifact_cache = ArtifactCache.connect()
+		if artifact_cache:
+			file_hash, _ = PresentationManager.hash_file(file)
+			extracted = artifact_cache.get_json(file_hash, ArtifactCache.SLIDES)
+			if extracted:
+				print("Loaded slides from cache:", file.filename)
+				return extracted["title"], extracted["slides"]
+
+		ppt = PresentationManager(file, cache=True)
 		slide_texts = ppt.extract_all_text()
 		title = ppt.title
-		ppt_content = "\n".join([slide["content"] for slide in slide_texts if slide["content"]])
 
-		file_data = MyDocumentsService._create_my_document_db_struct(
-			title, ppt_content, filename, user, root
+		if artifact_cache:
+			artifact_cache.set_json(file_hash, ArtifactCache.SLIDES, {"title": title, "slides": slide_texts})
+			try:
+				SlideBundle.build(file)
+			except Exception as e:
+				# Bundles are rebuilt when a presentation is generated from the slides
+				Common.exception_details("myDocumentsService._extract_pptx", e)
+
+		return title, slide_texts
+
+	def _reparse_pptx(self, document, user):
+		"""
+		Updates the record of a re-uploaded pptx in place and re-indexes only the slides whose
+		content changed since the previous upload.
+
+		Returns:
+			The Objectid of the existing record
+		"""
+		m_db = MongoClient.connect()
+
+		existing_file = document["record"]
+		file_id = existing_file["_id"]
+		virtual_filename = existing_file["virtualFileName"]
+		slides = MyDocumentsService._create_slides_manifest(document["slides"])
+		m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].update_one(
+			{"_id": file_id},
+			{
+				"$set": {
+					"title": existing_file["title"],
+					"virtualFileName": virtual_filename,
+					"slides": slides,
+					"updatedOn": datetime.datetime.utcnow(),
+				},
+				"$unset": {"description": ""},
+			}
 		)
-		# print(file_data)
-		response = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION].insert_one(file_data)
-
-		if response:
-			if response.inserted_id:
-				virtual_filename = str(response.inserted_id) + ".pptx"
-				docs = MyDocumentsService._create_my_ppt_index_struct(
-					slide_content=slide_texts,
-					filename=file_data["originalFileName"],
-					user_id=user["_id"],
-					root=root,
-					virtual_filename=virtual_filename
-				)
-				success, errors = ElasticService().index_batch(docs=docs)
-				print(f"\nIndexed: {success} documents \nErrors: {len(errors)}")
+		MyDocumentsService._save_descriptions([document])
+		MyDocumentsService.invalidate_file(file_id, virtual_filename)
+
+		docs = MyDocumentsService._create_my_ppt_index_struct(
+			slide_content=document["slides"],
+			filename=existing_file["originalFileName"],
+			user_id=user["_id"],
+			root=existing_file["root"],
+			virtual_filename=virtual_filename
+		)
+		success, errors = ElasticService().reindex_changed(
+			docs=docs,
+			previous_slides=existing_file.get("slides"),
+			virtual_filename=virtual_filename,
+			user_id=user["_id"]
+		)
+		print(f"\nRe-indexed: {success} documents \nErrors: {len(errors)}")
 
+		return str(file_id)
 
-			return str(response.inserted_id)
+	@staticmethod
+	def _save_descriptions(documents):
+		"""
+		Stores the text of `documents` returned by `parse_document`, compressed, in the content
+		collection under the same `_id` as their record. Keeping the text out of the records keeps
+		metadata reads small; it is loaded only by `get_file_description`.
+		"""
+		if not documents:
+			return
 
-		return None
+		m_db = MongoClient.connect()
+
+		m_db[Config.MONGO_DOCUMENT_CONTENT_COLLECTION].bulk_write([
+			ReplaceOne(
+				{"_id": document["record"]["_id"]},
+				{"description": Binary(Common.compress_text(document["description"]))},
+				upsert=True
+			)
+			for document in documents
+		], ordered=False)
 
 	@staticmethod
-	def generate_pptx_from_search(elastic_results, query, user_id):
-		try:
-			user_folder = os.path.join(Config.USER_FOLDER, str(user_id))
+	def _create_slides_manifest(slide_texts):
+		"""Position and content hash of every slide, used to diff the next upload of the file"""
+		return [
+			{
+				"slide_id": slide["slide_id"],
+				"slide_index": slide["slide_index"],
+				"content_hash": slide["content_hash"],
+			}
+			for slide in slide_texts
+		]
 
-			ppts = {}
-			skips = set()
+	@staticmethod
+	@Metrics.timed(GENERATION_SECONDS)
+	def generate_pptx_from_search(elastic_results, query, user_id, cancellation=None):
+		"""
+		Generates a presentation of the slides found by a search and returns its path, or None.
+		Once `cancellation`, a `CancellationToken`, is cancelled, generation stops before the next
+		slide, deletes what it wrote and raises `Cancelled`.
+		"""
+		progress = ProgressChannel.start(
+			user_id, "generate", len(elastic_results), "assembling",
+			job_id=cancellation.job_id if cancellation else None
+		)
+		dest_filepath = None
+		try:
+			file_paths = {}
 			for item in elastic_results:
 				virtual_filename = item['virtualFileName']
-				if (virtual_filename not in ppts) and (virtual_filename not in skips):
-					file_root = item['root']
-					file_path = os.path.join(user_folder, file_root[1:], virtual_filename)
-					if not Path(file_path).exists():
-						skips.append(virtual_filename)
-						continue
-					ppts[virtual_filename] = PresentationManager(file_path)
+				if virtual_filename not in file_paths:
+					file_path = MyDocumentsService.get_stored_file_path(virtual_filename, user_id, item['root'])
+					file_paths[virtual_filename] = file_path if Path(file_path).exists() else None
+			elastic_results = [item for item in elastic_results if file_paths[item['virtualFileName']]]
+			GENERATION_DECKS.observe(sum(1 for file_path in file_paths.values() if file_path))
+
+			# Written next to the blob store and moved into it when complete
+			blob_store = BlobStore.connect()
+			dest_filepath = blob_store.temp_path(".pptx")
+			generated_name = f"{Config.GENERATED_FOLDER_NAME}/{user_id}/{uuid.uuid4()}.pptx"
+
+			# Merge the slide bundles built at ingest, without loading the source presentations
+			slides = [(file_paths[item['virtualFileName']], item['slide_index']) for item in elastic_results]
+			with GENERATION_STAGE_SECONDS.time(stage="assemble"):
+				assembled = SlideBundle.assemble(slides, dest_filepath, cancellation)
+			if assembled:
+				progress.update(stage="storing", done=len(slides))
+				file_path = MyDocumentsService._store_generated(generated_name, dest_filepath, user_id)
+				progress.finish(query)
+				return file_path
+
+			# Load only the requested slides of each presentation
+			progress.update(stage="loading", done=0, total=len(elastic_results))
+			slide_indexes = {}
+			for item in elastic_results:
+				slide_indexes.setdefault(item['virtualFileName'], []).append(item['slide_index'])
+			ppts = {}
+			with GENERATION_STAGE_SECONDS.time(stage="load"):
+				for virtual_filename, indexes in slide_indexes.items():
+					if cancellation:
+						cancellation.raise_if_cancelled()
+					ppts[virtual_filename] = PresentationManager(
+						file_paths[virtual_filename], cache=True, slides=indexes, cancellation=cancellation
+					)
 			pp.pprint(ppts)
 
-			# Ensure that the folder exists
-			folder_path = os.path.join(user_folder, Config.GENERATED_FOLDER_NAME)
-			os.makedirs(folder_path, exist_ok=True)
-			dest_filepath = os.path.join(folder_path, f"{str(uuid.uuid4())}.pptx")
-
 			# Combine all slides into single presentation			
-			for slide in elastic_results:
-				slides_to_copy = [slide['slide_index']]
-				virtual_filename = slide['virtualFileName']
-				source = ppts[virtual_filename]
-				print(f"Copying from {source.title}")
-
-				PresentationManager.copy_slide_to_other_presentation(
-					source=source,
-					dest_filepath=dest_filepath,
-					slides_to_copy=slides_to_copy
-				)				
+			progress.update(stage="copying")
+			with GENERATION_STAGE_SECONDS.time(stage="copy"):
+				for slide in elastic_results:
+					if cancellation:
+						cancellation.raise_if_cancelled()
+					virtual_filename = slide['virtualFileName']
+					source = ppts[virtual_filename]
+					slides_to_copy = [source.slide_position(slide['slide_index'])]
+					print(f"Copying from {source.title}")
+
+					PresentationManager.copy_slide_to_other_presentation(
+						source=source,
+						dest_filepath=dest_filepath,
+						slides_to_copy=slides_to_copy
+					)				
+					progress.advance()
 			
-			return dest_filepath		
+			if not Path(dest_filepath).exists():
+				progress.finish(query, failed=True)
+				return None
+			progress.update(stage="storing")
+			file_path = MyDocumentsService._store_generated(generated_name, dest_filepath, user_id)
+			progress.finish(query)
+			return file_path
+
+		except Cancelled as e:
+			print(f"Generation of {query} cancelled: {e}")
+			MyDocumentsService._discard_generated(dest_filepath)
+			progress.finish(f"Cancelled: {e}", failed=True)
+			raise
 
 		except Exception as e:
 			Common.exception_details("myDocumentsService.generate_pptx_from_search", e)
+			MyDocumentsService._discard_generated(dest_filepath)
+			progress.finish(query, failed=True)
 			return None		
-				  
\ No newline at end of file
+				  
+
+	@staticmethod
+	def _discard_generated(file_path):
+		"""Deletes a presentation left unfinished"""
+		if file_path and os.path.exists(file_path):
+			os.remove(file_path)
+
+	@staticmethod
+	@Metrics.timed(GENERATION_STAGE_SECONDS, stage="store")
+	def _store_generated(name, file_path, user_id):
+		"""
+		Moves a generated presentation into the blob store and registers it for deletion once
+		expired. Returns its path, which stays valid while it is being downloaded.
+		"""
+		size = os.path.getsize(file_path)
+		GENERATION_OUTPUT_BYTES.observe(size)
+		blob_store = BlobStore.connect()
+		blob_store.store(name, file_path)
+		GeneratedDeckReaper.register(name, user_id, size)
+		return blob_store.resolve_path(name)
+
+
+InvalidationBus.register(MyDocumentsService._on_invalidation, MyDocumentsService.metadata_cache.clear)
@@ -0,0 +1,222 @@
+import datetime
+
+from bson import ObjectId
+from pathlib import Path
+from pymongo import ReturnDocument
+from werkzeug.datastructures import FileStorage
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+from app.services.myDocumentsService import MyDocumentsService
+from app.utils.blobstore import BlobStore
+from app.utils.messages import Messages
+
+
+class UploadError(Exception):
+	"""A request that does not match the state of the upload"""
+
+	def __init__(self, message, status, upload=None):
+		super().__init__(message)
+		self.message = message
+		self.status = status
+		self.upload = upload
+
+
+class StoredFile(FileStorage):
+	"""An uploaded file already in the blob store, which is linked instead of stored again"""
+
+	def __init__(self, blob_hash, **kwargs):
+		super().__init__(**kwargs)
+		self.blob_hash = blob_hash
+
+
+class UploadService:
+	"""
+	Resumable uploads of large files in chunks. An upload is created with the name and size of the
+	file, then its chunks are sent in order, each with the offset it starts at, and the upload is
+	finalized once complete. A client whose chunk failed asks for the current offset and resumes
+	from there.
+
+	Chunks are written straight to the blob store, and the file is hashed once when the upload is
+	finalized. The state of each upload is in the UPLOADS collection, so chunks can be handled by
+	any worker.
+	"""
+
+	@staticmethod
+	def _collection():
+		return MongoClient.connect()[Config.MONGO_UPLOADS_COLLECTION]
+
+	@staticmethod
+	def create_upload(logged_in_user, filename, size, path, replace=False):
+		"""Creates an upload of `size` bytes and returns it"""
+		if Path(filename).suffix.strip(".") != "pptx":
+			raise UploadError(Messages.ERROR_UPLOAD_FORMAT, 400)
+		if size <= 0 or size > Config.UPLOAD_MAX_BYTES:
+			raise UploadError(Messages.ERROR_UPLOAD_SIZE, 400)
+
+		UploadService.expire_uploads()
+
+		now = datetime.datetime.utcnow()
+		upload = {
+			"_id": ObjectId(),
+			"userId": str(logged_in_user["_id"]),
+			"filename": filename,
+			"size": size,
+			"path": path,
+			"replace": replace,
+			"offset": 0,
+			"createdOn": now,
+			"updatedOn": now,
+			"lockedUntil": now,
+			"finalizingUntil": now,
+		}
+		UploadService._collection().insert_one(upload)
+		return UploadService.to_response(upload)
+
+	@staticmethod
+	def get_upload(logged_in_user, upload_id):
+		"""Returns an upload of the user, with the offset to send the next chunk from"""
+		return UploadService.to_response(UploadService._find(logged_in_user, upload_id))
+
+	@staticmethod
+	def append_chunk(logged_in_user, upload_id, offset, length, stream):
+		"""
+		Writes a chunk of `length` bytes starting at `offset`, which must be the current offset of the
+		upload. Returns the upload with its new offset.
+		"""
+		upload = UploadService._find(logged_in_user, upload_id)
+		if offset != upload["offset"]:
+			raise UploadError(Messages.ERROR_UPLOAD_OFFSET, 409, upload)
+		if length is None or length <= 0 or length > Config.UPLOAD_CHUNK_MAX_BYTES:
+			raise UploadError(Messages.ERROR_UPLOAD_CHUNK_SIZE, 413, upload)
+		if offset + length > upload["size"]:
+			raise UploadError(Messages.ERROR_UPLOAD_CHUNK_SIZE, 413, upload)
+
+		# Only one chunk of an upload is written at a time
+		now = datetime.datetime.utcnow()
+		upload = UploadService._collection().find_one_and_update(
+			{"_id": upload["_id"], "offset": offset, "lockedUntil": {"$lte": now}},
+			{"$set": {"lockedUntil": now + datetime.timedelta(seconds=Config.UPLOAD_LOCK_SECONDS)}},
+			return_document=ReturnDocument.AFTER,
+		)
+		if not upload:
+			raise UploadError(Messages.ERROR_UPLOAD_LOCKED, 409, UploadService._find(logged_in_user, upload_id))
+
+		new_offset = offset
+		try:
+			new_offset = BlobStore.connect().append(upload_id, offset, stream)
+			if new_offset != offset + length:
+				raise UploadError(Messages.ERROR_UPLOAD_CHUNK_SIZE, 400)
+		except Exception:
+			new_offset = offset
+			raise
+		finally:
+			upload = UploadService._collection().find_one_and_update(
+				{"_id": upload["_id"]},
+				{"$set": {"offset": new_offset, "lockedUntil": datetime.datetime.utcnow(), "updatedOn": datetime.datetime.utcnow()}},
+				return_document=ReturnDocument.AFTER,
+			)
+
+		return UploadService.to_response(upload)
+
+	@staticmethod
+	def finalize_upload(logged_in_user, upload_id):
+		"""
+		Moves a complete upload into the blob store and hands it to the ingest pipeline. Returns the
+		id of the uploaded document. The upload is claimed for `UPLOAD_FINALIZE_SECONDS` first, so
+		that concurrent requests to finalize it do not upload the document twice, and so that it can
+		be finalized again if the worker finalizing it dies. If the document cannot be uploaded, the
+		upload is kept, complete, and finalizing it can be retried.
+		"""
+		upload = UploadService._find(logged_in_user, upload_id)
+		if upload["offset"] != upload["size"]:
+			raise UploadError(Messages.ERROR_UPLOAD_INCOMPLETE, 409, upload)
+
+		now = datetime.datetime.utcnow()
+		upload = UploadService._collection().find_one_and_update(
+			{"_id": upload["_id"], "offset": upload["size"], "finalizingUntil": {"$not": {"$gt": now}}},
+			{"$set": {
+				"finalizingUntil": now + datetime.timedelta(seconds=Config.UPLOAD_FINALIZE_SECONDS),
+				"updatedOn": now,
+			}},
+			return_document=ReturnDocument.AFTER,
+		)
+		if not upload:
+			raise UploadError(Messages.ERROR_UPLOAD_FINALIZING, 409, UploadService._find(logged_in_user, upload_id))
+
+		blob_store = BlobStore.connect()
+		try:
+			blob_hash = upload.get("blobHash")
+			if not blob_hash:
+				blob_hash = blob_store.commit(upload_id)
+				# Keeps the blob referenced until the document links it, also across retries
+				blob_store.link(UploadService._blob_name(upload_id), blob_hash)
+				UploadService._collection().update_one({"_id": upload["_id"]}, {"$set": {"blobHash": blob_hash}})
+
+			with blob_store.open(blob_hash) as stream:
+				file = StoredFile(
+					blob_hash,
+					stream=stream,
+					filename=upload["filename"],
+					content_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+				)
+				status, document_id = MyDocumentsService.upload_document(
+					logged_in_user, file, upload["path"], upload["replace"]
+				)
+			if not status:
+				raise UploadError(Messages.ERROR_UPLOAD_SAVE, 500)
+		except Exception:
+			UploadService._collection().update_one(
+				{"_id": upload["_id"]}, {"$set": {"finalizingUntil": datetime.datetime.utcnow()}}
+			)
+			raise
+
+		UploadService._delete(upload_id)
+		return document_id
+
+	@staticmethod
+	def delete_upload(logged_in_user, upload_id):
+		"""Cancels an upload"""
+		UploadService._find(logged_in_user, upload_id)
+		UploadService._delete(upload_id)
+
+	@staticmethod
+	def expire_uploads():
+		"""Deletes uploads that received no chunk for `UPLOAD_EXPIRY_SECONDS`"""
+		threshold = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.UPLOAD_EXPIRY_SECONDS)
+		for upload in UploadService._collection().find({"updatedOn": {"$lt": threshold}}, {"_id": 1}).limit(100):
+			UploadService._delete(str(upload["_id"]))
+
+	@staticmethod
+	def _blob_name(upload_id):
+		return f"uploads/{upload_id}"
+
+	@staticmethod
+	def _delete(upload_id):
+		upload = UploadService._collection().find_one_and_delete({"_id": ObjectId(upload_id)})
+		blob_store = BlobStore.connect()
+		if upload and upload.get("blobHash"):
+			blob_store.unlink(UploadService._blob_name(upload_id))
+		blob_store.discard(upload_id)
+
+	@staticmethod
+	def _find(logged_in_user, upload_id):
+		upload = None
+		if ObjectId.is_valid(upload_id):
+			upload = UploadService._collection().find_one(
+				{"_id": ObjectId(upload_id), "userId": str(logged_in_user["_id"])}
+			)
+		if not upload:
+			raise UploadError(Messages.NOT_FOUND_UPLOAD, 404)
+		return upload
+
+	@staticmethod
+	def to_response(upload):
+		"""Returns the fields of an upload sent to the client"""
+		return {
+			"uploadId": str(upload["_id"]),
+			"filename": upload["filename"],
+			"size": upload["size"],
+			"offset": upload["offset"],
+			"chunkSize": Config.UPLOAD_CHUNK_MAX_BYTES,
+		}
@@ -0,0 +1,165 @@
+"""
+    Admission control in front of expensive requests, shedding load when the server is saturated
+"""
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """A request refused by an `AdmissionController`, to be retried after `retry_after` seconds"""
+
+    # Reasons for refusing a request
+    QUEUE_FULL = "queue_full"
+    TIMEOUT = "timeout"
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Runs at most `limit` requests at once. Further requests wait, up to `max_queue` of them and for
+    at most `queue_timeout` seconds each. A request arriving to a full queue is refused right away
+    with 429, and a request still waiting at its deadline with 503, both with the number of seconds
+    after which a retry is likely to be admitted.
+
+    The limit adapts to memory: it is lowered so that every running request can use
+    `memory_per_request` bytes of the memory still available, leaving `memory_reserve` bytes free.
+    At least one request always runs.
+    """
+
+    # Seconds between two reads of the available memory
+    MEMORY_CHECK_INTERVAL = 1.0
+    # Weight of the latest request in the average duration of requests
+    DURATION_WEIGHT = 0.2
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout, memory_per_request=None, memory_reserve=0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_per_request = memory_per_request
+        self.memory_reserve = memory_reserve
+
+        self._condition = threading.Condition()
+        self._limit = max_concurrency
+        self._limit_checked = 0.0
+        self._average_duration = None
+        self.active = 0
+        self.waiting = 0
+        self.metrics = {
+            "admitted_total": 0,
+            "rejected_total": {AdmissionRejected.QUEUE_FULL: 0, AdmissionRejected.TIMEOUT: 0},
+            "wait_seconds_total": 0.0,
+        }
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """
+        Waits until the request may run, raising `AdmissionRejected` if it may not. `deadline`, a
+        `time.monotonic()` time, is when a request that already waited elsewhere, e.g. in a queue,
+        gives up; `queue_timeout` seconds from now by default.
+        """
+        self.acquire(deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def acquire(self, deadline=None):
+        arrived = time.monotonic()
+        deadline = arrived + self.queue_timeout if deadline is None else deadline
+        with self._condition:
+            if self.active < self.limit() and not self.waiting:
+                return self._admit(arrived)
+
+            if self.waiting >= self.max_queue:
+                self.metrics["rejected_total"][AdmissionRejected.QUEUE_FULL] += 1
+                raise AdmissionRejected(AdmissionRejected.QUEUE_FULL, 429, self.retry_after())
+
+            self.waiting += 1
+            try:
+                while self.active >= self.limit():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.metrics["rejected_total"][AdmissionRejected.TIMEOUT] += 1
+                        raise AdmissionRejected(AdmissionRejected.TIMEOUT, 503, self.retry_after())
+                    # Wakes up at least every second to see the limit change with memory
+                    self._condition.wait(min(remaining, self.MEMORY_CHECK_INTERVAL))
+            finally:
+                self.waiting -= 1
+            return self._admit(arrived)
+
+    def _admit(self, arrived):
+        self.active += 1
+        self.metrics["admitted_total"] += 1
+        self.metrics["wait_seconds_total"] += time.monotonic() - arrived
+
+    def release(self, duration=None):
+        with self._condition:
+            self.active -= 1
+            if duration is not None:
+                if self._average_duration is None:
+                    self._average_duration = duration
+                else:
+                    self._average_duration += self.DURATION_WEIGHT * (duration - self._average_duration)
+            self._condition.notify()
+
+    def limit(self):
+        """Returns the number of requests that may run at once with the memory available now"""
+        if not self.memory_per_request:
+            return self.max_concurrency
+
+        now = time.monotonic()
+        if now - self._limit_checked >= self.MEMORY_CHECK_INTERVAL:
+            self._limit_checked = now
+            available = available_memory()
+            if available is None:
+                self._limit = self.max_concurrency
+            else:
+                # Memory used by the running requests is not available anymore, but is theirs
+                headroom = available - self.memory_reserve + self.active * self.memory_per_request
+                self._limit = max(1, min(self.max_concurrency, int(headroom // self.memory_per_request)))
+        return self._limit
+
+    def retry_after(self):
+        """Returns the seconds until the requests ahead are likely done"""
+        duration = self._average_duration or 1.0
+        return max(1, math.ceil(duration * (self.waiting + 1) / max(1, self._limit)))
+
+    def to_metrics(self):
+        with self._condition:
+            return {**self.metrics, "active": self.active, "waiting": self.waiting, "limit": self._limit}
+
+
+def available_memory():
+    """Returns the bytes of memory available to this process, or None if unknown"""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        return None
+
+    # A container may have less memory than the host
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            maximum = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            current = int(f.read().strip())
+        if maximum != "max":
+            cgroup_available = int(maximum) - current
+            available = cgroup_available if available is None else min(available, cgroup_available)
+    except (OSError, ValueError):
+        pass
+    return available
@@ -0,0 +1,202 @@
+"""
+    On-disk cache of artifacts derived from presentations, shared by all worker processes
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.config import Config
+from app.utils.metrics import Metrics
+
+REQUESTS = Metrics.counter(
+    "artifact_cache_requests_total", "Lookups in the artifact cache by kind and result", ("kind", "result")
+)
+
+
+class ArtifactCache:
+    """
+    Stores artifacts derived from a presentation (extracted slide records, normalized deck bytes)
+    keyed by the SHA-256 of the presentation file and the kind of artifact, so that a deck parsed
+    by one worker is not parsed again by any other.
+
+    Backed by a SQLite database in WAL mode, which allows concurrent readers and serializes
+    writers across threads and processes. When the stored artifacts exceed `max_bytes`, the least
+    recently used ones are evicted. Reads only write the time an artifact was accessed when it is
+    older than `ACCESS_INTERVAL`, so that hits do not take the write lock, and the total size is
+    kept up to date by triggers in a one-row table rather than summed on every write.
+    """
+    __cache = None
+
+    # Bump when the format of cached artifacts changes, so that old entries are ignored
+    VERSION = 1
+    # Artifact kinds
+    SLIDES = "slides"
+    NORMALIZED = "normalized"
+    BUNDLE = "bundle"
+    PART = "part"
+    MANIFEST = "manifest"
+    FILE_HASH = "file_hash"
+
+    # Seconds for which reading an artifact again does not update its access time
+    ACCESS_INTERVAL = 300
+
+    @staticmethod
+    def connect():
+        """
+        Returns the cache of this process, or None if the cache is disabled
+        """
+        if not Config.ARTIFACT_CACHE_ENABLED:
+            return None
+        if ArtifactCache.__cache is None:
+            ArtifactCache.__cache = ArtifactCache(
+                Config.ARTIFACT_CACHE_PATH, Config.ARTIFACT_CACHE_MAX_BYTES
+            )
+        return ArtifactCache.__cache
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS artifacts (
+                    hash TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (hash, kind)
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed)")
+            # Total size of the artifacts, summed once for a cache created before it was kept
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts_total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            db.execute("INSERT OR IGNORE INTO artifacts_total (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM artifacts")
+            db.execute(
+                """CREATE TRIGGER IF NOT EXISTS artifacts_inserted AFTER INSERT ON artifacts BEGIN
+                    UPDATE artifacts_total SET size = size + NEW.size;
+                END"""
+            )
+            db.execute(
+                """CREATE TRIGGER IF NOT EXISTS artifacts_updated AFTER UPDATE OF size ON artifacts BEGIN
+                    UPDATE artifacts_total SET size = size + NEW.size - OLD.size;
+                END"""
+            )
+            db.execute(
+                """CREATE TRIGGER IF NOT EXISTS artifacts_deleted AFTER DELETE ON artifacts BEGIN
+                    UPDATE artifacts_total SET size = size - OLD.size;
+                END"""
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def _db(self):
+        """SQLite connections cannot be shared between threads, so each thread opens its own"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _kind(self, kind):
+        return f"{kind}:{self.VERSION}"
+
+    def get(self, file_hash, kind):
+        """Returns the artifact `kind` of the presentation with hash `file_hash` as bytes, or None"""
+        try:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, accessed FROM artifacts WHERE hash = ? AND kind = ?",
+                (file_hash, self._kind(kind))
+            ).fetchone()
+            if row is None:
+                REQUESTS.inc(kind=kind, result="miss")
+                return None
+            REQUESTS.inc(kind=kind, result="hit")
+            value, accessed = row
+            now = time.time()
+            if accessed < now - self.ACCESS_INTERVAL:
+                db.execute(
+                    "UPDATE artifacts SET accessed = ? WHERE hash = ? AND kind = ? AND accessed < ?",
+                    (now, file_hash, self._kind(kind), now - self.ACCESS_INTERVAL)
+                )
+            return value
+        except sqlite3.Error as e:
+            print("Artifact cache read failed:", e)
+            return None
+
+    def set(self, file_hash, kind, value):
+        """Stores the artifact `kind` of the presentation with hash `file_hash`, evicting old artifacts if needed"""
+        self.set_many([(file_hash, kind, value)])
+
+    def set_many(self, artifacts):
+        """Stores a list of (file_hash, kind, value) artifacts in a single transaction"""
+        now = time.time()
+        rows = [
+            (file_hash, self._kind(kind), value, len(value), now)
+            for file_hash, kind, value in artifacts
+            if len(value) <= self.max_bytes
+        ]
+        if not rows:
+            return
+        try:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # An upsert rather than INSERT OR REPLACE, whose deletes do not fire triggers
+                db.executemany(
+                    """INSERT INTO artifacts (hash, kind, value, size, accessed) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (hash, kind) DO UPDATE SET
+                        value = excluded.value, size = excluded.size, accessed = excluded.accessed""",
+                    rows
+                )
+                self._evict(db)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print("Artifact cache write failed:", e)
+
+    def _evict(self, db):
+        """Deletes the least recently used artifacts until the total size is within `max_bytes`"""
+        total = self.total_size(db)
+        if total <= self.max_bytes:
+            return
+        rows = db.execute("SELECT rowid, size FROM artifacts ORDER BY accessed")
+        evict = []
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((rowid,))
+            total -= size
+        db.executemany("DELETE FROM artifacts WHERE rowid = ?", evict)
+
+    def total_size(self, db=None):
+        """Returns the total size of the stored artifacts in bytes"""
+        return (db or self._db()).execute("SELECT size FROM artifacts_total").fetchone()[0]
+
+    def get_json(self, file_hash, kind):
+        """Returns a JSON artifact as a python object, or None"""
+        value = self.get(file_hash, kind)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, file_hash, kind, value):
+        """Stores a python object as a JSON artifact"""
+        self.set(file_hash, kind, json.dumps(value).encode("utf-8"))
+
+    def clear(self):
+        """Deletes all artifacts"""
+        self._db().execute("DELETE FROM artifacts")
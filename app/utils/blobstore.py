@@ -0,0 +1,316 @@
+"""
+    Content-addressed storage of uploaded and generated presentations
+"""
+import datetime
+import hashlib
+import os
+import tempfile
+
+from pymongo import ReturnDocument
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+
+
+class BlobStore:
+    """
+    Stores files once by the SHA-256 of their content. Files are referenced by a name, e.g. the
+    virtual filename of a document, which is resolved to the blob without a database lookup.
+    References to each blob are counted in MongoDB, and blobs left without references are deleted
+    by `collect_garbage` after a grace period.
+
+    Subclasses implement the storage of blobs and names, e.g. on a local disk or in a bucket.
+    """
+    __store = None
+
+    # Size of the chunks read while storing a file
+    CHUNK_SIZE = 1024 * 1024
+
+    @staticmethod
+    def connect():
+        """Returns the blob store of this process"""
+        if BlobStore.__store is None:
+            # Also with `GCP_PROD_ENV`: files were never written to a bucket there (saving them was a
+            # no-op), and reading slide parts and serving downloads need local paths. On GCP, mount
+            # the bucket or a persistent volume at `BLOB_STORE_FOLDER`, e.g. with Cloud Storage FUSE.
+            BlobStore.__store = LocalBlobStore(Config.BLOB_STORE_FOLDER)
+        return BlobStore.__store
+
+    def store(self, name, file, blob_hash=None):
+        """
+        Stores the content of `file`, a file object or a path, and points `name` to it. A path is
+        moved into the store. Returns the hash of the content.
+        """
+        blob_hash = self.put(file, blob_hash)
+        self.link(name, blob_hash)
+        return blob_hash
+
+    def link(self, name, blob_hash):
+        """Points `name` to the blob `blob_hash`, releasing the blob it pointed to before"""
+        # Referenced before the name points to it, so that it is not collected in between
+        self._add_ref(blob_hash, 1)
+        names = MongoClient.connect()[Config.MONGO_BLOB_NAMES_COLLECTION]
+        # The swap is atomic, so that concurrent links of a name each release the blob they replaced
+        previous = names.find_one_and_update(
+            {"_id": name},
+            {"$set": {"blob": blob_hash, "updatedOn": datetime.datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        # Names linked before they were recorded in MongoDB only have their file
+        previous = previous["blob"] if previous else self.resolve(name)
+        self._sync_ref(name, blob_hash)
+        if previous:
+            self._add_ref(previous, -1)
+
+    def unlink(self, name):
+        """Removes `name`, releasing the blob it pointed to"""
+        names = MongoClient.connect()[Config.MONGO_BLOB_NAMES_COLLECTION]
+        previous = names.find_one_and_delete({"_id": name})
+        previous = previous["blob"] if previous else self.resolve(name)
+        self._sync_ref(name, None)
+        if previous:
+            self._add_ref(previous, -1)
+
+    def _sync_ref(self, name, blob_hash):
+        """
+        Writes the name as swapped in MongoDB. A concurrent link may have swapped it again before
+        this write, in which case the name is written again as MongoDB has it, so that the last
+        writer leaves it as the last swap.
+        """
+        names = MongoClient.connect()[Config.MONGO_BLOB_NAMES_COLLECTION]
+        while True:
+            if blob_hash:
+                self._write_ref(name, blob_hash)
+            else:
+                self._delete_ref(name)
+            current = names.find_one({"_id": name}, {"blob": 1})
+            current = current["blob"] if current else None
+            if current == blob_hash:
+                return
+            blob_hash = current
+
+    def resolve_path(self, name):
+        """Returns the local path of the blob `name` points to, or None"""
+        blob_hash = self.resolve(name)
+        return self.path(blob_hash) if blob_hash else None
+
+    def collect_garbage(self, grace_seconds=3600):
+        """
+        Deletes the blobs that have had no references for `grace_seconds`. Storing or linking a blob
+        marks it as used, so a blob stored again while it is collected is kept: it is moved aside,
+        its reference document is deleted only if it is still unused and unreferenced, and it is
+        moved back otherwise. Returns the number of blobs deleted.
+        """
+        m_db = MongoClient.connect()
+        collection = m_db[Config.MONGO_BLOB_REFS_COLLECTION]
+
+        deleted = 0
+        threshold = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+        unused = {"refs": {"$lte": 0}, "updatedOn": {"$lt": threshold}}
+        for ref in collection.find(unused, {"_id": 1}):
+            trash = self._trash(ref["_id"])
+            if collection.delete_one({"_id": ref["_id"], **unused}).deleted_count:
+                self._purge(trash)
+                deleted += 1
+            else:
+                self._restore(ref["_id"], trash)
+        return deleted
+
+    def _add_ref(self, blob_hash, count):
+        m_db = MongoClient.connect()
+        return m_db[Config.MONGO_BLOB_REFS_COLLECTION].find_one_and_update(
+            {"_id": blob_hash},
+            {"$inc": {"refs": count}, "$set": {"updatedOn": datetime.datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )["refs"]
+
+    def _touch(self, blob_hash):
+        """Marks a blob as used, before it is stored, so that it is not collected meanwhile"""
+        m_db = MongoClient.connect()
+        m_db[Config.MONGO_BLOB_REFS_COLLECTION].update_one(
+            {"_id": blob_hash},
+            {"$set": {"updatedOn": datetime.datetime.utcnow()}, "$setOnInsert": {"refs": 0}},
+            upsert=True,
+        )
+
+    # Implemented by each storage backend
+
+    def put(self, file, blob_hash=None):
+        """Stores the content of `file` and returns its hash. The hash is computed unless given"""
+        raise NotImplementedError
+
+    def append(self, upload_id, offset, stream):
+        """
+        Writes `stream` at `offset` of the partial upload `upload_id`, dropping anything written
+        after `offset` before. Returns the new size of the upload.
+        """
+        raise NotImplementedError
+
+    def commit(self, upload_id):
+        """Moves a complete upload into the store, hashing it once, and returns its hash"""
+        raise NotImplementedError
+
+    def discard(self, upload_id):
+        """Deletes a partial upload"""
+        raise NotImplementedError
+
+    def open(self, blob_hash):
+        """Returns a binary file object with the content of a blob"""
+        raise NotImplementedError
+
+    def path(self, blob_hash):
+        """Returns the local path of a blob, or None if the backend does not store blobs locally"""
+        raise NotImplementedError
+
+    def exists(self, blob_hash):
+        raise NotImplementedError
+
+    def _trash(self, blob_hash):
+        """Moves a blob aside to be deleted, and returns where to, or None if it does not exist"""
+        raise NotImplementedError
+
+    def _purge(self, trash):
+        """Deletes a blob moved aside by `_trash`"""
+        raise NotImplementedError
+
+    def _restore(self, blob_hash, trash):
+        """Moves a blob moved aside by `_trash` back"""
+        raise NotImplementedError
+
+    def resolve(self, name):
+        """Returns the hash of the blob `name` points to, or None"""
+        raise NotImplementedError
+
+    def _write_ref(self, name, blob_hash):
+        raise NotImplementedError
+
+    def _delete_ref(self, name):
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Stores blobs under `folder/blobs/ab/cd/<sha256>` and names under `folder/refs/ab/cd/<sha256 of name>`,
+    sharded by the hash of the content and of the name so that no directory grows too large. Files
+    are written to a temporary file and renamed, so a blob or name is never seen half written.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.temp_folder = os.path.join(folder, "tmp")
+        os.makedirs(self.temp_folder, exist_ok=True)
+
+    @staticmethod
+    def _shard(key):
+        return os.path.join(key[:2], key[2:4], key)
+
+    def temp_path(self, suffix=""):
+        """Returns a new path on the same file system as the blobs, to write a file to store later"""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.temp_folder)
+        os.close(fd)
+        os.remove(path)
+        return path
+
+    def put(self, file, blob_hash=None):
+        if isinstance(file, str):
+            blob_hash = blob_hash or self._hash_file(file)
+            temp_path = file
+        else:
+            temp_path = self.temp_path()
+            digest = hashlib.sha256()
+            file.seek(0)
+            with open(temp_path, "wb") as f:
+                for chunk in iter(lambda: file.read(self.CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            file.seek(0)
+            blob_hash = digest.hexdigest()
+
+        # Replaced even if it exists, in case it is being collected. Marked as used first, so that
+        # garbage collection moves it back if it moved it aside
+        self._touch(blob_hash)
+        blob_path = self.path(blob_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(temp_path, blob_path)
+        return blob_hash
+
+    def _partial_path(self, upload_id):
+        return os.path.join(self.temp_folder, f"upload-{upload_id}.part")
+
+    def append(self, upload_id, offset, stream):
+        partial_path = self._partial_path(upload_id)
+        with open(partial_path, "r+b" if os.path.exists(partial_path) else "wb") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b""):
+                f.write(chunk)
+            return f.tell()
+
+    def commit(self, upload_id):
+        return self.put(self._partial_path(upload_id))
+
+    def discard(self, upload_id):
+        try:
+            os.remove(self._partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def open(self, blob_hash):
+        return open(self.path(blob_hash), "rb")
+
+    def path(self, blob_hash):
+        return os.path.join(self.folder, "blobs", self._shard(blob_hash))
+
+    def exists(self, blob_hash):
+        return os.path.exists(self.path(blob_hash))
+
+    def _trash(self, blob_hash):
+        trash = self.temp_path(".deleted")
+        try:
+            os.replace(self.path(blob_hash), trash)
+        except FileNotFoundError:
+            return None
+        return trash
+
+    def _purge(self, trash):
+        if trash:
+            os.remove(trash)
+
+    def _restore(self, blob_hash, trash):
+        if trash:
+            # The same content, if it was stored again meanwhile
+            os.replace(trash, self.path(blob_hash))
+
+    def _ref_path(self, name):
+        name_hash = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, "refs", name_hash[:2], name_hash[2:4], name_hash)
+
+    def resolve(self, name):
+        try:
+            with open(self._ref_path(name), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _write_ref(self, name, blob_hash):
+        ref_path = self._ref_path(name)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        temp_path = self.temp_path()
+        with open(temp_path, "w") as f:
+            f.write(blob_hash)
+        os.replace(temp_path, ref_path)
+
+    def _delete_ref(self, name):
+        try:
+            os.remove(self._ref_path(name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,254 @@
+"""
+    Creates the MongoDB indexes and ElasticSearch index template the application relies on.
+    Every step is idempotent, so it is safe to run on every startup.
+"""
+import threading
+import traceback
+
+from bson import ObjectId
+from elasticsearch.exceptions import BadRequestError
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.config import Config
+from app.models.elasticClient import ElasticClient
+from app.models.mongoClient import MongoClient
+
+
+class Bootstrap:
+
+    # Unique index on the names of files. Uploads check names themselves while it is missing
+    UNIQUE_FILENAME_INDEX = "unique_filename_per_folder"
+
+    # Indexes of each MongoDB collection as (keys, options)
+    MONGO_INDEXES = {
+        Config.MONGO_DOCUMENT_MASTER_COLLECTION: [
+            # Unique name per user and folder. Also serves lookups by `createdBy._id` alone
+            ([("createdBy._id", ASCENDING), ("root", ASCENDING), ("originalFileName", ASCENDING)],
+             {"name": UNIQUE_FILENAME_INDEX, "unique": True}),
+            ([("virtualFileName", ASCENDING)],
+             {"name": "virtualFileName"}),
+        ],
+        Config.MONGO_FILENAME_COUNTER_COLLECTION: [
+            ([("createdBy", ASCENDING), ("root", ASCENDING), ("fileName", ASCENDING)],
+             {"name": "unique_counter_per_filename", "unique": True}),
+        ],
+        # Generated presentations deleted by age, and by user when over quota
+        Config.MONGO_GENERATED_DECKS_COLLECTION: [
+            ([("accessedOn", ASCENDING)],
+             {"name": "accessedOn"}),
+            ([("userId", ASCENDING), ("accessedOn", ASCENDING)],
+             {"name": "userId_accessedOn"}),
+        ],
+        Config.MONGO_GENERATED_USAGE_COLLECTION: [
+            ([("size", ASCENDING)],
+             {"name": "size"}),
+        ],
+        # Blobs without references, deleted by garbage collection
+        Config.MONGO_BLOB_REFS_COLLECTION: [
+            ([("refs", ASCENDING), ("updatedOn", ASCENDING)],
+             {"name": "unreferenced_blobs"}),
+        ],
+        # Uploads without chunks for a while, deleted as expired
+        Config.MONGO_UPLOADS_COLLECTION: [
+            ([("updatedOn", ASCENDING)],
+             {"name": "updatedOn"}),
+        ],
+    }
+
+    # Duplicates printed when a unique index cannot be created
+    MAX_DUPLICATES_REPORTED = 20
+
+    ELASTIC_TEMPLATE = f"{Config.ELASTIC_INDEX}-template"
+
+    ELASTIC_MAPPINGS = {
+        "dynamic": "strict",
+        # Slides are routed by `user_id` so that searches, which are always for one user, hit one shard
+        "_routing": {"required": True},
+        # Only needed to diff slides on re-upload, which reads the hashes from MongoDB
+        "_source": {"excludes": ["content_hash"]},
+        "properties": {
+            "user_id": {"type": "keyword"},
+            "title": {"type": "text"},
+            "content": {"type": "text"},
+            "slide_id": {"type": "keyword", "index": False},
+            "slide_index": {"type": "integer"},
+            "content_hash": {"type": "keyword", "index": False},
+            "virtualFileName": {"type": "keyword"},
+            "originalFileName": {"type": "keyword", "index": False},
+            "root": {"type": "keyword"},
+        }
+    }
+
+    @staticmethod
+    def start():
+        """Runs `run` in a background thread, printing its result or error"""
+        def run():
+            try:
+                print("Bootstrap:", Bootstrap.run())
+            except Exception:
+                traceback.print_exc()
+
+        threading.Thread(target=run, name="bootstrap", daemon=True).start()
+
+    @staticmethod
+    def run():
+        """Creates all indexes and templates, then checks that the hot queries use them"""
+        Bootstrap.create_mongo_indexes()
+        Bootstrap.create_elastic_index()
+        return Bootstrap.explain_mongo_queries()
+
+    @staticmethod
+    def create_mongo_indexes():
+        """
+        Creates the indexes in `MONGO_INDEXES`. Creating an index that already exists is a no-op.
+        A unique index is skipped while documents written before it existed share its keys; they
+        are printed so that they can be renamed or deleted before the next startup.
+        """
+        m_db = MongoClient.connect()
+
+        for collection, indexes in Bootstrap.MONGO_INDEXES.items():
+            for keys, options in indexes:
+                try:
+                    m_db[collection].create_index(keys, **options)
+                except DuplicateKeyError:
+                    Bootstrap._report_duplicates(m_db[collection], keys, options["name"])
+            print(f"Created indexes of {collection}")
+
+    @staticmethod
+    def _report_duplicates(collection, keys, name):
+        """Prints the keys of the unique index `name` shared by several documents of `collection`"""
+        fields = [field for field, _ in keys]
+        duplicates = list(collection.aggregate([
+            {"$group": {
+                "_id": {field.replace(".", "_"): f"${field}" for field in fields},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": Bootstrap.MAX_DUPLICATES_REPORTED},
+        ], allowDiskUse=True))
+
+        print(
+            f"⚠️ Index {name} of {collection.name} not created: documents share its keys {fields}. "
+            f"Rename or delete all but one document of each group, then restart. Until then, uniqueness "
+            f"is checked before each insert, which does not prevent concurrent duplicates:"
+        )
+        for duplicate in duplicates:
+            print(f"  {duplicate['_id']}: {[str(_id) for _id in duplicate['ids']]}")
+        if len(duplicates) == Bootstrap.MAX_DUPLICATES_REPORTED:
+            print(f"  (first {Bootstrap.MAX_DUPLICATES_REPORTED} groups only)")
+
+    @staticmethod
+    def create_elastic_index():
+        """
+        Stores the index template of `Config.ELASTIC_INDEX` and creates the index if it does not
+        exist. For an existing index, new fields are added to its mapping and its refresh interval
+        updated; fields whose mapping changed need the index to be reindexed.
+        """
+        es = ElasticClient.connect(ElasticClient.ADMIN)
+        index = Config.ELASTIC_INDEX
+        settings = {"refresh_interval": Config.ELASTIC_REFRESH_INTERVAL}
+
+        es.indices.put_index_template(
+            name=Bootstrap.ELASTIC_TEMPLATE,
+            index_patterns=[index, f"{index}-*"],
+            template={
+                "settings": settings,
+                "mappings": Bootstrap.ELASTIC_MAPPINGS,
+            },
+        )
+
+        if not es.indices.exists(index=index):
+            es.indices.create(index=index)
+            print(f"Created index {index}")
+            return
+
+        es.indices.put_settings(index=index, settings=settings)
+        try:
+            es.indices.put_mapping(
+                index=index, 
+                properties=Bootstrap.ELASTIC_MAPPINGS["properties"]
+            )
+        except BadRequestError as e:
+            print(f"Mapping of {index} differs from {Bootstrap.ELASTIC_TEMPLATE}, reindex to apply it: {e}")
+
+        if not Bootstrap.is_routed(es, index):
+            print(f"⚠️ Index {index} was created without routing, run `flask --app main migrate-routing`")
+
+    @staticmethod
+    def migrate_to_routing():
+        """
+        Copies the index `Config.ELASTIC_INDEX`, created before slides were routed by `user_id`, to a
+        new index `<index>-routed` with every slide routed by its `user_id`. The old index is then
+        replaced by an alias of the same name pointing to the new index in one atomic step.
+        """
+        es = ElasticClient.connect(ElasticClient.ADMIN)
+        index = Config.ELASTIC_INDEX
+        new_index = f"{index}-routed"
+
+        if Bootstrap.is_routed(es, index):
+            print(f"{index} is already routed by user_id")
+            return
+
+        # Mappings and settings come from the index template
+        es.options(ignore_status=400).indices.create(index=new_index)
+
+        print(f"Reindexing {index} to {new_index}")
+        resp = es.options(request_timeout=Config.REQUEST_TIMEOUT).reindex(
+            source={"index": index},
+            dest={"index": new_index},
+            script={"source": "ctx._routing = ctx._source.user_id", "lang": "painless"},
+            wait_for_completion=True,
+            refresh=True,
+        )
+        if resp["failures"]:
+            raise Exception("Failed to reindex documents", resp["failures"])
+        print(f"Reindexed {resp['total']} documents")
+
+        es.indices.update_aliases(actions=[
+            {"add": {"index": new_index, "alias": index}},
+            {"remove_index": {"index": index}},
+        ])
+        print(f"{index} is now an alias of {new_index}")
+
+    @staticmethod
+    def is_routed(es, index):
+        """Whether every index behind `index` requires routing"""
+        mappings = es.indices.get_mapping(index=index)
+        return all(
+            mapping["mappings"].get("_routing", {}).get("required", False)
+            for mapping in mappings.values()
+        )
+
+    @staticmethod
+    def explain_mongo_queries():
+        """
+        Explains the frequent queries on the documents collection and warns about the ones that
+        scan the whole collection.
+
+        Returns:
+            dict: Name of each query and whether it uses an index
+        """
+        m_db = MongoClient.connect()
+        collection = m_db[Config.MONGO_DOCUMENT_MASTER_COLLECTION]
+        user_id = ObjectId()
+
+        queries = {
+            "virtualFileName": {"virtualFileName": f"{user_id}.pptx"},
+            "createdBy._id": {"createdBy._id": user_id},
+            "root/originalFileName": {
+                "createdBy._id": user_id,
+                "root": "/",
+                "originalFileName": "bootstrap.pptx",
+            },
+        }
+
+        results = {}
+        for name, query in queries.items():
+            plan = collection.find(query).explain()["queryPlanner"]["winningPlan"]
+            results[name] = "IXSCAN" in str(plan)
+            if not results[name]:
+                print(f"⚠️ Query on {name} does not use an index: {plan}")
+
+        return results
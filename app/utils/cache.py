@@ -0,0 +1,62 @@
+"""
+    In-process caches shared by the services
+"""
+import threading
+import time
+
+from collections import OrderedDict
+
+from app.utils.metrics import Metrics
+
+REQUESTS = Metrics.counter("cache_requests_total", "Lookups in the in-process caches by cache and result", ("cache", "result"))
+
+
+class TTLCache:
+    """
+    Thread-safe cache that keeps at most `maxsize` entries, each for at most `ttl` seconds.
+    When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value stored for `key`, or `default` if it is missing or expired"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                REQUESTS.inc(cache=self.name, result="miss")
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                REQUESTS.inc(cache=self.name, result="miss")
+                return default
+            self._data.move_to_end(key)
+            REQUESTS.inc(cache=self.name, result="hit")
+            return value
+
+    def set(self, key, value):
+        """Stores `value` for `key`, evicting the least recently used entry if the cache is full"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Removes `key` from the cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
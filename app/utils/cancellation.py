@@ -0,0 +1,176 @@
+"""
+    Cooperative cancellation of long running work that nobody waits for anymore
+"""
+import json
+import threading
+import time
+import traceback
+import uuid
+
+from app.models.redisClient import RedisClient
+
+
+class Cancelled(Exception):
+    """Raised by the work of a cancelled `CancellationToken`"""
+
+
+class CancellationToken:
+    """
+    Passed down to long running work, which checks it between steps, e.g. between slides, and
+    stops with `Cancelled` once it is cancelled. Cancelling only sets a flag, so it is safe from
+    any thread.
+    """
+
+    # Reasons for cancelling
+    REQUESTED = "requested"
+    SUPERSEDED = "superseded"
+    DISCONNECTED = "disconnected"
+
+    def __init__(self, user_id, kind):
+        self.user_id = str(user_id)
+        self.kind = kind
+        self.job_id = str(uuid.uuid4())
+        self.created = time.time()
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason=REQUESTED):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+class Cancellations:
+    """
+    Tokens of the work running or queued for each user. A user runs one job of each kind at a time:
+    starting a job cancels the previous one of the same kind, whose result would be discarded.
+
+    The requests of a user reach any worker process, so cancellations are also published on the
+    Redis message queue when there is one, and every process cancels its own tokens that match.
+    """
+
+    # Redis channel of the cancellations of all processes
+    CHANNEL = "cancellations"
+    # Sent with every cancellation, to ignore the ones published by this process
+    ORIGIN = str(uuid.uuid4())
+    # Seconds waited before subscribing again after an error
+    RETRY_DELAY = 5
+
+    __lock = threading.Lock()
+    __tokens = {}
+    __thread = None
+    __stop = threading.Event()
+
+    @staticmethod
+    def start(user_id, kind):
+        """Returns the token of a new job of the user, cancelling the job of the same kind it supersedes"""
+        token = CancellationToken(user_id, kind)
+        with Cancellations.__lock:
+            previous = Cancellations.__tokens.get((token.user_id, kind))
+            Cancellations.__tokens[(token.user_id, kind)] = token
+        if previous:
+            previous.cancel(CancellationToken.SUPERSEDED)
+        # Jobs of the same kind started before in other processes
+        Cancellations._publish(token.user_id, kind, None, CancellationToken.SUPERSEDED, before=token.created)
+        return token
+
+    @staticmethod
+    def finish(token):
+        """Forgets the token of a job that ended"""
+        with Cancellations.__lock:
+            if Cancellations.__tokens.get((token.user_id, token.kind)) is token:
+                del Cancellations.__tokens[(token.user_id, token.kind)]
+
+    @staticmethod
+    def cancel(user_id, kind=None, job_id=None, reason=CancellationToken.REQUESTED):
+        """
+        Cancels the jobs of the user in every process, only those of `kind` or the job `job_id` if
+        given. Returns the ids of the jobs cancelled in this process.
+        """
+        job_ids = Cancellations._cancel(str(user_id), kind, job_id, reason)
+        Cancellations._publish(str(user_id), kind, job_id, reason)
+        return job_ids
+
+    @staticmethod
+    def _cancel(user_id, kind, job_id, reason, before=None):
+        """Cancels the matching jobs of this process, only those started before `before` if given"""
+        with Cancellations.__lock:
+            tokens = [
+                token for (token_user_id, token_kind), token in Cancellations.__tokens.items()
+                if token_user_id == user_id
+                and (kind is None or token_kind == kind)
+                and (job_id is None or token.job_id == job_id)
+                and (before is None or token.created < before)
+            ]
+        for token in tokens:
+            token.cancel(reason)
+        return [token.job_id for token in tokens]
+
+    @staticmethod
+    def _publish(user_id, kind, job_id, reason, before=None):
+        """Sends a cancellation to the other processes, if there are any"""
+        client = RedisClient.connect()
+        if client is None:
+            return
+        message = {
+            "origin": Cancellations.ORIGIN,
+            "userId": user_id,
+            "kind": kind,
+            "jobId": job_id,
+            "reason": reason,
+            # Clocks of the processes of one deployment are assumed to agree
+            "before": before,
+        }
+        try:
+            client.publish(Cancellations.CHANNEL, json.dumps(message))
+        except Exception as e:
+            print("Failed to publish cancellation:", e)
+
+    @staticmethod
+    def listen():
+        """Starts receiving the cancellations of the other processes, once per process"""
+        if RedisClient.connect() is None:
+            return
+        with Cancellations.__lock:
+            if Cancellations.__thread and Cancellations.__thread.is_alive():
+                return
+            Cancellations.__stop.clear()
+            Cancellations.__thread = threading.Thread(
+                target=Cancellations._run, name="cancellations", daemon=True
+            )
+            Cancellations.__thread.start()
+
+    @staticmethod
+    def stop():
+        Cancellations.__stop.set()
+
+    @staticmethod
+    def _run():
+        while not Cancellations.__stop.is_set():
+            try:
+                pubsub = RedisClient.connect().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(Cancellations.CHANNEL)
+                while not Cancellations.__stop.is_set():
+                    message = pubsub.get_message(timeout=1)
+                    if message:
+                        Cancellations._receive(message["data"])
+            except Exception:
+                traceback.print_exc()
+                Cancellations.__stop.wait(Cancellations.RETRY_DELAY)
+
+    @staticmethod
+    def _receive(data):
+        message = json.loads(data)
+        if message["origin"] == Cancellations.ORIGIN:
+            return
+        Cancellations._cancel(
+            message["userId"], message["kind"], message["jobId"], message["reason"], message["before"]
+        )
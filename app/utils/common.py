@@ -1,18 +1,18 @@
 """
     Common functions accessible throughout the application
 """
-import json
 import re
 import os
 import traceback
+import zlib
 
-from bson import json_util
 from typing import Any
 from urllib.parse import urlsplit
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app.config import Config
 from app.models.mongoClient import MongoClient
+from app.utils.serializer import Serializer
 
 
 class Common:
@@ -79,20 +79,38 @@ class Common:
 
         try:
 
-            # iterate over cursor to get a list of dicts
-            cursor_dict = [doc for doc in cursor]
-
-            # serialize to json string
-            cursor_dict_string = json.dumps(cursor_dict, default=json_util.default)
-
-            # json from json string
-            cursor_dict = json.loads(cursor_dict_string)
+            # convert BSON values of each document in a single pass
+            cursor_dict = [Serializer.to_json_compatible(doc) for doc in cursor]
 
             return cursor_dict
 
         except Exception as e:
             Common.exception_details("common.py : cursor_to_dict", e)
 
+    @staticmethod
+    def compress_text(text):
+        """Compresses a string for storage
+
+        Args:
+            text (str): Text to compress
+
+        Returns:
+            bytes: zlib compressed UTF-8 text
+        """
+        return zlib.compress(text.encode("utf-8"))
+
+    @staticmethod
+    def decompress_text(data):
+        """Decompresses a string compressed with `compress_text`
+
+        Args:
+            data (bytes): Compressed text
+
+        Returns:
+            str: Original text
+        """
+        return zlib.decompress(data).decode("utf-8")
+
     @staticmethod
     def process_response(response):
         """Converts a response object to python dictionary and avoid type errors
@@ -104,7 +122,9 @@ class Common:
                 dict: Python dictionary representation of input Response
         """
 
-        processed_response = json.loads(json_util.dumps(response, default=str))
+        processed_response = Serializer.to_json_compatible(
+            response, fallback=Serializer.bson_or_str
+        )
 
         return processed_response
 
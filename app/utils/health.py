@@ -0,0 +1,94 @@
+"""
+    Reachability of the databases, checked in the background
+"""
+import datetime
+import threading
+import traceback
+
+from app.config import Config
+from app.models.elasticClient import ElasticClient
+from app.models.mongoClient import MongoClient
+
+
+class HealthCheck:
+    """
+    Pings ElasticSearch and MongoDB every `HEALTH_CHECK_INTERVAL` seconds in a background thread and
+    keeps the result, so that startup does not wait for the databases and requests can read their
+    state without a round trip. Clients connect on first use; a database that is down at startup
+    is reported here instead of failing the import of the app.
+    """
+
+    ELASTIC = "elastic"
+    MONGO = "mongo"
+
+    __thread = None
+    __stop = threading.Event()
+    __lock = threading.Lock()
+    status = {
+        ELASTIC: {"healthy": None, "checkedOn": None, "error": None},
+        MONGO: {"healthy": None, "checkedOn": None, "error": None},
+    }
+
+    @staticmethod
+    def _ping(name):
+        if name == HealthCheck.ELASTIC:
+            return ElasticClient.connect().options(
+                request_timeout=Config.HEALTH_CHECK_TIMEOUT, max_retries=0
+            ).ping()
+        MongoClient.connect().client.admin.command(
+            "ping", maxTimeMS=Config.HEALTH_CHECK_TIMEOUT * 1000
+        )
+        return True
+
+    @staticmethod
+    def start():
+        """Starts checking periodically, once per process. The first check runs right away"""
+        with HealthCheck.__lock:
+            if HealthCheck.__thread and HealthCheck.__thread.is_alive():
+                return
+            HealthCheck.__stop.clear()
+            HealthCheck.__thread = threading.Thread(
+                target=HealthCheck._run, name="health-check", daemon=True
+            )
+            HealthCheck.__thread.start()
+
+    @staticmethod
+    def stop():
+        HealthCheck.__stop.set()
+
+    @staticmethod
+    def _run():
+        while True:
+            for name in HealthCheck.status:
+                HealthCheck.check(name)
+            if HealthCheck.__stop.wait(Config.HEALTH_CHECK_INTERVAL):
+                return
+
+    @staticmethod
+    def check(name):
+        """Pings a database now and records the result. Returns whether it is reachable"""
+        error = None
+        try:
+            healthy = bool(HealthCheck._ping(name))
+        except Exception as e:
+            healthy, error = False, str(e)
+
+        with HealthCheck.__lock:
+            status = HealthCheck.status[name]
+            if status["healthy"] != healthy:
+                print(f"{name}: {'reachable' if healthy else 'unreachable'}", error or "")
+            status.update(healthy=healthy, checkedOn=datetime.datetime.utcnow(), error=error)
+        return healthy
+
+    @staticmethod
+    def pools():
+        """Returns the usage of the connection pools of this process"""
+        return {
+            HealthCheck.ELASTIC: ElasticClient.pool_metrics(),
+            HealthCheck.MONGO: {"size": Config.MONGO_MAX_POOL_SIZE, **MongoClient.pool_metrics.to_metrics()},
+        }
+
+    @staticmethod
+    def is_healthy(name):
+        """Returns whether a database was reachable at the last check, or None before the first check"""
+        return HealthCheck.status[name]["healthy"]
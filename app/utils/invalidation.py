@@ -0,0 +1,190 @@
+"""
+    Broadcasts cache invalidations to every process by tailing a change stream on DOCUMENTS_MASTER
+"""
+import threading
+import traceback
+
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+
+
+class InvalidationEvent:
+    """An invalidation delivered to the registered caches"""
+
+    # A record was inserted, modified or deleted
+    DECK_UPDATED = "deck_updated"
+    # Anything cached per user (e.g. search results) is stale for this user, or for every user if None
+    USER_GENERATION_BUMPED = "user_generation_bumped"
+
+    def __init__(self, type, event_id, file_id=None, user_id=None, virtual_filename=None):
+        self.type = type
+        self.event_id = event_id
+        self.file_id = file_id
+        self.user_id = user_id
+        self.virtual_filename = virtual_filename
+
+    def __repr__(self):
+        return f"InvalidationEvent({self.type}, file_id={self.file_id}, user_id={self.user_id})"
+
+
+class InvalidationBus:
+    """
+    Tails a change stream on DOCUMENTS_MASTER in a background thread and delivers an
+    `InvalidationEvent` to every registered cache of this process. Every change is delivered at most
+    once per process, even after the stream is resumed. When the stream cannot be resumed, changes
+    may have been missed and every registered cache is flushed instead.
+    """
+
+    # Number of event ids remembered to drop changes delivered twice after a resume
+    SEEN_EVENTS = 10000
+    # Seconds waited before reopening a failed stream
+    RETRY_DELAY = 5
+    # Error codes of a change stream that cannot be resumed from its token
+    UNRESUMABLE_CODES = {260, 280, 286}
+    # Error codes of a server that does not support change streams (not a replica set)
+    UNSUPPORTED_CODES = {40573}
+    # Fields of the changes read by `_dispatch`. The full documents looked up for updates hold every
+    # slide of a deck, which the server would otherwise send to every process on every change.
+    PIPELINE = [{"$project": {
+        "operationType": 1,
+        "documentKey._id": 1,
+        "fullDocument.virtualFileName": 1,
+        "fullDocument.createdBy._id": 1,
+    }}]
+
+    __thread = None
+    __stop = threading.Event()
+    __lock = threading.Lock()
+    __handlers = []
+    __seen = OrderedDict()
+
+    @staticmethod
+    def register(on_event, on_flush):
+        """
+        Registers a cache. `on_event` is called with each `InvalidationEvent` and `on_flush` without
+        arguments when the cache must be emptied. Both must be safe to call more than once.
+        """
+        with InvalidationBus.__lock:
+            InvalidationBus.__handlers.append((on_event, on_flush))
+
+    @staticmethod
+    def start():
+        """Starts tailing the change stream, once per process"""
+        if not Config.INVALIDATION_BUS_ENABLED:
+            return
+        with InvalidationBus.__lock:
+            if InvalidationBus.__thread and InvalidationBus.__thread.is_alive():
+                return
+            InvalidationBus.__stop.clear()
+            InvalidationBus.__thread = threading.Thread(
+                target=InvalidationBus._run, name="invalidation-bus", daemon=True
+            )
+            InvalidationBus.__thread.start()
+
+    @staticmethod
+    def stop():
+        """Stops tailing the change stream"""
+        InvalidationBus.__stop.set()
+
+    @staticmethod
+    def publish(event):
+        """Delivers an event to the registered caches of this process, unless it was already delivered"""
+        with InvalidationBus.__lock:
+            if event.event_id in InvalidationBus.__seen:
+                return
+            InvalidationBus.__seen[event.event_id] = True
+            while len(InvalidationBus.__seen) > InvalidationBus.SEEN_EVENTS:
+                InvalidationBus.__seen.popitem(last=False)
+            handlers = list(InvalidationBus.__handlers)
+
+        for on_event, _ in handlers:
+            try:
+                on_event(event)
+            except Exception:
+                traceback.print_exc()
+
+    @staticmethod
+    def flush():
+        """Empties every registered cache"""
+        with InvalidationBus.__lock:
+            handlers = list(InvalidationBus.__handlers)
+
+        print("Invalidation bus: flushing all caches")
+        for _, on_flush in handlers:
+            try:
+                on_flush()
+            except Exception:
+                traceback.print_exc()
+
+    @staticmethod
+    def _run():
+        collection = MongoClient.connect()[Config.MONGO_DOCUMENT_MASTER_COLLECTION]
+        resume_token = None
+
+        while not InvalidationBus.__stop.is_set():
+            try:
+                with collection.watch(
+                    InvalidationBus.PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=1000,
+                ) as stream:
+                    while stream.alive and not InvalidationBus.__stop.is_set():
+                        change = stream.try_next()
+                        if change is not None and change["operationType"] == "invalidate":
+                            # The collection was dropped or renamed, the stream cannot continue
+                            resume_token = None
+                            InvalidationBus.flush()
+                            break
+                        if change is not None:
+                            InvalidationBus._dispatch(change)
+                        resume_token = stream.resume_token
+
+            except OperationFailure as e:
+                if e.code in InvalidationBus.UNSUPPORTED_CODES:
+                    print("Invalidation bus: change streams are not supported by the database, stopping")
+                    return
+                if resume_token is not None and e.code in InvalidationBus.UNRESUMABLE_CODES:
+                    # Changes since the token are lost
+                    resume_token = None
+                    InvalidationBus.flush()
+                    continue
+                print("Invalidation bus: change stream failed:", e)
+
+            except PyMongoError as e:
+                print("Invalidation bus: change stream interrupted:", e)
+
+            InvalidationBus.__stop.wait(InvalidationBus.RETRY_DELAY)
+
+    @staticmethod
+    def _dispatch(change):
+        """Converts a change of DOCUMENTS_MASTER into invalidation events"""
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "dropDatabase"):
+            InvalidationBus.flush()
+            return
+
+        event_id = change["_id"]["_data"]
+        file_id = str(change["documentKey"]["_id"])
+        document = change.get("fullDocument") or {}
+        user_id = (document.get("createdBy") or {}).get("_id")
+        user_id = str(user_id) if user_id else None
+
+        InvalidationBus.publish(InvalidationEvent(
+            InvalidationEvent.DECK_UPDATED,
+            event_id,
+            file_id=file_id,
+            user_id=user_id,
+            virtual_filename=document.get("virtualFileName"),
+        ))
+        # The owner of a deleted record is unknown, so every user is bumped
+        InvalidationBus.publish(InvalidationEvent(
+            InvalidationEvent.USER_GENERATION_BUMPED,
+            event_id + ":user",
+            file_id=file_id,
+            user_id=user_id,
+        ))
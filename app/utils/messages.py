@@ -60,6 +60,9 @@ class Messages:
     ERROR_FOLDER_DELETE = "Failed to delete folder!"
     ERROR_FOLDER_RETRIEVE = "Failed to receive folders!"
     ERROR_DATABASE_CONNECTION = "Failed to connect to database!"
+    ERROR_SERVER_BUSY = "Server is busy, please retry later!"
+    ERROR_GENERATION_CANCELLED = "Presentation generation was cancelled!"
+    ERROR_HEALTH = "A database is unreachable or has not been checked yet!"
     ERROR_DATABASE_CONNECTION_UPDATE = "Failed to update database connection!"
     ERROR_DATABASE_QUERY = "Failed to query database, please try again!"
     ERROR_DATABASE_TYPES = "Failed to retrieve database types!"
@@ -70,6 +73,14 @@ class Messages:
     ERROR_DOMAIN_NAMES = "Failed to retrieve domain names!"
     ERROR_USER_ACTIVATED = "Failed to activated user!"
     ERROR_USER_DEACTIVATED = "Failed to deactivate user!"
+    ERROR_UPLOAD_FORMAT = "Incompatible file format, only .pptx files can be uploaded!"
+    ERROR_UPLOAD_SIZE = "File size is outside the allowed range!"
+    ERROR_UPLOAD_CHUNK_SIZE = "Chunk size is outside the allowed range!"
+    ERROR_UPLOAD_OFFSET = "Upload offset does not match, resume from the current offset!"
+    ERROR_UPLOAD_LOCKED = "Another chunk of this upload is being written!"
+    ERROR_UPLOAD_INCOMPLETE = "Upload is incomplete!"
+    ERROR_UPLOAD_FINALIZING = "Upload is already being finalized!"
+    ERROR_UPLOAD_SAVE = "Failed to save uploaded file!"
 
     # INVALID_
     INVALID_LOGIN_INFO = "Invalid login information!"
@@ -96,6 +107,7 @@ class Messages:
     NOT_MEMBER_GROUP = "User is not a member of this group!"
     NOT_FOUND_DOMAIN = "Domain not found!"
     NOT_FOUND_POST = "Post not found!"
+    NOT_FOUND_UPLOAD = "Upload not found!"
 
     # OK_
     OK_USER_CREATED = "User created successfully"
@@ -139,6 +151,13 @@ class Messages:
     OK_CHAT_DELETE = "Chats deleted successfully"
     OK_CHAT_PROCESSING = "Chat processing..."
     OK_FILE_UPLOAD_STARTED = "File upload started..."
+    OK_UPLOAD_CREATED = "Upload created successfully"
+    OK_UPLOAD_RETRIEVAL = "Upload retrieved successfully"
+    OK_UPLOAD_CHUNK = "Chunk received successfully"
+    OK_UPLOAD_FINALIZED = "File uploaded successfully"
+    OK_UPLOAD_DELETED = "Upload cancelled successfully"
+    OK_QUEUE_RETRIEVAL = "Queue retrieved successfully"
+    OK_GENERATION_CANCELLED = "Presentation generation cancelled successfully"
     OK_FILE_RETRIVE = "Files received successfully"
     OK_FILE_MOVED = "File moved successfully"
     OK_DOCUMENT_RENAMED = "Document renamed successfully"
@@ -156,6 +175,7 @@ class Messages:
     OK_MY_DOCUMENT_SHARED = "Document shared successfully"
     OK_MY_DOCUMENT_DELETED = "Document deleted successfully"
     OK_DATABASE_CONNECTION = "Database connection established successfully!"
+    OK_HEALTH = "All databases are reachable"
     OK_DATABASE_CONNECTION_UPDATE = "Database connection updated successfully"
     OK_DATABASE_CONNECTIONS = "Database connections fetched successfully!"
     OK_DATABASE_QUERY = "Database queried successfully!"
@@ -164,6 +184,7 @@ class Messages:
     OK_USER_QUERY_HISTORY = "User query history retrieved successfully!"
     OK_PASSWORD_RESET_EMAIL_SENT = "Successfully sent password reset link to your email address!"
     OK_TOKEN_VALID = "Token is valid!"
+    OK_SOCKET_TOKEN = "Socket token created successfully!"
     OK_USER_ACTIVATED = "User has been activated successfully!"
     OK_USER_DEACTIVATED = "User has been deactivated successfully!"
     OK_MENU_RETRIEVAL = "Menu items retrieved successfully!"
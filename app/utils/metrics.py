@@ -0,0 +1,422 @@
+"""
+    Counters and histograms of the server, exposed in the Prometheus text format
+"""
+import atexit
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from contextlib import contextmanager
+
+from app.config import Config
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+# Buckets of durations in seconds, from 1 ms to 5 min
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Buckets of counts, e.g. hits or decks
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000)
+# Buckets of sizes in bytes, from 64 KB to 1 GB
+BYTES_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(8))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Counter:
+    """A value that only increases, per combination of label values"""
+
+    TYPE = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            values = [[[str(label) for label in key], value] for key, value in self._values.items()]
+        return {"type": self.TYPE, "help": self.help, "labels": list(self.labels), "values": values}
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    @staticmethod
+    def samples(name, metric, values):
+        for key, value in sorted(values.items()):
+            yield f"{name}{_format_labels(metric['labels'], key)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, with their sum. Observing a value is a bisect and three
+    additions under a lock, cheap enough for every request and every slide.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, "") for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Count per bucket (the last one for +Inf), then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds spent in the block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[[str(label) for label in key], list(counts)] for key, counts in self._values.items()]
+        return {
+            "type": self.TYPE, "help": self.help, "labels": list(self.labels),
+            "buckets": list(self.buckets), "values": values,
+        }
+
+    @staticmethod
+    def merge(counts, other):
+        return [count + more for count, more in zip(counts, other)]
+
+    @staticmethod
+    def samples(name, metric, values):
+        buckets = tuple(metric["buckets"]) + (float("inf"),)
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                labels = _format_labels(metric["labels"], key, [("le", _format_value(bound))])
+                yield f"{name}_bucket{labels} {cumulative}"
+            yield f"{name}_sum{_format_labels(metric['labels'], key)} {_format_value(counts[-1])}"
+            yield f"{name}_count{_format_labels(metric['labels'], key)} {cumulative}"
+
+
+class Gauge:
+    """
+    Values read from a callback at each scrape, e.g. the length of a queue. Across worker processes
+    the values of the live ones are combined with `aggregate`: "sum", "max" or "min".
+    """
+
+    TYPE = "gauge"
+    AGGREGATES = {"sum": lambda a, b: a + b, "max": max, "min": min}
+
+    def __init__(self, name, help, labels, collect, aggregate="sum"):
+        if aggregate not in Gauge.AGGREGATES:
+            raise ValueError(f"Unknown aggregate {aggregate} of gauge {name}")
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Returns a list of (label values, value)
+        self.collect = collect
+        self.aggregate = aggregate
+
+    def snapshot(self):
+        values = [[[str(label) for label in key], value] for key, value in self.collect()]
+        return {
+            "type": self.TYPE, "help": self.help, "labels": list(self.labels),
+            "aggregate": self.aggregate, "values": values,
+        }
+
+    @staticmethod
+    def samples(name, metric, values):
+        for key, value in sorted(values.items()):
+            yield f"{name}{_format_labels(metric['labels'], key)} {_format_value(value)}"
+
+
+class Metrics:
+    """
+    Registry of the metrics of this process. With `METRICS_DIR` set, which gunicorn does when it
+    runs more than one worker, every process writes a snapshot of its metrics there every
+    `METRICS_FLUSH_INTERVAL` seconds and when it exits, and a scrape of `/metrics` returns the sum of
+    them all, whichever worker serves it. Snapshots of workers that exited are kept, so that
+    counters do not go backwards when a worker is restarted; only gauges of live workers are kept.
+    The counters and histograms of exited workers are folded into a single snapshot at each scrape,
+    so the folder does not grow with every restart.
+    """
+
+    __lock = threading.Lock()
+    __metrics = {}
+    __thread = None
+    # Identity of the snapshot file of this process, renewed in a forked child
+    __pid = None
+    __id = None
+
+    TYPES = {Counter.TYPE: Counter, Histogram.TYPE: Histogram, Gauge.TYPE: Gauge}
+    # Snapshot of the counters and histograms of every worker that exited
+    RETIRED_FILE = "metrics-retired.json"
+    # Held while the snapshots are read and those of exited workers retired
+    LOCK_FILE = "metrics.lock"
+
+    @staticmethod
+    def _register(metric):
+        with Metrics.__lock:
+            return Metrics.__metrics.setdefault(metric.name, metric)
+
+    @staticmethod
+    def counter(name, help, labels=()):
+        return Metrics._register(Counter(name, help, labels))
+
+    @staticmethod
+    def histogram(name, help, labels=(), buckets=SECONDS_BUCKETS):
+        return Metrics._register(Histogram(name, help, labels, buckets))
+
+    @staticmethod
+    def gauge(name, help, labels, collect, aggregate="sum"):
+        return Metrics._register(Gauge(name, help, labels, collect, aggregate))
+
+    @staticmethod
+    def timed(histogram, **labels):
+        """Decorator observing the seconds spent in every call of a function"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def start():
+        """Writes the snapshot of this process to `METRICS_DIR` in the background, if it is set"""
+        if not Config.METRICS_DIR or (Metrics.__thread and Metrics.__thread.is_alive()):
+            return
+        os.makedirs(Config.METRICS_DIR, exist_ok=True)
+        Metrics.__thread = threading.Thread(target=Metrics._run, name="metrics-flush", daemon=True)
+        Metrics.__thread.start()
+        atexit.register(Metrics.flush)
+
+    @staticmethod
+    def _run():
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            try:
+                Metrics.flush()
+            except Exception:
+                traceback.print_exc()
+
+    @staticmethod
+    def snapshot():
+        """Returns the current values of every metric of this process"""
+        with Metrics.__lock:
+            metrics = list(Metrics.__metrics.values())
+
+        snapshot = {}
+        for metric in metrics:
+            try:
+                snapshot[metric.name] = metric.snapshot()
+            except Exception as e:
+                print(f"Failed to collect {metric.name}:", e)
+        return {"pid": os.getpid(), "metrics": snapshot}
+
+    @staticmethod
+    def _path():
+        if Metrics.__pid != os.getpid():
+            Metrics.__pid = os.getpid()
+            Metrics.__id = uuid.uuid4().hex
+        return os.path.join(Config.METRICS_DIR, f"metrics-{Metrics.__pid}-{Metrics.__id}.json")
+
+    @staticmethod
+    def flush(snapshot=None):
+        """Writes the snapshot of this process to `METRICS_DIR`, replacing the previous one"""
+        if not Config.METRICS_DIR:
+            return
+        Metrics._write(Metrics._path(), snapshot or Metrics.snapshot())
+
+    @staticmethod
+    def _write(path, snapshot):
+        """Replaces the snapshot at `path` at once, so that it is never read half written"""
+        temp = f"{path}.tmp"
+        with open(temp, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(temp, path)
+
+    @staticmethod
+    def _snapshots():
+        """Returns the snapshot of this process, then those of the others in `METRICS_DIR`"""
+        own = Metrics.snapshot()
+        if not Config.METRICS_DIR:
+            return [own]
+
+        Metrics.flush(own)
+        own_path = Metrics._path()
+        retired_path = os.path.join(Config.METRICS_DIR, Metrics.RETIRED_FILE)
+        snapshots = [own]
+        with Metrics._locked() as locked:
+            retired = Metrics._read(retired_path) if os.path.exists(retired_path) else None
+            retired = retired or {"pid": None, "files": [], "metrics": {}}
+            exited = []
+            for path in glob.glob(os.path.join(Config.METRICS_DIR, "metrics-*.json")):
+                if path in (own_path, retired_path):
+                    continue
+                if locked and os.path.basename(path) in retired["files"]:
+                    # Already retired by a scrape that stopped before removing it
+                    Metrics._remove(path)
+                    continue
+                snapshot = Metrics._read(path)
+                if snapshot is None:
+                    continue
+                if _alive(snapshot["pid"]):
+                    snapshots.append(snapshot)
+                    continue
+                # Only the counters and histograms of exited workers still count
+                snapshot["metrics"] = {
+                    name: metric for name, metric in snapshot["metrics"].items() if metric["type"] != Gauge.TYPE
+                }
+                exited.append((path, snapshot))
+
+            if exited and locked:
+                retired = Metrics._retire(retired_path, retired, exited)
+            else:
+                snapshots.extend(snapshot for _, snapshot in exited)
+        snapshots.append(retired)
+        return snapshots
+
+    @staticmethod
+    @contextmanager
+    def _locked():
+        """Locks `METRICS_DIR` against other processes, yielding whether it could"""
+        if fcntl is None:
+            yield False
+            return
+        with open(os.path.join(Config.METRICS_DIR, Metrics.LOCK_FILE), "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield True
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path):
+        """Returns the snapshot written to `path`, or None if it cannot be read"""
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            # Written by hand, or by another version of the server
+            print(f"Skipped metrics snapshot {path}:", e)
+            return None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _retire(retired_path, retired, exited):
+        """
+        Folds the snapshots of exited workers into the retired snapshot, then removes their files.
+        Must be called with `METRICS_DIR` locked. The retired snapshot names the files it folded, so
+        that a scrape stopped before removing them does not count them twice.
+        """
+        merged = Metrics._merge({}, retired["metrics"])
+        for _, snapshot in exited:
+            Metrics._merge(merged, snapshot["metrics"])
+        retired = {
+            "pid": None,
+            "files": [os.path.basename(path) for path, _ in exited],
+            "metrics": {
+                name: {**metric, "values": [[list(key), value] for key, value in metric["values"].items()]}
+                for name, metric in merged.items()
+            },
+        }
+        Metrics._write(retired_path, retired)
+        for path, _ in exited:
+            Metrics._remove(path)
+        return retired
+
+    @staticmethod
+    def _merge(merged, metrics):
+        """Adds the metrics of a snapshot to `merged`, whose values are keyed by tuples of labels"""
+        for name, metric in metrics.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {**metric, "values": {}}
+            elif target["type"] != metric["type"]:
+                continue
+            if metric["type"] == Gauge.TYPE:
+                combine = Gauge.AGGREGATES[target["aggregate"]]
+            else:
+                combine = Metrics.TYPES[metric["type"]].merge
+            for key, value in metric["values"]:
+                key = tuple(key)
+                values = target["values"]
+                values[key] = value if key not in values else combine(values[key], value)
+        return merged
+
+    @staticmethod
+    def render():
+        """Returns every metric, of every worker process, in the Prometheus text exposition format"""
+        merged = {}
+        for snapshot in Metrics._snapshots():
+            Metrics._merge(merged, snapshot["metrics"])
+
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            lines.extend(Metrics.TYPES[metric["type"]].samples(name, metric, metric["values"]))
+        return "\n".join(lines) + "\n"
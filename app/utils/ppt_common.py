@@ -39,6 +39,8 @@ def create_text_chunks(text, max_chunk_size=2250):
 
 
 def find_and_replace_diagrams(slide):
+    """Replaces SmartArt diagrams with groups of shapes. Returns the number of diagrams replaced"""
+    replaced = 0
     # Collect all diagrams in slide
     diagrams = []
     for shape in slide.shapes:
@@ -60,9 +62,13 @@ def find_and_replace_diagrams(slide):
         new_shape_objects = shapes_from_drawing(drawing_xml, next_id, parent)
         # Create new groupShape, attach shape objects, attach to slide
         add_group_to_slide(slide, new_shape_objects, position)
+        replaced += 1
+
+    return replaced
 
 
 def find_and_replace_OLE_photos(slide):
+    """Replaces embedded MS Photo Editor objects with their picture. Returns the number of objects replaced"""
     shapes = slide.shapes
     # Collect all embedded OLE objects
     ole_photo_objs = []
@@ -85,6 +91,8 @@ def find_and_replace_OLE_photos(slide):
         parent = obj.element.getparent()
         parent.remove(obj.element)
 
+    return len(ole_photo_objs)
+
 
 def find_and_replace_OLE(slide):
     ole_objs = []
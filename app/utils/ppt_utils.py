@@ -186,12 +186,14 @@ def remove_shape(shape):
 
 ### CHARTS
 
-from typing import Union
+from typing import TYPE_CHECKING, Union
 
-import pandas as pd
+# pandas, numpy and openpyxl are only imported by the chart helpers that use them
+if TYPE_CHECKING:
+    import pandas as pd
 
 
-def chart_to_dataframe(graphical_frame) -> pd.DataFrame:
+def chart_to_dataframe(graphical_frame) -> "pd.DataFrame":
     """
     Helper to parse chart data to a DataFrame.
 
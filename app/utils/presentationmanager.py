@@ -1,33 +1,61 @@
+import hashlib
 import traceback
 
 from functools import cached_property
+from io import BytesIO
 from pathlib import Path
 from pptx import Presentation
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 
+from app.utils.artifactcache import ArtifactCache
+from app.utils.metrics import Metrics
 from app.utils.ppt_utils import duplicate_slide
 from app.utils.ppt_common import create_text_chunks, find_and_replace_diagrams, print_shape_type, find_and_replace_OLE_photos, find_and_replace_OLE
 
+NORMALIZE_SECONDS = Metrics.histogram("presentation_normalize_seconds", "Seconds to normalize a presentation")
+SLIDE_COPY_SECONDS = Metrics.histogram("presentation_slide_copy_seconds", "Seconds to copy one slide between presentations")
+SAVE_SECONDS = Metrics.histogram("presentation_save_seconds", "Seconds to save a presentation")
+
+
 class PresentationManager(object):
     """Contains Presentation object and functions to manage it"""
     
     # Character limit for content text in single slide
     MAX_CONTENT_LIMIT=2250
 
-    def __init__(self, path_or_file, template_slide_index=1, slide_size=()):
+    def __init__(self, path_or_file, template_slide_index=1, slide_size=(), cache=False, slides=None, cancellation=None):
+        """
+        Opens the presentation at the given path or in the given file. With `cache`, the normalized
+        presentation is looked up in the shared `ArtifactCache` by the hash of the file, and stored
+        there after normalizing it. Use it only for source presentations that are not modified.
+
+        With `slides`, a list of slide indexes, a stored presentation is opened lazily: only those
+        slides are loaded, from their slide bundles, and `slide_position` maps their indexes to
+        their position in the loaded presentation. Loading them stops with `Cancelled` once
+        `cancellation`, a `CancellationToken`, is cancelled.
+        """
         # Since presentation.Presentation class not intended to be constructed directly, using pptx.Presentation() to open presentation
         self.file_path = None
+        self.file_hash = None
+        self.slide_indexes = None
+        self.presentation = None
+        normalized = False
 
         if isinstance(path_or_file, str):
             if Path(path_or_file).exists():
-                self.presentation = Presentation(path_or_file)
+                if slides is not None:
+                    self.presentation = self._open_slides(path_or_file, slides, cancellation)
+                    normalized = self.presentation is not None
+                if self.presentation is None:
+                    self.presentation, normalized = self._open(path_or_file, cache)
                 self.file_path = path_or_file
                 print("Loaded presentation from:", self.file_path)
             else:
                 self.presentation = Presentation()
+                normalized = True
                 print("New presentation object loaded")
         else:
-            self.presentation = Presentation(path_or_file)
+            self.presentation, normalized = self._open(path_or_file, cache)
             print("Loaded presentation:", path_or_file.filename)
 
         if slide_size:
@@ -42,11 +70,81 @@ class PresentationManager(object):
         min_items = min(layout_items_count)
         self.blank_layout_id = layout_items_count.index(min_items)
 
+        if not normalized:
+            self._normalize()
+
+    def _open(self, path_or_file, cache):
+        """
+        Opens the presentation, from its normalized version in the artifact cache if there is one.
+
+        Returns:
+            tuple: The presentation and whether it is already normalized
+        """
+        artifact_cache = ArtifactCache.connect() if cache else None
+        if artifact_cache is None:
+            return Presentation(path_or_file), False
+
+        self.file_hash, data = self.hash_file(path_or_file)
+        normalized = artifact_cache.get(self.file_hash, ArtifactCache.NORMALIZED)
+        if normalized is None:
+            return Presentation(BytesIO(data)), False
+        # An empty artifact means the original presentation needed no changes
+        return Presentation(BytesIO(normalized or data)), True
+
+    def _open_slides(self, file_path, slides, cancellation=None):
+        """
+        Opens only the given slides of a stored presentation, from their normalized slide bundles.
+        Returns None if the slides cannot be assembled from bundles.
+        """
+        from app.utils.slidebundle import SlideBundle
+
+        slides = sorted(set(slides))
+        buffer = BytesIO()
+        if not SlideBundle.assemble([(file_path, i) for i in slides], buffer, cancellation):
+            return None
+
+        self.slide_indexes = slides
+        buffer.seek(0)
+        return Presentation(buffer)
+
+    def slide_position(self, index):
+        """Returns the position in the loaded presentation of the slide with the given index in the file"""
+        if self.slide_indexes is None:
+            return index
+        return self.slide_indexes.index(index)
+
+    @Metrics.timed(NORMALIZE_SECONDS)
+    def _normalize(self):
+        """Replaces shapes that cannot be copied between presentations"""
+        replaced = 0
         for slide in self.presentation.slides:
-            find_and_replace_diagrams(slide) 
-            find_and_replace_OLE_photos(slide)       
+            replaced += find_and_replace_diagrams(slide) 
+            replaced += find_and_replace_OLE_photos(slide)       
             # find_and_replace_OLE(slide)       
 
+        if self.file_hash:
+            normalized = b""
+            if replaced:
+                buffer = BytesIO()
+                self.presentation.save(buffer)
+                normalized = buffer.getvalue()
+            ArtifactCache.connect().set(self.file_hash, ArtifactCache.NORMALIZED, normalized)
+
+    @staticmethod
+    def hash_file(path_or_file):
+        """
+        Returns the SHA-256 of a presentation file at the given path or in the given file, and its content
+        """
+        if isinstance(path_or_file, str):
+            with open(path_or_file, "rb") as f:
+                data = f.read()
+        else:
+            stream = getattr(path_or_file, "stream", path_or_file)
+            stream.seek(0)
+            data = stream.read()
+            stream.seek(0)
+        return hashlib.sha256(data).hexdigest(), data
+
     @property
     def xml_slides(self):
         return self.presentation.slides._sldIdLst
@@ -143,7 +241,8 @@ class PresentationManager(object):
         if remove_template:
             print("Removing template", self.template_slide_index)
             self.remove_slide(self.template_slide_index)
-        self.presentation.save(filepath)
+        with SAVE_SECONDS.time():
+            self.presentation.save(filepath)
         print("Saved presentation to:", filepath)
 
     @classmethod
@@ -159,11 +258,13 @@ class PresentationManager(object):
             slides_to_copy = range(source.total_slides)
 
         for i in slides_to_copy:
-            duplicate_slide(source.presentation, i, destination.presentation)
+            with SLIDE_COPY_SECONDS.time():
+                duplicate_slide(source.presentation, i, destination.presentation)
         # Save twice to avoid corruption bug
         destination.save(dest_filepath)
         destination = Presentation(dest_filepath)
-        destination.save(dest_filepath)
+        with SAVE_SECONDS.time():
+            destination.save(dest_filepath)
    
 
 
@@ -180,6 +281,11 @@ class PresentationManager(object):
         title = shapes.title.text if shapes.title else f"Untitled"
         return title
 
+    @staticmethod
+    def content_hash(title, content):
+        """Hash of the indexed text of a slide, used to detect changed slides on re-upload"""
+        return hashlib.sha256(f"{title}\n{content}".encode("utf-8")).hexdigest()
+
     def extract_all_text(self):
         docs = []
         slide_texts = []
@@ -208,11 +314,13 @@ class PresentationManager(object):
                 shape_text = get_text(item)
                 if shape_text:
                     all_text.append(shape_text)
+            content = "\n".join(all_text)
             slide_texts.append({
                 "title": title,
-                "content": "\n".join(all_text),
+                "content": content,
                 "slide_id": slide.slide_id,
                 "slide_index": i,
+                "content_hash": self.content_hash(title, content),
             })
 
         return slide_texts
@@ -0,0 +1,137 @@
+"""
+    Progress of long running jobs, sent to the socket of their user at a bounded rate
+"""
+import threading
+import time
+import traceback
+import uuid
+
+from app import socketio
+from app.config import Config
+from app.utils.metrics import Metrics
+from app.utils.socket import user_room
+
+UPDATES = Metrics.counter("progress_updates_total", "Progress updates of jobs, sent or coalesced")
+EMITS = Metrics.counter("progress_emits_total", "Progress events sent to sockets")
+
+
+class ProgressJob:
+    """
+    Progress of one job of a user, e.g. an upload of several files. Updates only record the latest
+    state; it is sent by `ProgressChannel`. Safe to update from several threads.
+    """
+
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, user_id, job, total, stage, job_id=None):
+        self.user_id = str(user_id)
+        self.job_id = job_id or str(uuid.uuid4())
+        self.job = job
+        self.total = total
+        self.stage = stage
+        self.done = 0
+        self.status = ProgressJob.RUNNING
+        self.message = ""
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, count=1, stage=None):
+        """Records `count` more items done, and the stage the job moved to if given"""
+        with self._lock:
+            self.done = min(self.done + count, self.total)
+            self.stage = stage or self.stage
+        ProgressChannel.publish(self)
+
+    def update(self, stage=None, done=None, total=None):
+        """Records the stage of the job, and resets its counts if given"""
+        with self._lock:
+            self.stage = stage or self.stage
+            self.total = self.total if total is None else total
+            self.done = self.done if done is None else min(done, self.total)
+        ProgressChannel.publish(self)
+
+    def finish(self, message="", failed=False):
+        """Records the end of the job. The final state is always sent"""
+        with self._lock:
+            self.status = ProgressJob.FAILED if failed else ProgressJob.DONE
+            self.message = message
+        ProgressChannel.publish(self)
+
+    def to_payload(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            eta = None
+            if self.status == ProgressJob.RUNNING and 0 < self.done < self.total:
+                eta = round(elapsed / self.done * (self.total - self.done), 1)
+            return {
+                "jobId": self.job_id,
+                "job": self.job,
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "eta": eta,
+                "status": self.status,
+                "message": self.message,
+            }
+
+
+class ProgressChannel:
+    """
+    Sends the progress of jobs to the `<user_id>_progress` socket event of their user. Updates are
+    coalesced per job: a background thread sends the latest state of every job updated in the last
+    `PROGRESS_INTERVAL` seconds, and intermediate states in between are dropped. At most one event
+    per job is sent per interval, however fast the job is updated.
+    """
+
+    __thread = None
+    __lock = threading.Lock()
+    __wake = threading.Event()
+    __pending = {}
+
+    @staticmethod
+    def start(user_id, job, total, stage, job_id=None):
+        """Returns a new job of the user, with `total` items to process, and sends its first state"""
+        progress = ProgressJob(user_id, job, total, stage, job_id)
+        ProgressChannel.publish(progress)
+        return progress
+
+    @staticmethod
+    def publish(progress):
+        """Schedules the latest state of a job to be sent, replacing any state not sent yet"""
+        with ProgressChannel.__lock:
+            ProgressChannel.__pending[progress.job_id] = progress
+            UPDATES.inc()
+            if not (ProgressChannel.__thread and ProgressChannel.__thread.is_alive()):
+                ProgressChannel.__thread = threading.Thread(
+                    target=ProgressChannel._run, name="progress-channel", daemon=True
+                )
+                ProgressChannel.__thread.start()
+        if progress.status != ProgressJob.RUNNING:
+            ProgressChannel.__wake.set()
+
+    @staticmethod
+    def _run():
+        while True:
+            ProgressChannel.__wake.wait(Config.PROGRESS_INTERVAL)
+            ProgressChannel.__wake.clear()
+            try:
+                ProgressChannel.flush()
+            except Exception:
+                traceback.print_exc()
+
+    @staticmethod
+    def flush():
+        """Sends the pending state of every job"""
+        with ProgressChannel.__lock:
+            pending = list(ProgressChannel.__pending.values())
+            ProgressChannel.__pending.clear()
+
+        for progress in pending:
+            payload = progress.to_payload()
+            socketio.emit(f"{progress.user_id}_progress", payload, to=user_room(progress.user_id))
+            if payload["status"] != ProgressJob.RUNNING:
+                print(f"🔌 progress: {payload['job']} {payload['status']} {payload['done']}/{payload['total']}")
+
+        EMITS.inc(len(pending))
@@ -0,0 +1,174 @@
+"""
+    Deletes generated presentations by age and by per-user and global quotas
+"""
+import datetime
+import threading
+import traceback
+
+from pymongo import ASCENDING
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+from app.utils.blobstore import BlobStore
+from app.utils.metrics import Metrics
+
+SWEEPS = Metrics.counter("reaper_sweeps_total", "Sweeps of generated presentations")
+SWEEP_SECONDS = Metrics.histogram("reaper_sweep_seconds", "Seconds per sweep of generated presentations")
+RECLAIMED_BYTES = Metrics.counter(
+    "reaper_reclaimed_bytes_total", "Bytes of generated presentations deleted, by reason", ("reason",)
+)
+RECLAIMED_DECKS = Metrics.counter(
+    "reaper_reclaimed_decks_total", "Generated presentations deleted, by reason", ("reason",)
+)
+
+
+class GeneratedDeckReaper:
+    """
+    Generated presentations are registered in GENERATED_DECKS with their owner, size and last
+    access. A background thread deletes, in batches, the ones not accessed for
+    `GENERATED_TTL_SECONDS`, then the least recently accessed ones of every user over
+    `GENERATED_USER_QUOTA_BYTES`, then the least recently accessed ones over
+    `GENERATED_GLOBAL_QUOTA_BYTES`. Each sweep reads the registry through its indexes instead of
+    scanning directories.
+
+    Bytes used per user and in total are kept up to date in GENERATED_USAGE, so that finding the
+    users over quota does not add up the registry.
+
+    A presentation is leased for `GENERATED_LEASE_SECONDS` when it is registered, which covers
+    its download right after generation; it is not deleted before its lease expires. Deleting a
+    presentation releases its blob, which is deleted once unreferenced.
+    """
+
+    # Usage document holding the total of all users
+    TOTAL = "*"
+
+    # Reasons for deleting a presentation
+    TTL = "ttl"
+    USER_QUOTA = "user_quota"
+    GLOBAL_QUOTA = "global_quota"
+
+    __thread = None
+    __stop = threading.Event()
+    __lock = threading.Lock()
+
+    @staticmethod
+    def _collection():
+        return MongoClient.connect()[Config.MONGO_GENERATED_DECKS_COLLECTION]
+
+    @staticmethod
+    def _add_usage(user_id, size):
+        usage = MongoClient.connect()[Config.MONGO_GENERATED_USAGE_COLLECTION]
+        for key in (str(user_id), GeneratedDeckReaper.TOTAL):
+            usage.update_one({"_id": key}, {"$inc": {"size": size}}, upsert=True)
+
+    @staticmethod
+    def register(name, user_id, size):
+        """Registers a generated presentation stored under `name`, leased for its first download"""
+        now = datetime.datetime.utcnow()
+        GeneratedDeckReaper._collection().insert_one({
+            "_id": name,
+            "userId": str(user_id),
+            "size": size,
+            "createdOn": now,
+            "accessedOn": now,
+            "leasedUntil": now + datetime.timedelta(seconds=Config.GENERATED_LEASE_SECONDS),
+        })
+        GeneratedDeckReaper._add_usage(user_id, size)
+
+    @staticmethod
+    def start():
+        """Starts sweeping periodically, once per process"""
+        if not Config.REAPER_ENABLED:
+            return
+        with GeneratedDeckReaper.__lock:
+            if GeneratedDeckReaper.__thread and GeneratedDeckReaper.__thread.is_alive():
+                return
+            GeneratedDeckReaper.__stop.clear()
+            GeneratedDeckReaper.__thread = threading.Thread(
+                target=GeneratedDeckReaper._run, name="generated-deck-reaper", daemon=True
+            )
+            GeneratedDeckReaper.__thread.start()
+
+    @staticmethod
+    def stop():
+        GeneratedDeckReaper.__stop.set()
+
+    @staticmethod
+    def _run():
+        while not GeneratedDeckReaper.__stop.wait(Config.REAPER_INTERVAL_SECONDS):
+            try:
+                GeneratedDeckReaper.sweep()
+            except Exception:
+                traceback.print_exc()
+
+    @staticmethod
+    def sweep(batch_size=None):
+        """
+        Deletes at most `batch_size` presentations for each reason, then the blobs left without
+        references. Returns the number of bytes reclaimed.
+        """
+        started = datetime.datetime.utcnow()
+        batch_size = batch_size or Config.REAPER_BATCH_SIZE
+        collection = GeneratedDeckReaper._collection()
+        not_leased = {"leasedUntil": {"$lt": started}}
+
+        reclaimed = 0
+        expired = started - datetime.timedelta(seconds=Config.GENERATED_TTL_SECONDS)
+        reclaimed += GeneratedDeckReaper._delete(
+            collection.find({"accessedOn": {"$lt": expired}, **not_leased}).sort("accessedOn", ASCENDING).limit(batch_size),
+            GeneratedDeckReaper.TTL,
+        )
+
+        usage = MongoClient.connect()[Config.MONGO_GENERATED_USAGE_COLLECTION]
+        over_quota = usage.find({
+            "_id": {"$ne": GeneratedDeckReaper.TOTAL}, "size": {"$gt": Config.GENERATED_USER_QUOTA_BYTES}
+        })
+        for user in over_quota:
+            excess = user["size"] - Config.GENERATED_USER_QUOTA_BYTES
+            reclaimed += GeneratedDeckReaper._delete(
+                collection.find({"userId": user["_id"], **not_leased}).sort("accessedOn", ASCENDING).limit(batch_size),
+                GeneratedDeckReaper.USER_QUOTA,
+                excess,
+            )
+
+        total = usage.find_one({"_id": GeneratedDeckReaper.TOTAL})
+        if total and total["size"] > Config.GENERATED_GLOBAL_QUOTA_BYTES:
+            reclaimed += GeneratedDeckReaper._delete(
+                collection.find(not_leased).sort("accessedOn", ASCENDING).limit(batch_size),
+                GeneratedDeckReaper.GLOBAL_QUOTA,
+                total["size"] - Config.GENERATED_GLOBAL_QUOTA_BYTES,
+            )
+
+        BlobStore.connect().collect_garbage(Config.BLOB_GRACE_SECONDS)
+
+        SWEEPS.inc()
+        SWEEP_SECONDS.observe((datetime.datetime.utcnow() - started).total_seconds())
+        if reclaimed:
+            print(f"Reaper: reclaimed {reclaimed} bytes of generated presentations")
+        return reclaimed
+
+    @staticmethod
+    def _delete(decks, reason, excess=None):
+        """
+        Deletes the given presentations, stopping once `excess` bytes are reclaimed. A presentation
+        leased or deleted by another process in the meantime is skipped.
+        """
+        collection = GeneratedDeckReaper._collection()
+        blob_store = BlobStore.connect()
+
+        reclaimed = 0
+        for deck in decks:
+            if excess is not None and reclaimed >= excess:
+                break
+            deleted = collection.find_one_and_delete({
+                "_id": deck["_id"], "leasedUntil": {"$lt": datetime.datetime.utcnow()}
+            })
+            if not deleted:
+                continue
+            blob_store.unlink(deleted["_id"])
+            GeneratedDeckReaper._add_usage(deleted["userId"], -deleted["size"])
+            reclaimed += deleted["size"]
+            RECLAIMED_BYTES.inc(deleted["size"], reason=reason)
+            RECLAIMED_DECKS.inc(reason=reason)
+
+        return reclaimed
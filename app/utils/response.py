@@ -5,12 +5,19 @@
 
 import datetime
 import json
+import zlib
 
 from bson import ObjectId
-from flask import jsonify
+from flask import jsonify, request, stream_with_context
 
-from app import socketio
+from app import app, socketio
 from app.utils.messages import Messages
+from app.utils.serializer import Serializer
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
 
 
 class Response:
@@ -29,6 +36,48 @@ class Response:
         """
         return jsonify({"data": data, "message": message, "success": success}), status
 
+    @staticmethod
+    def ndjson_response(items, status=200):
+        """Streams items as newline delimited JSON, one line per item, as soon as each is available.
+        The stream is compressed with brotli or gzip when the client accepts it.
+
+        Args:
+            items (iterable): Items to stream, e.g. a generator of search hits.
+            status (int, optional): Http status code. Defaults to 200.
+
+        Returns:
+            Response: Streamed NDJSON response
+        """
+        chunks = Serializer.stream_ndjson(items)
+        headers = {"Vary": "Accept-Encoding", "X-Accel-Buffering": "no"}
+
+        encodings = ["br", "gzip"] if brotli else ["gzip"]
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding:
+            chunks = Response._compress_stream(chunks, encoding)
+            headers["Content-Encoding"] = encoding
+
+        return app.response_class(
+            stream_with_context(chunks),
+            status=status,
+            mimetype="application/x-ndjson",
+            headers=headers,
+        )
+
+    @staticmethod
+    def _compress_stream(chunks, encoding):
+        """Compresses a stream of chunks, flushing after each so the client can decode it right away"""
+        if encoding == "br":
+            compressor = brotli.Compressor()
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+
     @staticmethod
     def socket_reponse(
         event: str,
@@ -108,6 +157,29 @@ class Response:
             400,
         )
 
+    @staticmethod
+    def server_busy(status=503, retry_after=1):
+        """Generates a response for a request refused because the server is saturated
+
+        Args:
+            status (int, optional): 429 or 503. Defaults to 503.
+            retry_after (int, optional): Seconds after which to retry. Defaults to 1.
+
+        Returns:
+            json: Response for a busy server, with a Retry-After header
+        """
+        return (
+            jsonify(
+                {
+                    "data": [],
+                    "message": Messages.ERROR_SERVER_BUSY,
+                    "success": False,
+                }
+            ),
+            status,
+            {"Retry-After": str(retry_after)},
+        )
+
     @staticmethod
     def server_error():
         """Generates a response for server error
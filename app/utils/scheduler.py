@@ -0,0 +1,241 @@
+"""
+    Fair sharing of worker threads between users
+"""
+import threading
+import time
+import traceback
+
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+from app.utils.admission import AdmissionRejected
+from app.utils.cancellation import Cancelled
+
+
+def _gevent_patched():
+    """Whether gevent has patched `threading`, e.g. in the gunicorn gevent workers"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+class _Task:
+    def __init__(self, user_id, fn, args, kwargs):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.started = threading.Event()
+
+
+class FairScheduler:
+    """
+    Runs tasks on `workers` threads, sharing them fairly between users. Tasks wait in a queue per
+    user, and the users with waiting tasks take turns: each dispatch starts the oldest task of the
+    next user in turn. A user runs at most `user_max_in_flight` tasks at once, so a user with
+    hundreds of tasks cannot hold every worker while others wait.
+
+    Optionally, at most `max_queue` tasks wait in total, further submissions being refused with
+    `AdmissionRejected` (429), and a task still waiting after `queue_timeout` seconds fails with
+    `AdmissionRejected` (503): `run` gives up at the deadline, removing its task from the queue. With an `AdmissionController`, a task only starts once admitted by
+    it, e.g. when there is enough memory.
+
+    Tasks run on OS threads. Under gevent, threads started by `threading` are greenlets, and a
+    CPU bound task, e.g. parsing a presentation, would block every request and socket of the
+    worker: the workers then run on a gevent thread pool of native threads instead.
+    """
+
+    # Seconds the metrics of a user without tasks are kept
+    USER_METRICS_TTL = 600
+
+    def __init__(self, name, workers, user_max_in_flight, max_queue=None, queue_timeout=None, admission=None):
+        self.name = name
+        self.workers = workers
+        self.user_max_in_flight = user_max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.admission = admission
+
+        self._condition = threading.Condition()
+        # Queues of the users with waiting tasks, in turn order
+        self._queues = OrderedDict()
+        self._in_flight = {}
+        self._queued = 0
+        self._threads = []
+        self._pool = None
+        self._users = {}
+        self._last_active = {}
+        self._last_eviction = time.monotonic()
+
+    def submit(self, user_id, fn, *args, **kwargs):
+        """Queues `fn(*args, **kwargs)` for the user and returns a `Future` of its result"""
+        return self._submit(user_id, fn, args, kwargs).future
+
+    def _submit(self, user_id, fn, args, kwargs):
+        user_id = str(user_id)
+        task = _Task(user_id, fn, args, kwargs)
+        with self._condition:
+            if self.max_queue is not None and self._queued >= self.max_queue:
+                self._user_metrics(user_id)["rejected_total"] += 1
+                raise AdmissionRejected(AdmissionRejected.QUEUE_FULL, 429, self._retry_after())
+            self._queues.setdefault(user_id, deque()).append(task)
+            self._queued += 1
+            self._start_workers()
+            self._condition.notify()
+        return task
+
+    def run(self, user_id, fn, *args, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` for the user through the queue and returns its result. Raises
+        `AdmissionRejected` (503) as soon as the task has waited `queue_timeout` seconds without
+        starting.
+        """
+        task = self._submit(user_id, fn, args, kwargs)
+        if self.queue_timeout is not None and not task.started.wait(self.queue_timeout):
+            self._withdraw(task)
+        return task.future.result()
+
+    def _withdraw(self, task):
+        """Removes a task that did not start before its deadline from the queue, failing it with 503"""
+        with self._condition:
+            queue = self._queues.get(task.user_id)
+            if queue is None or task not in queue:
+                # Started in the meantime
+                return
+            queue.remove(task)
+            if not queue:
+                del self._queues[task.user_id]
+            self._queued -= 1
+            self._user_metrics(task.user_id)["rejected_total"] += 1
+        task.future.cancel()
+        raise AdmissionRejected(AdmissionRejected.TIMEOUT, 503, self._retry_after())
+
+    def _start_workers(self):
+        if _gevent_patched():
+            if self._pool is None:
+                from gevent.threadpool import ThreadPool
+
+                self._pool = ThreadPool(self.workers)
+                for _ in range(self.workers):
+                    self._pool.spawn(self._run)
+            return
+
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        """Removes and returns the oldest task of the next user in turn that may run one, or None"""
+        for user_id in list(self._queues):
+            if self._in_flight.get(user_id, 0) >= self.user_max_in_flight:
+                continue
+            queue = self._queues.pop(user_id)
+            task = queue.popleft()
+            # The user goes to the end of the turn order
+            if queue:
+                self._queues[user_id] = queue
+            self._queued -= 1
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+            task.started.set()
+            return task
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                task = self._next()
+                while task is None:
+                    self._condition.wait()
+                    task = self._next()
+
+            waited = time.monotonic() - task.submitted
+            try:
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                if self.queue_timeout is not None and waited > self.queue_timeout:
+                    raise AdmissionRejected(AdmissionRejected.TIMEOUT, 503, self._retry_after())
+                # Admission waits only for what is left of the queue deadline
+                deadline = task.submitted + self.queue_timeout if self.queue_timeout is not None else None
+                with self.admission.admit(deadline) if self.admission else nullcontext():
+                    result = task.fn(*task.args, **task.kwargs)
+                task.future.set_result(result)
+            except BaseException as e:
+                if not isinstance(e, (AdmissionRejected, Cancelled)):
+                    traceback.print_exc()
+                task.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._in_flight[task.user_id] -= 1
+                    if not self._in_flight[task.user_id]:
+                        del self._in_flight[task.user_id]
+                    metrics = self._user_metrics(task.user_id)
+                    metrics["completed_total"] += 1
+                    metrics["wait_seconds_total"] += waited
+                    metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+                    self._evict_idle_users()
+                    self._condition.notify()
+
+    @staticmethod
+    def _new_user_metrics():
+        return {
+            "completed_total": 0,
+            "rejected_total": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _user_metrics(self, user_id):
+        """Returns the metrics of a user, to be updated, marking the user as active"""
+        self._last_active[user_id] = time.monotonic()
+        if user_id not in self._users:
+            self._users[user_id] = self._new_user_metrics()
+        return self._users[user_id]
+
+    def _evict_idle_users(self):
+        """Forgets the metrics of the users without tasks for `USER_METRICS_TTL` seconds"""
+        now = time.monotonic()
+        if now - self._last_eviction < self.USER_METRICS_TTL / 10:
+            return
+        self._last_eviction = now
+        for user_id, last_active in list(self._last_active.items()):
+            if now - last_active > self.USER_METRICS_TTL and user_id not in self._queues and user_id not in self._in_flight:
+                del self._last_active[user_id]
+                self._users.pop(user_id, None)
+
+    def _retry_after(self):
+        return self.admission.retry_after() if self.admission else 1
+
+    def user_state(self, user_id):
+        """Returns the tasks of a user waiting and running, and how long the oldest has waited"""
+        user_id = str(user_id)
+        with self._condition:
+            queue = self._queues.get(user_id, ())
+            return {
+                "queued": len(queue),
+                "in_flight": self._in_flight.get(user_id, 0),
+                "oldest_wait_seconds": round(time.monotonic() - queue[0].submitted, 3) if queue else 0.0,
+                **self._users.get(user_id, self._new_user_metrics()),
+            }
+
+    def to_metrics(self):
+        """Returns the state of the scheduler and of every user it has run tasks for"""
+        with self._condition:
+            return {
+                "queued": self._queued,
+                "in_flight": sum(self._in_flight.values()),
+                "users": {
+                    user_id: {
+                        "queued": len(self._queues.get(user_id, ())),
+                        "in_flight": self._in_flight.get(user_id, 0),
+                        **metrics,
+                    }
+                    for user_id, metrics in self._users.items()
+                },
+            }
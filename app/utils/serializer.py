@@ -0,0 +1,112 @@
+"""
+    Conversion of MongoDB documents to JSON without intermediate JSON strings, and a fast
+    JSON provider for Flask responses
+"""
+import json
+
+from bson import ObjectId, json_util
+from bson.decimal128 import Decimal128
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class Serializer:
+
+    # Types already supported by JSON
+    JSON_TYPES = (str, int, float, bool, type(None))
+
+    @staticmethod
+    def to_json_compatible(obj, fallback=json_util.default):
+        """Converts BSON values inside `obj` in a single pass, without serializing to a string
+
+        Args:
+            obj (Any): Document, list of documents or value to convert
+            fallback (callable, optional): Converts values of any other type. Defaults to
+                `json_util.default`, which gives the same result as `json.loads(json_util.dumps(obj))`
+
+        Returns:
+            Any: `obj` with only JSON compatible values
+        """
+        if isinstance(obj, Serializer.JSON_TYPES):
+            return obj
+        if isinstance(obj, dict):
+            return {
+                str(key): Serializer.to_json_compatible(value, fallback) 
+                for key, value in obj.items()
+            }
+        if isinstance(obj, (list, tuple)):
+            return [Serializer.to_json_compatible(value, fallback) for value in obj]
+
+        return Serializer.to_json_compatible(fallback(obj), fallback)
+
+    @staticmethod
+    def bson_or_str(obj):
+        """Converts BSON values like `json_util.default` and any other value to a string"""
+        try:
+            return json_util.default(obj)
+        except TypeError:
+            return str(obj)
+
+    @staticmethod
+    def default(obj):
+        """Converts values JSON does not support, for responses"""
+        if isinstance(obj, (ObjectId, Decimal128)):
+            return str(obj)
+        return DefaultJSONProvider.default(obj)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        """Serializes `obj` to JSON bytes, with orjson when it is installed
+
+        Args:
+            obj (Any): Value to serialize
+            sort_keys (bool, optional): Sort the keys of objects. Defaults to False.
+
+        Returns:
+            bytes: JSON
+        """
+        if orjson is not None:
+            # Keep the date format of Flask's JSON provider
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=Serializer.default, option=option)
+        return json.dumps(
+            obj, default=Serializer.default, separators=(",", ":"), sort_keys=sort_keys
+        ).encode("utf-8")
+
+    @staticmethod
+    def stream_ndjson(items):
+        """Serializes `items` as newline delimited JSON, one line per item
+
+        Args:
+            items (iterable): Values to serialize
+
+        Yields:
+            bytes: One JSON line
+        """
+        for item in items:
+            yield Serializer.dumps(item) + b"\n"
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider serializing with `Serializer.dumps`"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return Serializer.dumps(obj, self.sort_keys).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        obj = kwargs or (args[0] if len(args) == 1 else list(args) if args else None)
+        if self._app.debug:
+            return super().response(obj)
+        return self._app.response_class(
+            Serializer.dumps(obj, self.sort_keys), mimetype=self.mimetype
+        )
@@ -0,0 +1,488 @@
+"""
+    Self-contained bundles of single slides, built at ingest and merged into generated presentations
+    at the package level, without loading the source presentations with python-pptx
+"""
+import hashlib
+import json
+import os
+import posixpath
+import traceback
+import zipfile
+
+from io import BytesIO
+from urllib.parse import quote, unquote
+
+from lxml import etree
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+
+from app.utils.artifactcache import ArtifactCache
+from app.utils.cancellation import Cancelled
+from app.utils.presentationmanager import PresentationManager
+from app.utils.zipmanifest import PackageReader, ZipManifest
+
+
+NS = {
+    "ct": "http://schemas.openxmlformats.org/package/2006/content-types",
+    "pr": "http://schemas.openxmlformats.org/package/2006/relationships",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "p14": "http://schemas.microsoft.com/office/powerpoint/2010/main",
+}
+R_ID = f"{{{NS['r']}}}id"
+
+
+class BundleError(Exception):
+    """A slide cannot be assembled from bundles and must be copied with python-pptx"""
+
+
+class _Package:
+    """Read-only access to the parts and relationships of a pptx file"""
+
+    def __init__(self, data):
+        self._zip = zipfile.ZipFile(BytesIO(data))
+        self._names = set(self._zip.namelist())
+        types = etree.fromstring(self._zip.read("[Content_Types].xml"))
+        self._defaults = {
+            el.get("Extension").lower(): el.get("ContentType") for el in types.iterfind("ct:Default", NS)
+        }
+        self._overrides = {
+            el.get("PartName"): el.get("ContentType") for el in types.iterfind("ct:Override", NS)
+        }
+
+    def exists(self, partname):
+        return partname[1:] in self._names
+
+    def blob(self, partname):
+        return self._zip.read(partname[1:])
+
+    def content_type(self, partname):
+        if partname in self._overrides:
+            return self._overrides[partname]
+        extension = posixpath.splitext(partname)[1][1:].lower()
+        return self._defaults.get(extension, "application/octet-stream")
+
+    def rels(self, partname):
+        """
+        Returns the relationships of a part as [rId, type, target, external] lists, where the target of
+        an internal relationship is the partname it points to
+        """
+        directory, filename = posixpath.split(partname)
+        rels_partname = posixpath.join(directory, "_rels", filename + ".rels")
+        if not self.exists(rels_partname):
+            return []
+
+        rels = []
+        for el in etree.fromstring(self.blob(rels_partname)).iterfind("pr:Relationship", NS):
+            external = el.get("TargetMode") == "External"
+            target = el.get("Target")
+            if not external:
+                target = posixpath.normpath(posixpath.join(directory, unquote(target)))
+            rels.append([el.get("Id"), el.get("Type"), target, external])
+        return rels
+
+
+class _Assembler:
+    """Copies the parts of bundles into a new package, renaming them so that they do not collide"""
+
+    # Parts shared by the slides of a presentation, copied once per source presentation
+    SHARED_TYPES = {CT.PML_SLIDE_LAYOUT, CT.PML_SLIDE_MASTER, CT.OFC_THEME, CT.PML_NOTES_MASTER}
+    # Parts copied once per slide even when their content is identical
+    SLIDE_TYPES = {CT.PML_SLIDE, CT.PML_NOTES_SLIDE}
+    # Ids of slide masters and layouts share a range starting at 2^31, ids of slides start at 256
+    FIRST_MASTER_ID = 2147483648
+    FIRST_SLIDE_ID = 256
+
+    def __init__(self, artifact_cache):
+        self.artifact_cache = artifact_cache
+        self.readers = {}
+        # Partname -> [blob, content type, rels]
+        self.parts = {}
+        self.copied = {}
+        self.counters = {}
+        self.presentation = None
+        self.masters = []
+        self.notes_master = None
+        self.slides = []
+
+    def add(self, bundle, instance, file_path):
+        """Adds the slide of a bundle. `instance` tells apart the same slide added more than once"""
+        deck = bundle["deck"]
+        if deck not in self.readers:
+            self.readers[deck] = PackageReader(file_path, ZipManifest.load(file_path, deck))
+        if self.presentation is None:
+            self.presentation = self._copy(bundle, bundle["presentation"], instance)
+        self.slides.append(self._copy(bundle, bundle["slide"], instance))
+
+    def _copy(self, bundle, partname, instance):
+        part = bundle["parts"][partname]
+        content_type = part["content_type"]
+
+        if content_type in self.SHARED_TYPES:
+            key = (bundle["deck"], partname)
+        elif content_type in self.SLIDE_TYPES or part["rels"]:
+            key = (instance, bundle["deck"], partname)
+        else:
+            # Media and other leaf parts are shared by content across presentations
+            key = (part["hash"], content_type)
+
+        if content_type == CT.PML_NOTES_MASTER and self.notes_master:
+            # A presentation has a single notes master
+            return self.notes_master
+        if key in self.copied:
+            return self.copied[key]
+
+        if partname == bundle["presentation"]:
+            new_partname = "/ppt/presentation.xml"
+            content_type = CT.PML_PRESENTATION_MAIN
+        else:
+            new_partname = self._partname(partname)
+        self.copied[key] = new_partname
+
+        rels = []
+        self.parts[new_partname] = [self._blob(bundle, partname), content_type, rels]
+        if content_type == CT.PML_SLIDE_MASTER:
+            self.masters.append(new_partname)
+        elif content_type == CT.PML_NOTES_MASTER:
+            self.notes_master = new_partname
+
+        for rId, reltype, target, external in part["rels"]:
+            if not external:
+                target = self._copy(bundle, target, instance)
+            rels.append([rId, reltype, target, external])
+
+        return new_partname
+
+    def _partname(self, partname):
+        """Returns the next free partname in the directory of `partname`, e.g. /ppt/slides/slide3.xml"""
+        directory, filename = posixpath.split(partname)
+        base, extension = posixpath.splitext(filename)
+        base = base.rstrip("0123456789")
+        key = (directory, base, extension.lower())
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return f"{directory}/{base}{self.counters[key]}{extension}"
+
+    def _blob(self, bundle, partname):
+        """Reads a part from the cache if it differs from the stored presentation, else from the presentation"""
+        part = bundle["parts"][partname]
+        if not part["cached"]:
+            try:
+                return self.readers[bundle["deck"]].read(partname)
+            except (KeyError, zipfile.BadZipFile):
+                raise BundleError(bundle["deck"])
+
+        blob = self.artifact_cache.get(part["hash"], ArtifactCache.PART)
+        if blob is None:
+            raise BundleError(bundle["deck"])
+        return blob
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+
+    def save(self, dest_filepath):
+        """Writes the package, adding the slides and masters to the presentation part"""
+        blob, content_type, rels = self.parts[self.presentation]
+        presentation = etree.fromstring(blob)
+        rIds = {rel[0] for rel in rels}
+
+        def add_rel(reltype, target):
+            n = len(rIds) + 1
+            while f"rId{n}" in rIds:
+                n += 1
+            rIds.add(f"rId{n}")
+            rels.append([f"rId{n}", reltype, target, False])
+            return f"rId{n}"
+
+        lists = []
+        next_id = self.FIRST_MASTER_ID
+        master_list = etree.Element(f"{{{NS['p']}}}sldMasterIdLst")
+        for master in self.masters:
+            etree.SubElement(master_list, f"{{{NS['p']}}}sldMasterId", {
+                "id": str(next_id), R_ID: add_rel(RT.SLIDE_MASTER, master)
+            })
+            next_id += 1
+            # Ids of layouts must be unique across all masters
+            master_xml = etree.fromstring(self.parts[master][0])
+            for layout_id in master_xml.iterfind("p:sldLayoutIdLst/p:sldLayoutId", NS):
+                layout_id.set("id", str(next_id))
+                next_id += 1
+            self.parts[master][0] = self._serialize(master_xml)
+        lists.append(master_list)
+
+        if self.notes_master:
+            notes_master_list = etree.Element(f"{{{NS['p']}}}notesMasterIdLst")
+            etree.SubElement(notes_master_list, f"{{{NS['p']}}}notesMasterId", {
+                R_ID: add_rel(RT.NOTES_MASTER, self.notes_master)
+            })
+            lists.append(notes_master_list)
+
+        slide_list = etree.Element(f"{{{NS['p']}}}sldIdLst")
+        for i, slide in enumerate(self.slides):
+            etree.SubElement(slide_list, f"{{{NS['p']}}}sldId", {
+                "id": str(self.FIRST_SLIDE_ID + i), R_ID: add_rel(RT.SLIDE, slide)
+            })
+        lists.append(slide_list)
+
+        # The lists come first in a presentation part
+        for i, element in enumerate(lists):
+            presentation.insert(i, element)
+        self.parts[self.presentation][0] = self._serialize(presentation)
+
+        with zipfile.ZipFile(dest_filepath, "w", zipfile.ZIP_DEFLATED) as package:
+            package.writestr("[Content_Types].xml", self._content_types())
+            package.writestr("_rels/.rels", self._rels("/", [["rId1", RT.OFFICE_DOCUMENT, self.presentation, False]]))
+            for partname, (blob, _, part_rels) in self.parts.items():
+                package.writestr(partname[1:], blob)
+                if part_rels:
+                    directory, filename = posixpath.split(partname)
+                    package.writestr(
+                        posixpath.join(directory, "_rels", filename + ".rels")[1:],
+                        self._rels(partname, part_rels)
+                    )
+
+    def _content_types(self):
+        types = etree.Element(f"{{{NS['ct']}}}Types", nsmap={None: NS["ct"]})
+        etree.SubElement(types, f"{{{NS['ct']}}}Default", {
+            "Extension": "rels", "ContentType": "application/vnd.openxmlformats-package.relationships+xml"
+        })
+        etree.SubElement(types, f"{{{NS['ct']}}}Default", {"Extension": "xml", "ContentType": "application/xml"})
+        for partname, (_, content_type, _) in self.parts.items():
+            etree.SubElement(types, f"{{{NS['ct']}}}Override", {"PartName": partname, "ContentType": content_type})
+        return self._serialize(types)
+
+    def _rels(self, partname, rels):
+        directory = posixpath.dirname(partname)
+        relationships = etree.Element(f"{{{NS['pr']}}}Relationships", nsmap={None: NS["pr"]})
+        for rId, reltype, target, external in rels:
+            attributes = {"Id": rId, "Type": reltype}
+            if external:
+                attributes["Target"] = target
+                attributes["TargetMode"] = "External"
+            else:
+                attributes["Target"] = quote(posixpath.relpath(target, directory))
+            etree.SubElement(relationships, f"{{{NS['pr']}}}Relationship", attributes)
+        return self._serialize(relationships)
+
+    @staticmethod
+    def _serialize(element):
+        return etree.tostring(element, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+class SlideBundle:
+    """
+    A bundle is the manifest of everything a slide needs to be copied into another presentation:
+    the slide part, its notes, layout, master, theme and media, each with its relationships and
+    the hash of its content. Parts are read from the stored presentation through its `ZipManifest`,
+    so only the parts of the requested slides are decompressed. Parts that differ from the stored
+    presentation, because normalizing it changed them, are stored once in the `ArtifactCache` by hash.
+
+    Bundles are built when a presentation is uploaded, and rebuilt when they are missing or were
+    built by an older `VERSION`. Generating a presentation copies the parts of the bundles of the
+    selected slides into a new package, renaming parts and renumbering slide and master ids.
+    """
+
+    # Bump when the format of bundles changes, so that old bundles are rebuilt
+    VERSION = 2
+    # Relationships of the presentation part that are added back when bundles are assembled
+    PRESENTATION_RELS = {RT.SLIDE, RT.SLIDE_MASTER, RT.NOTES_MASTER, RT.HANDOUT_MASTER}
+    # Relationships of slides that are not copied, as they point to parts of the source presentation
+    SKIPPED_RELS = {RT.COMMENTS}
+
+    @staticmethod
+    def build(path_or_file):
+        """
+        Builds and stores the bundles of every slide of a presentation. Returns the number of bundles
+        """
+        artifact_cache = ArtifactCache.connect()
+        if artifact_cache is None:
+            return 0
+
+        file_hash, data = PresentationManager.hash_file(path_or_file)
+        normalized = artifact_cache.get(file_hash, ArtifactCache.NORMALIZED)
+        if normalized is None:
+            # Normalizing the presentation stores it in the cache
+            PresentationManager(path_or_file, cache=True)
+            normalized = artifact_cache.get(file_hash, ArtifactCache.NORMALIZED)
+            if normalized is None:
+                raise BundleError(file_hash)
+
+        if not normalized:
+            # The stored presentation needed no changes, its parts are read from it
+            ZipManifest.store(file_hash, data)
+        return SlideBundle._build(artifact_cache, file_hash, normalized or data, from_deck=not normalized)
+
+    @staticmethod
+    def _build(artifact_cache, file_hash, data, from_deck):
+        package = _Package(data)
+        presentation = next(
+            target for _, reltype, target, _ in package.rels("/") if reltype == RT.OFFICE_DOCUMENT
+        )
+        presentation_rels = package.rels(presentation)
+        targets = {rId: target for rId, _, target, _ in presentation_rels}
+
+        presentation_xml = etree.fromstring(package.blob(presentation))
+        slides = [targets[el.get(R_ID)] for el in presentation_xml.iterfind("p:sldIdLst/p:sldId", NS)]
+        # Lists of slides and masters, and sections and custom shows referring to them, are rebuilt
+        for path in ("p:sldMasterIdLst", "p:notesMasterIdLst", "p:handoutMasterIdLst", "p:sldIdLst", "p:custShowLst"):
+            for el in presentation_xml.findall(path, NS):
+                el.getparent().remove(el)
+        for el in presentation_xml.findall("p:extLst/p:ext/p14:sectionLst/..", NS):
+            el.getparent().remove(el)
+
+        blobs = {}
+        envelope = {}
+        SlideBundle._collect(
+            package, presentation, envelope, blobs, from_deck,
+            blob=_Assembler._serialize(presentation_xml),
+            rels=[rel for rel in presentation_rels if rel[1] not in SlideBundle.PRESENTATION_RELS]
+        )
+
+        artifacts = []
+        for slide_index, slide in enumerate(slides):
+            parts = dict(envelope)
+            mergeable = SlideBundle._collect(package, slide, parts, blobs, from_deck)
+            bundle = {
+                "version": SlideBundle.VERSION,
+                "deck": file_hash,
+                "presentation": presentation,
+                "slide": slide,
+                "mergeable": mergeable,
+                "parts": parts,
+            }
+            artifacts.append((
+                SlideBundle._key(file_hash, slide_index),
+                ArtifactCache.BUNDLE,
+                json.dumps(bundle).encode("utf-8")
+            ))
+
+        artifact_cache.set_many(
+            [(part_hash, ArtifactCache.PART, blob) for part_hash, blob in blobs.items()] + artifacts
+        )
+        return len(slides)
+
+    @staticmethod
+    def _collect(package, partname, parts, blobs, from_deck, blob=None, rels=None):
+        """
+        Adds a part and every part it depends on to `parts`, and the contents to cache to `blobs`.
+        A part given with its `blob` always differs from the stored presentation. Returns False if the
+        part depends on other slides, which cannot be copied with it.
+        """
+        mergeable = True
+        pending = [(partname, blob, rels)]
+        while pending:
+            partname, blob, rels = pending.pop()
+            if partname in parts:
+                continue
+            cached = blob is not None or not from_deck
+            if blob is None:
+                blob = package.blob(partname)
+            if rels is None:
+                rels = [rel for rel in package.rels(partname) if rel[1] not in SlideBundle.SKIPPED_RELS]
+
+            part_hash = hashlib.sha256(blob).hexdigest()
+            if cached:
+                blobs[part_hash] = blob
+            parts[partname] = {
+                "hash": part_hash,
+                "content_type": package.content_type(partname),
+                "rels": rels,
+                "cached": cached,
+            }
+
+            for _, _, target, external in rels:
+                if external or target in parts:
+                    continue
+                if not package.exists(target) or package.content_type(target) == CT.PML_SLIDE:
+                    # Links to other slides or missing parts
+                    mergeable = False
+                    continue
+                pending.append((target, None, None))
+
+        return mergeable
+
+    @staticmethod
+    def _key(file_hash, slide_index):
+        return f"{file_hash}:{slide_index}"
+
+    @staticmethod
+    def load(file_path, file_hash, slide_index):
+        """Returns the bundle of a slide, building the bundles of the presentation if needed"""
+        artifact_cache = ArtifactCache.connect()
+        key = SlideBundle._key(file_hash, slide_index)
+
+        bundle = artifact_cache.get_json(key, ArtifactCache.BUNDLE)
+        if bundle is None or bundle.get("version") != SlideBundle.VERSION:
+            SlideBundle.build(file_path)
+            bundle = artifact_cache.get_json(key, ArtifactCache.BUNDLE)
+        if bundle is None:
+            raise BundleError(file_hash)
+
+        return bundle
+
+    @staticmethod
+    def _discard(dest_filepath):
+        """Deletes what was written to `dest_filepath`, into which slides are then copied another way"""
+        if isinstance(dest_filepath, str) and os.path.exists(dest_filepath):
+            os.remove(dest_filepath)
+
+    @staticmethod
+    def _fail(error, dest_filepath):
+        """Returns False, or raises `error` if the generation was cancelled, after discarding the output"""
+        if not isinstance(error, Cancelled):
+            traceback.print_exc()
+        SlideBundle._discard(dest_filepath)
+        if isinstance(error, Cancelled):
+            raise error
+        return False
+
+    @staticmethod
+    def assemble(slides, dest_filepath, cancellation=None):
+        """
+        Creates a presentation at `dest_filepath`, a path or a file object, with the given
+        (file_path, slide_index) slides. Stops with `Cancelled` before the next slide once
+        `cancellation`, a `CancellationToken`, is cancelled.
+
+        Returns:
+            bool: False if the slides cannot be assembled from bundles, e.g. because the artifact
+            cache is disabled or a slide links to other slides
+        """
+        artifact_cache = ArtifactCache.connect()
+        if artifact_cache is None or not slides:
+            return False
+
+        hashes = {}
+        for attempt in range(2):
+            assembler = _Assembler(artifact_cache)
+            try:
+                for instance, (file_path, slide_index) in enumerate(slides):
+                    if cancellation:
+                        cancellation.raise_if_cancelled()
+                    if file_path not in hashes:
+                        hashes[file_path] = ZipManifest.file_hash(file_path)
+                    bundle = SlideBundle.load(file_path, hashes[file_path], slide_index)
+                    if not bundle["mergeable"]:
+                        return False
+                    assembler.add(bundle, instance, file_path)
+                assembler.save(dest_filepath)
+                return True
+
+            except BundleError as e:
+                # Parts were evicted from the cache since the bundle was built
+                file_hash = e.args[0]
+                file_path = next((path for path, h in hashes.items() if h == file_hash), None)
+                if attempt or file_path is None:
+                    SlideBundle._discard(dest_filepath)
+                    return False
+                print("Rebuilding slide bundles of:", file_path)
+                try:
+                    SlideBundle.build(file_path)
+                except Exception as rebuild_error:
+                    return SlideBundle._fail(rebuild_error, dest_filepath)
+
+            except Exception as e:
+                return SlideBundle._fail(e, dest_filepath)
+
+            finally:
+                assembler.close()
+
+        return False
@@ -1,27 +1,101 @@
 from typing import Union
 
 from bson import ObjectId
+from flask import request
+from flask_socketio import join_room
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app import app, socketio
+from app.config import Config
+from app.models.redisClient import RedisClient
+from app.utils.cancellation import CancellationToken, Cancellations
+
+# Users of the socket connections of this process, by session id
+_connections = {}
+
+# Seconds the set of the connections of a user is kept in Redis after the last connection
+CONNECTIONS_TTL = 24 * 3600
+
+# Authentication
+
+
+def _serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(app.secret_key, salt="socket-auth")
+
+
+def create_socket_token(userid: Union[str, ObjectId]) -> str:
+    """
+    Returns a signed token with which the user connects to the socket. The token expires after
+    `SOCKET_TOKEN_MAX_AGE` seconds, and is only needed to connect.
+    """
+    return _serializer().dumps(str(userid))
+
+
+def user_room(userid: Union[str, ObjectId]) -> str:
+    """Room joined by every socket connection of a user"""
+    return f"user:{userid}"
+
+
+def _track_connection(userid: str, sid: str, connected: bool) -> int:
+    """
+    Records a connection or disconnection of a user and returns the number of connections the
+    user has left in every process. Connections of a process that died are never removed, which
+    only prevents cancelling the work of their user.
+    """
+    if connected:
+        _connections[sid] = userid
+    else:
+        _connections.pop(sid, None)
+
+    client = RedisClient.connect()
+    if client is None:
+        return sum(1 for connected_userid in _connections.values() if connected_userid == userid)
+
+    key = f"sockets:{userid}"
+    pipeline = client.pipeline()
+    if connected:
+        pipeline.sadd(key, sid)
+    else:
+        pipeline.srem(key, sid)
+    pipeline.expire(key, CONNECTIONS_TTL)
+    pipeline.scard(key)
+    return pipeline.execute()[-1]
 
-from app import socketio
 
 # On connection
 
 
 @socketio.on("connect")
-def connect():
+def connect(auth=None):
     """
-    The connect function is used to connect the socket to a remote address.
-    The function takes no arguments and returns nothing.
+    Authenticates the connection with the token sent by the client, `{"token": ...}`, and joins
+    the room of the user, to which all events of the user are emitted. Connections without a valid
+    token are refused.
 
     Args:
+      auth: Authentication data sent by the client.
 
     Returns:
         Nothing.
     """
+    token = auth.get("token") if isinstance(auth, dict) else None
+    try:
+        userid = _serializer().loads(token, max_age=Config.SOCKET_TOKEN_MAX_AGE) if token else None
+    except BadSignature:
+        userid = None
+    except Exception as e:
+        # E.g. no secret key to verify the token with
+        print("Error: ", e)
+        return False
+    if not userid:
+        raise ConnectionRefusedError("unauthorized")
+
+    join_room(user_room(userid))
     try:
-        print("Socket Connected!")
+        _track_connection(userid, request.sid, True)
     except Exception as e:
         print("Error: ", e)
+    print("Socket Connected!")
 
 
 # On disconnection
@@ -30,7 +104,9 @@ def connect():
 @socketio.on("disconnect")
 def disconnect():
     """
-    The disconnect function is used to disconnect the socket from the server.
+    The disconnect function is used to disconnect the socket from the server. Once a user has no
+    connection left in any process, e.g. because the browser was closed, the work running for the
+    user is cancelled in every process.
 
     Args:
 
@@ -38,6 +114,9 @@ def disconnect():
         Nothing.
     """
     try:
+        userid = _connections.get(request.sid)
+        if userid and not _track_connection(userid, request.sid, False):
+            Cancellations.cancel(userid, reason=CancellationToken.DISCONNECTED)
         print("Socket Disconnected!")
     except Exception as e:
         print("Error: ", e)
@@ -49,16 +128,16 @@ def disconnect():
 # Error
 def socket_error(userid: Union[str, ObjectId], msg: str) -> None:
     print(f"🔌 socket_error: {msg}")
-    socketio.emit(f"{userid}_error", msg)
+    socketio.emit(f"{userid}_error", msg, to=user_room(userid))
 
 
 # Success
 def socket_success(userid: Union[str, ObjectId], msg: str) -> None:
     print(f"🔌 socket_success: {msg}")
-    socketio.emit(f"{userid}_success", msg)
+    socketio.emit(f"{userid}_success", msg, to=user_room(userid))
 
 
 # Info
 def socket_info(userid: Union[str, ObjectId], msg: str) -> None:
     print(f"🔌 socket_info: {msg}")
-    socketio.emit(f"{userid}_info", msg)
+    socketio.emit(f"{userid}_info", msg, to=user_room(userid))
@@ -0,0 +1,120 @@
+"""
+    Random access to the parts of stored presentations without reading the whole package
+"""
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+
+from io import BytesIO
+
+from app.utils.artifactcache import ArtifactCache
+from app.utils.presentationmanager import PresentationManager
+
+
+class ZipManifest:
+    """
+    The offset, compression and size of every part of a presentation, read from the central
+    directory of its ZIP package. Together with the slide bundles, which record the parts every
+    slide depends on, it lets a reader decompress only the parts of the requested slides.
+    """
+
+    @staticmethod
+    def build(path_or_data):
+        """Returns the manifest of the presentation at the given path or with the given content"""
+        source = BytesIO(path_or_data) if isinstance(path_or_data, bytes) else path_or_data
+        with zipfile.ZipFile(source) as package:
+            parts = {
+                "/" + info.filename: [info.header_offset, info.compress_type, info.compress_size, info.file_size, info.CRC]
+                for info in package.infolist()
+            }
+        size = len(path_or_data) if isinstance(path_or_data, bytes) else os.path.getsize(path_or_data)
+        return {"size": size, "parts": parts}
+
+    @staticmethod
+    def store(file_hash, data):
+        """Records the manifest of an uploaded presentation, before it is saved to disk"""
+        artifact_cache = ArtifactCache.connect()
+        if artifact_cache:
+            artifact_cache.set_json(file_hash, ArtifactCache.MANIFEST, ZipManifest.build(data))
+
+    @staticmethod
+    def load(file_path, file_hash):
+        """Returns the manifest of a stored presentation, reading its central directory on a miss"""
+        artifact_cache = ArtifactCache.connect()
+        manifest = artifact_cache.get_json(file_hash, ArtifactCache.MANIFEST)
+        if manifest is None or manifest["size"] != os.path.getsize(file_path):
+            manifest = ZipManifest.build(file_path)
+            artifact_cache.set_json(file_hash, ArtifactCache.MANIFEST, manifest)
+        return manifest
+
+    @staticmethod
+    def file_hash(file_path):
+        """
+        Returns the SHA-256 of a stored presentation. It is remembered by the path, size and
+        modification time of the file, so that the file is only read the first time.
+        """
+        artifact_cache = ArtifactCache.connect()
+        stat = os.stat(file_path)
+        key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        file_hash = artifact_cache.get(key, ArtifactCache.FILE_HASH)
+        if file_hash is not None:
+            return file_hash.decode("ascii")
+
+        file_hash, _ = PresentationManager.hash_file(file_path)
+        artifact_cache.set(key, ArtifactCache.FILE_HASH, file_hash.encode("ascii"))
+        return file_hash
+
+
+class PackageReader:
+    """
+    Reads single parts of a stored presentation through a memory map of the file, decompressing
+    only the parts that are read
+    """
+
+    # Size and signature of a local file header in a ZIP file
+    LOCAL_HEADER_SIZE = 30
+    LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+    def __init__(self, file_path, manifest):
+        self.manifest = manifest
+        self._file = open(file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+    def read(self, partname):
+        """Returns the content of a part, raising `zipfile.BadZipFile` if it does not match the manifest"""
+        offset, method, compressed_size, size, crc = self.manifest["parts"][partname]
+
+        header = self._map[offset:offset + self.LOCAL_HEADER_SIZE]
+        if header[:4] != self.LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"No local header for {partname}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = offset + self.LOCAL_HEADER_SIZE + name_length + extra_length
+        data = self._map[start:start + compressed_size]
+
+        if method == zipfile.ZIP_STORED:
+            blob = data
+        elif method == zipfile.ZIP_DEFLATED:
+            blob = zlib.decompress(data, -zlib.MAX_WBITS)
+        else:
+            raise zipfile.BadZipFile(f"Unsupported compression {method} for {partname}")
+
+        if len(blob) != size or zlib.crc32(blob) != crc:
+            raise zipfile.BadZipFile(f"Corrupt part {partname}")
+        return blob
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
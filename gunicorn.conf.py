@@ -0,0 +1,54 @@
+"""
+    Production server: `gunicorn -c gunicorn.conf.py main:app`
+
+    Runs SERVER_WORKERS gevent worker processes, each serving up to SERVER_WORKER_CONNECTIONS
+    requests and Socket.IO connections concurrently. Emits reach clients connected to any worker
+    through the Redis message queue in SOCKETIO_MESSAGE_QUEUE, which is required with more than
+    one worker. Gunicorn does not route the requests of a client to the same worker, so with more
+    than one worker Socket.IO clients must connect with the websocket transport only, or each
+    worker runs as its own instance on its own port behind a load balancer with sticky sessions.
+
+    Read from the environment directly, since importing the app package connects to the databases.
+"""
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Must be set before the workers import the app
+os.environ.setdefault("SOCKETIO_ASYNC_MODE", "gevent")
+# Where the workers write their metrics, so that a scrape of any of them returns those of all. One
+# per port, so that instances running side by side each report their own
+os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), f'pptx_flask_metrics_{os.getenv("SERVER_PORT", 8080)}')
+)
+
+if int(os.getenv("SERVER_WORKERS", 1)) > 1 and not os.getenv("SOCKETIO_MESSAGE_QUEUE"):
+    raise RuntimeError("SOCKETIO_MESSAGE_QUEUE is required to run more than one worker")
+
+bind = f'{os.getenv("SERVER_HOST", "0.0.0.0")}:{os.getenv("SERVER_PORT", 8080)}'
+worker_class = "gevent"
+workers = int(os.getenv("SERVER_WORKERS", 1))
+worker_connections = int(os.getenv("SERVER_WORKER_CONNECTIONS", 1000))
+# Workers whose event loop is blocked longer than this are restarted. Parsing and generation run
+# on native threads (see FairScheduler), so they do not block it; they share the GIL though, so
+# CPU bound work only runs in parallel across SERVER_WORKERS processes
+timeout = int(os.getenv("SERVER_TIMEOUT", 300))
+graceful_timeout = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.getenv("SERVER_KEEPALIVE", 5))
+
+# The app connects to the databases and starts background threads when imported, so every
+# worker imports it after forking and after gevent has patched the standard library
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """Starts the metrics from zero, without the workers of a previous run"""
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
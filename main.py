@@ -6,6 +6,6 @@ if __name__ == '__main__':
     # For local run
     # socketio.run(app, debug=True, host='0.0.0.0', port=5000, log_output=True)
     
-    # For GCP
+    # Development server. In production run `gunicorn -c gunicorn.conf.py main:app`
     socketio.run(app, debug=True, host='0.0.0.0', port=8080, log_output=True, allow_unsafe_werkzeug=True)
     
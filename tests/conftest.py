@@ -0,0 +1,15 @@
+"""
+    Settings of the test run, set before the app package is imported. No database is needed:
+    clients connect on first use, and the background work that would use them is disabled.
+"""
+import os
+import tempfile
+
+_folder = tempfile.mkdtemp(prefix="pptx-flask-tests-")
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("BOOTSTRAP_ON_STARTUP", "false")
+os.environ.setdefault("INVALIDATION_BUS_ENABLED", "false")
+os.environ.setdefault("REAPER_ENABLED", "false")
+os.environ.setdefault("BLOB_STORE_FOLDER", os.path.join(_folder, "blobs"))
+os.environ.setdefault("ARTIFACT_CACHE_PATH", os.path.join(_folder, "artifacts.sqlite3"))
@@ -0,0 +1,114 @@
+"""
+    In-memory stand-ins for the few MongoDB operations the tests need, each atomic
+"""
+import threading
+import uuid
+
+from types import SimpleNamespace
+
+
+def _compare(value, operator, operand):
+    if operator == "$ne":
+        return value != operand
+    if operator == "$not":
+        return not _condition(value, operand)
+    if value is None:
+        return False
+    if operator == "$lte":
+        return value <= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$gt":
+        return value > operand
+    raise NotImplementedError(operator)
+
+
+def _condition(value, condition):
+    if not isinstance(condition, dict):
+        return value == condition
+    return all(_compare(value, operator, operand) for operator, operand in condition.items())
+
+
+def _get(document, key):
+    for field in key.split("."):
+        document = document.get(field) if isinstance(document, dict) else None
+    return document
+
+
+def matches(document, filter):
+    return all(_condition(_get(document, key), condition) for key, condition in filter.items())
+
+
+class FakeCursor(list):
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeCollection:
+    """A collection supporting equality, $ne, $not, $lt, $lte and $gt filters and $set, $inc and $setOnInsert"""
+
+    def __init__(self):
+        self.documents = {}
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.lock = threading.Lock()
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def _find(self, filter):
+        return [document for document in self.documents.values() if matches(document, filter)]
+
+    def insert_one(self, document):
+        with self.lock:
+            self.documents[document["_id"]] = dict(document)
+
+    def update_one(self, filter, update, upsert=False):
+        self._update(filter, update, upsert)
+
+    def find_one_and_update(self, filter, update, upsert=False, return_document=False):
+        before, after = self._update(filter, update, upsert)
+        return after if return_document else before
+
+    def _update(self, filter, update, upsert):
+        with self.lock:
+            found = self._find(filter)
+            if found:
+                document, inserted = found[0], False
+            elif upsert:
+                # Inserted with the fields the filter matches exactly
+                document = {key: value for key, value in filter.items() if not isinstance(value, dict)}
+                document.setdefault("_id", uuid.uuid4().hex)
+                inserted = True
+            else:
+                return None, None
+            before = None if inserted else dict(document)
+            for key, value in update.get("$set", {}).items():
+                document[key] = value
+            for key, value in update.get("$inc", {}).items():
+                document[key] = document.get(key, 0) + value
+            if inserted:
+                for key, value in update.get("$setOnInsert", {}).items():
+                    document.setdefault(key, value)
+                self.documents[document["_id"]] = document
+            return before, dict(document)
+
+    def find_one(self, filter, projection=None):
+        with self.lock:
+            found = self._find(filter)
+            return dict(found[0]) if found else None
+
+    def find_one_and_delete(self, filter):
+        with self.lock:
+            found = self._find(filter)
+            return self.documents.pop(found[0]["_id"]) if found else None
+
+    def delete_one(self, filter):
+        with self.lock:
+            found = self._find(filter)
+            if found:
+                del self.documents[found[0]["_id"]]
+            return SimpleNamespace(deleted_count=len(found[:1]))
+
+    def find(self, filter, projection=None):
+        with self.lock:
+            return FakeCursor(dict(document) for document in self._find(filter))
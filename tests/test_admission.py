@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected
+from app.utils.scheduler import FairScheduler
+
+
+def _hold(controller, release):
+    """Keeps one request of `controller` running until `release` is set"""
+    admitted = threading.Event()
+
+    def run():
+        with controller.admit():
+            admitted.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert admitted.wait(5)
+    return thread
+
+
+def test_full_queue_is_refused_with_429():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=0, queue_timeout=5)
+    release = threading.Event()
+    thread = _hold(controller, release)
+
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire()
+    assert e.value.status == 429
+    assert e.value.reason == AdmissionRejected.QUEUE_FULL
+    assert e.value.retry_after >= 1
+
+    release.set()
+    thread.join()
+
+
+def test_waiting_request_is_refused_with_503_at_its_deadline():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+    release = threading.Event()
+    thread = _hold(controller, release)
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as e:
+        # A deadline given by the caller replaces `queue_timeout`
+        controller.acquire(deadline=started + 0.2)
+    assert e.value.status == 503
+    assert e.value.reason == AdmissionRejected.TIMEOUT
+    assert 0.2 <= time.monotonic() - started < 1
+
+    release.set()
+    thread.join()
+    assert controller.to_metrics()["rejected_total"][AdmissionRejected.TIMEOUT] == 1
+
+
+def test_admitted_once_a_request_is_released():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+    release = threading.Event()
+    thread = _hold(controller, release)
+
+    threading.Timer(0.1, release.set).start()
+    with controller.admit():
+        assert controller.active == 1
+    thread.join()
+    assert controller.active == 0
+
+
+def test_scheduler_admits_within_the_queue_deadline():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+    scheduler = FairScheduler("test", workers=1, user_max_in_flight=1, queue_timeout=0.3, admission=controller)
+    release = threading.Event()
+    thread = _hold(controller, release)
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as e:
+        scheduler.run("user", lambda: None)
+    assert e.value.status == 503
+    # Admission waits for what is left of the scheduler deadline, not for its own queue_timeout
+    assert time.monotonic() - started < 1
+
+    release.set()
+    thread.join()
+
+
+def test_load_keeps_admitted_requests_within_the_deadline():
+    """Concurrent fake generations of several users, more than the scheduler and admission can take"""
+    controller = AdmissionController("test", max_concurrency=3, max_queue=4, queue_timeout=5)
+    scheduler = FairScheduler(
+        "test", workers=6, user_max_in_flight=2, max_queue=8, queue_timeout=0.5, admission=controller
+    )
+    work, slack = 0.05, 0.25
+    lock = threading.Lock()
+    in_flight = {}
+    peaks = {"total": 0, "user": 0}
+    start = threading.Barrier(40)
+    results = []
+
+    def generate(user_id):
+        with lock:
+            in_flight[user_id] = in_flight.get(user_id, 0) + 1
+            peaks["total"] = max(peaks["total"], sum(in_flight.values()))
+            peaks["user"] = max(peaks["user"], in_flight[user_id])
+        started = time.monotonic()
+        time.sleep(work)
+        with lock:
+            in_flight[user_id] -= 1
+        return started
+
+    def request(n):
+        user_id = f"user{n % 10}"
+        start.wait(5)
+        # Arrives in waves, so that requests are admitted as others complete
+        time.sleep(n % 4 * 0.1)
+        submitted = time.monotonic()
+        try:
+            started = scheduler.run(user_id, generate, user_id)
+            results.append((started - submitted, time.monotonic() - submitted))
+        except AdmissionRejected as e:
+            results.append((e.status, time.monotonic() - submitted))
+
+    threads = [threading.Thread(target=request, args=(n,)) for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(results) == 40
+    admitted = [(waited, latency) for waited, latency in results if isinstance(waited, float)]
+    refused = [(status, latency) for status, latency in results if isinstance(status, int)]
+    assert admitted and refused
+    # Admitted requests start before the deadline and take the deadline and their work at most
+    assert max(waited for waited, _ in admitted) <= scheduler.queue_timeout + slack
+    assert max(latency for _, latency in admitted) <= scheduler.queue_timeout + work + slack
+    # The others are refused by then instead of waiting
+    assert {status for status, _ in refused} <= {429, 503}
+    assert max(latency for _, latency in refused) <= scheduler.queue_timeout + slack
+    assert peaks["total"] <= controller.max_concurrency
+    assert peaks["user"] <= scheduler.user_max_in_flight
+    assert controller.active == 0
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    """Runs /search/generate with a fake generation, which blocks until `release` is set"""
+    from app import app
+    from app.routes.user.presentation import routes
+    from app.services.myDocumentsService import MyDocumentsService
+
+    release = threading.Event()
+    fd, deck = tempfile.mkstemp(suffix=".pptx")
+    os.close(fd)
+
+    def generate_from_search(query, user_id, cancellation=None):
+        release.wait(5)
+        return deck
+
+    admission = AdmissionController("test", max_concurrency=1, max_queue=1, queue_timeout=2)
+    scheduler = FairScheduler(
+        "test", workers=1, user_max_in_flight=10, max_queue=1, queue_timeout=2, admission=admission
+    )
+    monkeypatch.setattr(routes, "generate_from_search", generate_from_search)
+    monkeypatch.setattr(MyDocumentsService, "generation_scheduler", scheduler)
+
+    yield app.test_client(), release
+
+    release.set()
+    os.remove(deck)
+
+
+def _get(client, responses):
+    responses.append(client.get("/api/presentation/search/generate?query=test"))
+
+
+def test_generate_refuses_a_full_queue_with_retry_after(generation):
+    client, release = generation
+    responses = []
+    requests = []
+    for _ in range(2):
+        # The first one runs, the second one waits in the queue
+        requests.append(threading.Thread(target=_get, args=(client, responses)))
+        requests[-1].start()
+        time.sleep(0.05)
+
+    refused = client.get("/api/presentation/search/generate?query=test")
+    assert refused.status_code == 429
+    assert int(refused.headers["Retry-After"]) >= 1
+
+    release.set()
+    for request in requests:
+        request.join(5)
+    assert [response.status_code for response in responses] == [200, 200]
+
+
+def test_generate_gives_up_at_the_queue_deadline(generation, monkeypatch):
+    client, release = generation
+    from app.services.myDocumentsService import MyDocumentsService
+
+    monkeypatch.setattr(MyDocumentsService.generation_scheduler, "queue_timeout", 0.3)
+    responses = []
+    running = threading.Thread(target=_get, args=(client, responses))
+    running.start()
+    time.sleep(0.05)
+
+    # Refused at the deadline, while the generation ahead of it still runs
+    started = time.monotonic()
+    refused = client.get("/api/presentation/search/generate?query=test")
+    assert refused.status_code == 503
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert time.monotonic() - started < 1
+    assert not responses
+
+    release.set()
+    running.join(5)
+    assert responses[0].status_code == 200
@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+from app.utils.artifactcache import ArtifactCache
+
+
+def _sum(cache):
+    return cache._db().execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+
+def _accessed(cache, file_hash, kind):
+    return cache._db().execute(
+        "SELECT accessed FROM artifacts WHERE hash = ? AND kind = ?", (file_hash, cache._kind(kind))
+    ).fetchone()[0]
+
+
+def test_total_size_is_kept_up_to_date(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache.sqlite3"), max_bytes=100)
+    cache.set_many([("a", ArtifactCache.PART, b"x" * 10), ("b", ArtifactCache.PART, b"x" * 20)])
+    assert cache.total_size() == _sum(cache) == 30
+
+    # Replaced with another size
+    cache.set("a", ArtifactCache.PART, b"x" * 5)
+    assert cache.total_size() == _sum(cache) == 25
+
+    cache.clear()
+    assert cache.total_size() == 0
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache.sqlite3"), max_bytes=100)
+    for i in range(5):
+        cache.set(str(i), ArtifactCache.PART, b"x" * 30)
+    assert cache.total_size() == _sum(cache) == 90
+    assert [cache.get(str(i), ArtifactCache.PART) is not None for i in range(5)] == [False, False, True, True, True]
+
+
+def test_reads_update_the_access_time_once_per_interval(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache.sqlite3"), max_bytes=100)
+    cache.set("a", ArtifactCache.PART, b"value")
+    written = _accessed(cache, "a", ArtifactCache.PART)
+
+    assert cache.get("a", ArtifactCache.PART) == b"value"
+    assert _accessed(cache, "a", ArtifactCache.PART) == written
+
+    old = time.time() - cache.ACCESS_INTERVAL - 1
+    cache._db().execute("UPDATE artifacts SET accessed = ?", (old,))
+    assert cache.get("a", ArtifactCache.PART) == b"value"
+    assert _accessed(cache, "a", ArtifactCache.PART) > old + 1
+
+
+def test_total_of_a_cache_created_before_it_was_kept(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute(
+        """CREATE TABLE artifacts (
+            hash TEXT NOT NULL, kind TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL,
+            accessed REAL NOT NULL, PRIMARY KEY (hash, kind)
+        )"""
+    )
+    db.execute("INSERT INTO artifacts VALUES ('a', 'part:1', x'00', 42, 0)")
+    db.commit()
+    db.close()
+
+    cache = ArtifactCache(path, max_bytes=100)
+    assert cache.total_size() == 42
+    cache.set("b", ArtifactCache.PART, b"x" * 8)
+    assert cache.total_size() == _sum(cache) == 50
@@ -0,0 +1,195 @@
+import datetime
+import hashlib
+import os
+import threading
+
+from io import BytesIO
+
+import pytest
+
+from app.config import Config
+from app.utils import blobstore
+from app.utils.blobstore import LocalBlobStore
+from fakes import FakeCollection
+
+
+@pytest.fixture
+def db(monkeypatch):
+    collections = {
+        Config.MONGO_BLOB_REFS_COLLECTION: FakeCollection(),
+        Config.MONGO_BLOB_NAMES_COLLECTION: FakeCollection(),
+    }
+    monkeypatch.setattr(blobstore.MongoClient, "connect", staticmethod(lambda: collections))
+    return collections
+
+
+@pytest.fixture
+def blob_store(tmp_path, db):
+    """A store in a temporary folder, with references counted in fake collections"""
+    store = LocalBlobStore(str(tmp_path))
+    refs = db[Config.MONGO_BLOB_REFS_COLLECTION]
+    store.refs = lambda: {blob_hash: ref["refs"] for blob_hash, ref in refs.documents.items()}
+    return store
+
+
+def _age(db, blob_hash, seconds=7200):
+    """Makes a blob look unused for `seconds`"""
+    db[Config.MONGO_BLOB_REFS_COLLECTION].documents[blob_hash]["updatedOn"] = (
+        datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+    )
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_put_a_file_object(blob_store):
+    data = os.urandom(3 * blob_store.CHUNK_SIZE + 1)
+    file = BytesIO(data)
+    file.read(10)
+
+    blob_hash = blob_store.put(file)
+    assert blob_hash == _sha256(data)
+    # The file object can be read again
+    assert file.tell() == 0
+    with blob_store.open(blob_hash) as f:
+        assert f.read() == data
+    assert blob_store.path(blob_hash).endswith(os.path.join(blob_hash[:2], blob_hash[2:4], blob_hash))
+
+
+def test_put_moves_a_path(blob_store):
+    path = blob_store.temp_path(".pptx")
+    with open(path, "wb") as f:
+        f.write(b"deck")
+
+    blob_hash = blob_store.put(path)
+    assert blob_hash == _sha256(b"deck")
+    assert not os.path.exists(path)
+    assert blob_store.exists(blob_hash)
+
+
+def test_names_count_references(blob_store):
+    first = blob_store.store("/ppt/a.pptx", BytesIO(b"same"))
+    assert blob_store.store("/ppt/b.pptx", BytesIO(b"same")) == first
+    assert blob_store.refs() == {first: 2}
+    assert blob_store.resolve_path("/ppt/a.pptx") == blob_store.path(first)
+
+    # Storing a name again with other content releases the blob it pointed to
+    second = blob_store.store("/ppt/a.pptx", BytesIO(b"other"))
+    assert blob_store.refs() == {first: 1, second: 1}
+    # Storing the same content again does not count it twice
+    blob_store.store("/ppt/a.pptx", BytesIO(b"other"))
+    assert blob_store.refs() == {first: 1, second: 1}
+
+    blob_store.unlink("/ppt/b.pptx")
+    blob_store.unlink("/ppt/missing.pptx")
+    assert blob_store.refs() == {first: 0, second: 1}
+    assert blob_store.resolve("/ppt/b.pptx") is None
+    assert blob_store.resolve_path("/ppt/b.pptx") is None
+
+
+
+def test_collect_garbage(blob_store, db):
+    kept = blob_store.store("/ppt/kept.pptx", BytesIO(b"kept"))
+    released = blob_store.store("/ppt/released.pptx", BytesIO(b"released"))
+    recent = blob_store.store("/ppt/recent.pptx", BytesIO(b"recent"))
+    for name in ("/ppt/released.pptx", "/ppt/recent.pptx"):
+        blob_store.unlink(name)
+    _age(db, kept)
+    _age(db, released)
+
+    assert blob_store.collect_garbage(3600) == 1
+    assert not blob_store.exists(released)
+    assert blob_store.exists(kept) and blob_store.exists(recent)
+    assert blob_store.refs() == {kept: 1, recent: 0}
+    assert not os.listdir(blob_store.temp_folder)
+
+
+@pytest.mark.parametrize("stage, after", [
+    # Found unused, then stored before it is moved aside
+    ("find", True),
+    # Moved aside, then stored before its reference document is deleted
+    ("delete_one", False),
+    # Its reference document deleted, then stored before the file is deleted
+    ("delete_one", True),
+])
+def test_collect_garbage_keeps_a_blob_stored_meanwhile(blob_store, db, monkeypatch, stage, after):
+    blob_hash = blob_store.store("/ppt/old.pptx", BytesIO(b"content"))
+    blob_store.unlink("/ppt/old.pptx")
+    _age(db, blob_hash)
+
+    refs = db[Config.MONGO_BLOB_REFS_COLLECTION]
+    operation = getattr(refs, stage)
+
+    def interleaved(*args, **kwargs):
+        monkeypatch.setattr(refs, stage, operation)
+        if not after:
+            blob_store.store("/ppt/new.pptx", BytesIO(b"content"))
+        result = operation(*args, **kwargs)
+        if after:
+            blob_store.store("/ppt/new.pptx", BytesIO(b"content"))
+        return result
+
+    monkeypatch.setattr(refs, stage, interleaved)
+    blob_store.collect_garbage(3600)
+
+    assert blob_store.resolve_path("/ppt/new.pptx") == blob_store.path(blob_hash)
+    with blob_store.open(blob_hash) as f:
+        assert f.read() == b"content"
+    assert blob_store.refs() == {blob_hash: 1}
+    assert not os.listdir(blob_store.temp_folder)
+
+
+def test_concurrent_links_release_each_blob_once(blob_store, db):
+    blobs = [blob_store.put(BytesIO(bytes([i]))) for i in range(4)]
+    blob_store.link("/ppt/shared.pptx", blobs[0])
+
+    def run(blob_hash):
+        for _ in range(50):
+            blob_store.link("/ppt/shared.pptx", blob_hash)
+
+    threads = [threading.Thread(target=run, args=(blob_hash,)) for blob_hash in blobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    current = db[Config.MONGO_BLOB_NAMES_COLLECTION].documents["/ppt/shared.pptx"]["blob"]
+    assert blob_store.resolve("/ppt/shared.pptx") == current
+    assert blob_store.refs() == {blob_hash: int(blob_hash == current) for blob_hash in blobs}
+
+    blob_store.unlink("/ppt/shared.pptx")
+    assert blob_store.refs() == {blob_hash: 0 for blob_hash in blobs}
+    assert blob_store.resolve("/ppt/shared.pptx") is None
+
+
+def test_names_stored_before_they_were_recorded(blob_store, db):
+    """Names written before names were recorded in MongoDB are released from their file"""
+    blob_hash = blob_store.put(BytesIO(b"legacy"))
+    blob_store._add_ref(blob_hash, 1)
+    blob_store._write_ref("/ppt/legacy.pptx", blob_hash)
+
+    other = blob_store.store("/ppt/legacy.pptx", BytesIO(b"new"))
+    assert blob_store.refs() == {blob_hash: 0, other: 1}
+
+
+def test_append_resumes_at_the_offset(blob_store):
+    data = os.urandom(2 * blob_store.CHUNK_SIZE + 100)
+    middle = blob_store.CHUNK_SIZE + 7
+
+    assert blob_store.append("upload", 0, BytesIO(data[:middle] + b"lost")) == middle + 4
+    # A retried chunk replaces whatever was written after its offset
+    assert blob_store.append("upload", middle, BytesIO(data[middle:])) == len(data)
+
+    blob_hash = blob_store.commit("upload")
+    assert blob_hash == _sha256(data)
+    with blob_store.open(blob_hash) as f:
+        assert f.read() == data
+    assert not os.listdir(blob_store.temp_folder)
+
+
+def test_discard(blob_store):
+    blob_store.append("discarded", 0, BytesIO(b"chunk"))
+    blob_store.discard("discarded")
+    blob_store.discard("discarded")
+    assert not os.listdir(blob_store.temp_folder)
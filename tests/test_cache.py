@@ -0,0 +1,87 @@
+import threading
+
+from app.utils import cache
+from app.utils.cache import REQUESTS, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _requests(name):
+    return {result: value for (cache_name, result), value in REQUESTS.snapshot()["values"] if cache_name == name}
+
+
+def test_least_recently_used_is_evicted():
+    ttl_cache = TTLCache("test_lru", maxsize=2)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("c", 3)
+
+    assert ttl_cache.get("b") is None
+    assert ttl_cache.get("a") == 1
+    assert ttl_cache.get("c") == 3
+    assert len(ttl_cache) == 2
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    ttl_cache = TTLCache("test_ttl", ttl=10)
+    ttl_cache.set("a", 1)
+
+    clock.now += 10
+    assert ttl_cache.get("a") == 1
+    clock.now += 0.1
+    assert ttl_cache.get("a", "expired") == "expired"
+    assert len(ttl_cache) == 0
+
+    # Setting an entry again renews it
+    ttl_cache.set("a", 2)
+    clock.now += 5
+    ttl_cache.set("a", 3)
+    clock.now += 9
+    assert ttl_cache.get("a") == 3
+
+
+def test_invalidate_and_clear():
+    ttl_cache = TTLCache("test_invalidate")
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.invalidate("a")
+    ttl_cache.invalidate("missing")
+    assert ttl_cache.get("a") is None
+    assert ttl_cache.get("b") == 2
+
+    ttl_cache.clear()
+    assert len(ttl_cache) == 0
+
+
+def test_hits_and_misses_are_counted():
+    ttl_cache = TTLCache("test_requests")
+    ttl_cache.get("a")
+    ttl_cache.set("a", None)
+    ttl_cache.get("a")
+    ttl_cache.get("a")
+    assert _requests("test_requests") == {"miss": 1, "hit": 2}
+
+
+def test_concurrent_use_keeps_the_size():
+    ttl_cache = TTLCache("test_threads", maxsize=50)
+
+    def run(offset):
+        for i in range(1000):
+            ttl_cache.set(offset + i, i)
+            ttl_cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=run, args=(n * 1000,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ttl_cache) == 50
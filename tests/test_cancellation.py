@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from app.utils.cancellation import CancellationToken, Cancellations, Cancelled
+
+
+def test_new_job_supersedes_the_previous_one_of_its_kind():
+    first = Cancellations.start("user", "generation")
+    other_kind = Cancellations.start("user", "ingest")
+    second = Cancellations.start("user", "generation")
+
+    assert first.is_cancelled and first.reason == CancellationToken.SUPERSEDED
+    assert not second.is_cancelled
+    assert not other_kind.is_cancelled
+    with pytest.raises(Cancelled):
+        first.raise_if_cancelled()
+
+    for token in (first, second, other_kind):
+        Cancellations.finish(token)
+
+
+def test_cancel_by_job_id():
+    token = Cancellations.start("user", "generation")
+
+    assert Cancellations.cancel("user", "generation", "another-job") == []
+    assert not token.is_cancelled
+    assert Cancellations.cancel("user", "generation", token.job_id) == [token.job_id]
+    assert token.is_cancelled and token.reason == CancellationToken.REQUESTED
+    Cancellations.finish(token)
+
+
+def test_cancellation_from_another_process():
+    token = Cancellations.start("user", "generation")
+
+    def receive(origin, before):
+        Cancellations._receive(json.dumps({
+            "origin": origin, "userId": "user", "kind": "generation", "jobId": None,
+            "reason": CancellationToken.SUPERSEDED, "before": before,
+        }))
+
+    # Published by this process, or superseding with a job started before this one
+    receive(Cancellations.ORIGIN, None)
+    receive("other", token.created - 1)
+    assert not token.is_cancelled
+
+    receive("other", token.created + 1)
+    assert token.is_cancelled
+    Cancellations.finish(token)
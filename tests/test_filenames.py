@@ -0,0 +1,46 @@
+import collections
+
+import pytest
+
+from bson import ObjectId
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+from app.services.myDocumentsService import MyDocumentsService
+from fakes import FakeCollection
+
+USER = {"_id": "65700cee327beccab31fc13b"}
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    """Records in a fake collection without the unique index on file names, as when older files share names"""
+    db = collections.defaultdict(FakeCollection)
+    monkeypatch.setattr(MongoClient, "connect", staticmethod(lambda: db))
+    MyDocumentsService.unique_filename_index.clear()
+    yield db[Config.MONGO_DOCUMENT_MASTER_COLLECTION]
+    MyDocumentsService.unique_filename_index.clear()
+
+
+def _record(filename, root="/ppt"):
+    doc = MyDocumentsService._create_my_document_db_struct("title", filename, USER, root)
+    doc["_id"] = ObjectId()
+    return doc
+
+
+def _names(collection):
+    return sorted(document["originalFileName"] for document in collection.documents.values())
+
+
+def test_names_are_checked_without_the_unique_index(documents):
+    for _ in range(3):
+        MyDocumentsService._insert_my_document(_record("deck.pptx"))
+    MyDocumentsService._insert_my_document(_record("deck.pptx", root="/other"))
+
+    assert _names(documents) == ["deck(1).pptx", "deck(2).pptx", "deck.pptx", "deck.pptx"]
+
+
+def test_bulk_inserts_check_names_without_the_unique_index(documents):
+    records = [{"record": _record("deck.pptx")} for _ in range(2)] + [{"record": _record("other.pptx")}]
+    assert len(MyDocumentsService._insert_my_documents(records)) == 3
+    assert _names(documents) == ["deck(1).pptx", "deck.pptx", "other.pptx"]
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from app.config import Config
+from app.models.mongoClient import MongoClient, PoolMetrics
+from app.utils.health import HealthCheck
+
+
+def test_pools_are_a_copy_of_the_counts(monkeypatch):
+    pool_metrics = PoolMetrics()
+    monkeypatch.setattr(MongoClient, "pool_metrics", pool_metrics)
+    event = SimpleNamespace(reason="timeout")
+    pool_metrics.connection_created(event)
+    pool_metrics.connection_check_out_started(event)
+    pool_metrics.connection_checked_out(event)
+
+    pools = HealthCheck.pools()[HealthCheck.MONGO]
+    assert pools["size"] == Config.MONGO_MAX_POOL_SIZE
+    assert (pools["open"], pools["in_use"], pools["checkouts_total"]) == (1, 1, 1)
+
+    # Not changed by the events that follow
+    pool_metrics.connection_checked_in(event)
+    pool_metrics.connection_check_out_failed(event)
+    assert pools["in_use"] == 1 and pools["checkout_failures_total"] == 0
+    assert pool_metrics.to_metrics()["in_use"] == 0
+    assert pools is not pool_metrics.metrics
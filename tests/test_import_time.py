@@ -0,0 +1,43 @@
+"""
+    Cold start budget: workers are scaled up and down, so importing the app must stay fast and
+    must not wait for the databases or load the modules only needed for charts.
+"""
+import os
+import subprocess
+import sys
+
+# Seconds `import app` may take, about 0.5 s when measured
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 1.5))
+
+# Loaded on first use only
+DEFERRED_MODULES = {"pandas", "numpy", "openpyxl"}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_times():
+    """Returns the cumulative import time in seconds of every module imported by `import app`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_import_time_within_budget():
+    times = _import_times()
+
+    assert times["app"] < IMPORT_TIME_BUDGET, f"import app took {times['app']:.2f}s"
+    assert not DEFERRED_MODULES & {module.split(".")[0] for module in times}
@@ -0,0 +1,96 @@
+import pytest
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+from app.utils.invalidation import InvalidationBus, InvalidationEvent
+
+
+class FakeStream:
+    """A change stream that returns `changes` in turn, then stops the bus"""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            InvalidationBus.stop()
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+
+class FakeCollection:
+    def __init__(self, changes):
+        self.changes = changes
+        self.watched = []
+
+    def watch(self, pipeline=None, **kwargs):
+        self.watched.append((pipeline, kwargs))
+        return FakeStream(self.changes)
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Events delivered to a cache registered alone on the bus"""
+    events = []
+    monkeypatch.setattr(InvalidationBus, "_InvalidationBus__handlers", [(events.append, lambda: None)])
+    yield events
+    InvalidationBus._InvalidationBus__stop.clear()
+
+
+def _project(change, projection):
+    """Applies an inclusion projection of dotted paths, as the server does"""
+    projected = {"_id": change["_id"]}
+    for path in projection:
+        source, target = change, projected
+        keys = path.split(".")
+        for key in keys[:-1]:
+            source = source.get(key)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if keys[-1] in source:
+                target[keys[-1]] = source[keys[-1]]
+    return projected
+
+
+def test_changes_are_read_without_the_slides(events, monkeypatch):
+    change = {
+        "_id": {"_data": "token-1"},
+        "operationType": "update",
+        "documentKey": {"_id": "file"},
+        "fullDocument": {
+            "_id": "file",
+            "virtualFileName": "deck.pptx",
+            "createdBy": {"_id": "user", "name": "User"},
+            "slides": [{"index": i, "text": "text"} for i in range(100)],
+        },
+    }
+    (stage,) = InvalidationBus.PIPELINE
+    collection = FakeCollection([_project(change, stage["$project"])])
+    monkeypatch.setattr(
+        MongoClient, "connect", staticmethod(lambda: {Config.MONGO_DOCUMENT_MASTER_COLLECTION: collection})
+    )
+
+    InvalidationBus._run()
+
+    pipeline, kwargs = collection.watched[0]
+    assert pipeline == InvalidationBus.PIPELINE
+    assert kwargs["full_document"] == "updateLookup"
+    assert "slides" not in str(pipeline)
+
+    updated, bumped = events
+    assert updated.type == InvalidationEvent.DECK_UPDATED
+    assert (updated.file_id, updated.user_id, updated.virtual_filename) == ("file", "user", "deck.pptx")
+    assert bumped.type == InvalidationEvent.USER_GENERATION_BUMPED
+    assert bumped.user_id == "user"
@@ -0,0 +1,112 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.config import Config
+from app.utils.metrics import COUNT_BUCKETS, Metrics
+
+REQUESTS = Metrics.counter("test_requests_total", "Requests of the test", ("route",))
+SIZES = Metrics.histogram("test_sizes", "Sizes of the test", buckets=COUNT_BUCKETS)
+QUEUED = Metrics.gauge("test_queued", "Queued tasks of the test", (), lambda: [((), 3)])
+HEALTHY = Metrics.gauge("test_healthy", "Health of the test", (), lambda: [((), 1)], aggregate="min")
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _write(folder, pid, name):
+    """Writes the snapshot of another worker, with the same metrics as this one"""
+    snapshot = Metrics.snapshot()
+    snapshot["pid"] = pid
+    snapshot["metrics"]["test_healthy"]["values"] = [[[], 0]]
+    with open(os.path.join(folder, f"metrics-{pid}-{name}.json"), "w") as file:
+        json.dump(snapshot, file)
+
+
+def _sample(text, line):
+    prefix = line + " "
+    return [sample[len(prefix):] for sample in text.splitlines() if sample.startswith(prefix)]
+
+
+def test_render_without_folder_returns_this_process(monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_DIR", None)
+    REQUESTS.inc(route="/a\"b")
+    text = Metrics.render()
+
+    assert "# TYPE test_requests_total counter" in text
+    assert _sample(text, 'test_requests_total{route="/a\\"b"}')
+    assert _sample(text, "test_queued") == ["3"]
+
+
+def test_render_sums_the_workers(metrics_dir):
+    REQUESTS.inc(2, route="/sum")
+    SIZES.observe(3)
+    own = Metrics.render()
+    requests = int(_sample(own, 'test_requests_total{route="/sum"}')[0])
+    sizes = int(_sample(own, "test_sizes_count")[0])
+
+    # Another live worker, here the parent of this process, and one that exited
+    _write(metrics_dir, os.getppid(), "live")
+    _write(metrics_dir, _exited_pid(), "exited")
+    text = Metrics.render()
+
+    # Counters and histograms of every worker, including the one that exited
+    assert int(_sample(text, 'test_requests_total{route="/sum"}')[0]) == 3 * requests
+    assert int(_sample(text, "test_sizes_count")[0]) == 3 * sizes
+    assert int(_sample(text, 'test_sizes_bucket{le="+Inf"}')[0]) == 3 * sizes
+    # Gauges of the live workers only
+    assert _sample(text, "test_queued") == ["6"]
+    assert _sample(text, "test_healthy") == ["0"]
+    # This process wrote its own snapshot to be read by the others
+    assert len(list(metrics_dir.glob(f"metrics-{os.getpid()}-*.json"))) == 1
+
+
+def test_exited_workers_are_retired(metrics_dir):
+    REQUESTS.inc(route="/retired")
+    requests = int(_sample(Metrics.render(), 'test_requests_total{route="/retired"}')[0])
+
+    for name in ("first", "second"):
+        _write(metrics_dir, _exited_pid(), name)
+    text = Metrics.render()
+    assert int(_sample(text, 'test_requests_total{route="/retired"}')[0]) == 3 * requests
+    assert _sample(text, "test_queued") == ["3"]
+    # Folded into a single snapshot, without their gauges
+    assert not list(metrics_dir.glob("metrics-*-first.json"))
+    assert not list(metrics_dir.glob("metrics-*-second.json"))
+    retired = json.loads((metrics_dir / Metrics.RETIRED_FILE).read_text())
+    assert "test_requests_total" in retired["metrics"] and "test_queued" not in retired["metrics"]
+
+    # Counted once at the next scrapes, with the workers that exited since
+    _write(metrics_dir, _exited_pid(), "third")
+    assert int(_sample(Metrics.render(), 'test_requests_total{route="/retired"}')[0]) == 4 * requests
+    assert int(_sample(Metrics.render(), 'test_requests_total{route="/retired"}')[0]) == 4 * requests
+
+
+def test_retired_snapshots_left_behind_are_not_counted_twice(metrics_dir):
+    REQUESTS.inc(route="/left")
+    requests = int(_sample(Metrics.render(), 'test_requests_total{route="/left"}')[0])
+    pid = _exited_pid()
+    _write(metrics_dir, pid, "left")
+    Metrics.render()
+
+    # A scrape that stopped after writing the retired snapshot, before removing what it folded
+    _write(metrics_dir, pid, "left")
+    assert int(_sample(Metrics.render(), 'test_requests_total{route="/left"}')[0]) == 2 * requests
+    assert not list(metrics_dir.glob("metrics-*-left.json"))
+
+
+def test_render_skips_unreadable_snapshots(metrics_dir):
+    (metrics_dir / "metrics-1-partial.json").write_text("{")
+    assert "# TYPE test_requests_total counter" in Metrics.render()
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from app.config import Config
+from app.utils import progress
+from app.utils.progress import ProgressChannel, ProgressJob
+from app.utils.socket import user_room
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Events sent to sockets, by job id. Pending updates are only sent when flushed or finished"""
+    events = {}
+
+    def emit(event, payload, to=None):
+        events.setdefault(payload["jobId"], []).append((event, payload, to))
+
+    monkeypatch.setattr(Config, "PROGRESS_INTERVAL", 60)
+    monkeypatch.setattr(progress.socketio, "emit", emit)
+    return events
+
+
+def _wait_for(events, job_id, timeout=2):
+    deadline = time.monotonic() + timeout
+    while job_id not in events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return events.get(job_id, [])
+
+
+def test_updates_are_coalesced(emitted):
+    job = ProgressChannel.start("user", "upload", 100, "parse")
+    for i in range(100):
+        job.advance(stage="index" if i >= 50 else None)
+    ProgressChannel.flush()
+
+    # The background thread may have sent the first state before the interval was raised
+    events = emitted[job.job_id]
+    assert 1 <= len(events) <= 2
+    event, payload, to = events[-1]
+    assert event == "user_progress"
+    assert to == user_room("user")
+    assert payload["done"] == 100 and payload["stage"] == "index"
+    assert payload["status"] == ProgressJob.RUNNING
+
+
+def test_final_state_is_sent_at_once(emitted):
+    job = ProgressChannel.start("user", "generate", 10, "search")
+    job.advance(5)
+    job.finish("generated")
+
+    events = _wait_for(emitted, job.job_id)
+    assert events, "the final state was not sent before the interval"
+    _, payload, _ = events[-1]
+    assert payload["status"] == ProgressJob.DONE
+    assert payload["message"] == "generated"
+    assert payload["done"] == 5
+
+
+def test_payload():
+    job = ProgressJob("user", "upload", 4, "parse", job_id="job")
+    assert job.to_payload()["eta"] is None
+
+    job.done = 2
+    payload = job.to_payload()
+    assert payload["jobId"] == "job"
+    assert payload["eta"] is not None and payload["eta"] >= 0
+
+    job.update(done=10, total=8)
+    assert job.done == 8 and job.total == 8
+    job.finish(failed=True)
+    assert job.to_payload()["status"] == ProgressJob.FAILED
+    assert job.to_payload()["eta"] is None
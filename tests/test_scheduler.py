@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.admission import AdmissionRejected
+from app.utils.scheduler import FairScheduler
+
+
+def test_users_take_turns():
+    scheduler = FairScheduler("test", workers=1, user_max_in_flight=1)
+    release = threading.Event()
+    order = []
+
+    def task(name):
+        release.wait(5)
+        order.append(name)
+
+    futures = [scheduler.submit("a", task, f"a{i}") for i in range(3)]
+    time.sleep(0.05)
+    futures += [scheduler.submit("b", task, f"b{i}") for i in range(2)]
+    release.set()
+    for future in futures:
+        future.result(5)
+
+    # a0 was already running when the tasks of b arrived
+    assert order == ["a0", "a1", "b0", "a2", "b1"]
+
+
+def test_user_runs_at_most_max_in_flight():
+    scheduler = FairScheduler("test", workers=4, user_max_in_flight=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    futures = [scheduler.submit("a", task) for _ in range(6)]
+    for future in futures:
+        future.result(5)
+    assert max(peak) == 2
+
+
+def test_full_queue_is_refused():
+    scheduler = FairScheduler("test", workers=1, user_max_in_flight=1, max_queue=1)
+    release = threading.Event()
+    scheduler.submit("a", release.wait, 5)
+    time.sleep(0.05)
+    scheduler.submit("a", lambda: None)
+
+    with pytest.raises(AdmissionRejected) as e:
+        scheduler.submit("b", lambda: None)
+    assert e.value.status == 429
+    release.set()
+
+
+def test_run_gives_up_at_the_deadline_and_leaves_the_queue():
+    scheduler = FairScheduler("test", workers=1, user_max_in_flight=1, queue_timeout=0.2)
+    release = threading.Event()
+    running = scheduler.submit("a", release.wait, 5)
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as e:
+        scheduler.run("b", lambda: "never")
+    assert e.value.status == 503
+    assert time.monotonic() - started < 1
+    assert scheduler.to_metrics()["queued"] == 0
+    assert scheduler.user_state("b")["rejected_total"] == 1
+
+    release.set()
+    assert running.result(5) is True
+
+
+def test_idle_users_are_evicted(monkeypatch):
+    scheduler = FairScheduler("test", workers=1, user_max_in_flight=1)
+    monkeypatch.setattr(FairScheduler, "USER_METRICS_TTL", 0.1)
+    scheduler.run("a", lambda: None)
+    assert "a" in scheduler.to_metrics()["users"]
+
+    time.sleep(0.2)
+    scheduler.run("b", lambda: None)
+    assert set(scheduler.to_metrics()["users"]) == {"b"}
@@ -0,0 +1,73 @@
+import datetime
+import json
+
+import pytest
+
+from bson import ObjectId, json_util
+from bson.decimal128 import Decimal128
+
+from app.utils import serializer
+from app.utils.serializer import Serializer
+
+DOCUMENT = {
+    "_id": ObjectId("65a1b2c3d4e5f60718293a4b"),
+    "name": "deck.pptx",
+    "size": 12345,
+    "price": Decimal128("1.50"),
+    "created": datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+    "slides": [{"index": 1, "tags": ("a", "b")}, {"index": 2, "deleted": None, "ratio": 0.5}],
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def dumps(request, monkeypatch):
+    """Serializes with orjson and with the json fallback"""
+    if request.param == "json":
+        monkeypatch.setattr(serializer, "orjson", None)
+    elif serializer.orjson is None:
+        pytest.skip("orjson is not installed")
+    return Serializer.dumps
+
+
+def test_to_json_compatible_matches_json_util():
+    assert Serializer.to_json_compatible(DOCUMENT) == json.loads(json_util.dumps(DOCUMENT))
+
+
+def test_to_json_compatible_with_fallback():
+    converted = Serializer.to_json_compatible(DOCUMENT, Serializer.bson_or_str)
+    assert converted["_id"] == {"$oid": "65a1b2c3d4e5f60718293a4b"}
+    assert converted["slides"][0]["tags"] == ["a", "b"]
+    assert Serializer.to_json_compatible({1: object}, Serializer.bson_or_str) == {"1": str(object)}
+
+
+def test_dumps(dumps):
+    loaded = json.loads(dumps(DOCUMENT))
+    assert loaded["_id"] == "65a1b2c3d4e5f60718293a4b"
+    assert loaded["price"] == "1.50"
+    # The date format of Flask's JSON provider
+    assert loaded["created"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+    assert loaded["slides"][1] == {"index": 2, "deleted": None, "ratio": 0.5}
+    assert dumps({"b": 1, "a": 2}, sort_keys=True) == b'{"a":2,"b":1}'
+
+
+def test_dumps_refuses_unknown_types(dumps):
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
+
+
+def test_stream_ndjson(dumps):
+    lines = list(Serializer.stream_ndjson([{"a": 1}, [2]]))
+    assert lines == [b'{"a":1}\n', b"[2]\n"]
+
+
+def test_response():
+    from app import app
+
+    with app.app_context():
+        assert app.json.response({"a": 1}).get_json() == {"a": 1}
+        assert app.json.response(a=1, b=2).get_json() == {"a": 1, "b": 2}
+        assert app.json.response(1, 2).get_json() == [1, 2]
+        assert app.json.response().get_json() is None
+        assert app.json.response(DOCUMENT).get_json()["_id"] == "65a1b2c3d4e5f60718293a4b"
+        with pytest.raises(TypeError):
+            app.json.response(1, a=2)
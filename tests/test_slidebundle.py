@@ -0,0 +1,128 @@
+import struct
+import zipfile
+import zlib
+
+from io import BytesIO
+
+import pytest
+
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.util import Inches
+
+from app.utils.cancellation import CancellationToken, Cancelled
+from app.utils.slidebundle import BundleError, SlideBundle
+
+
+def _png(red, green, blue):
+    """Returns a 1x1 PNG of the given color"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixels = zlib.compress(bytes([0, red, green, blue]))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", pixels)
+        + chunk(b"IEND", b"")
+    )
+
+
+def _deck(path, name, slides, image=None):
+    """Saves a presentation with a titled slide per entry of `slides`, the first one with `image`"""
+    presentation = Presentation()
+    for i, title in enumerate(slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+        slide.shapes.title.text = title
+        slide.notes_slide.notes_text_frame.text = f"notes of {title}"
+        if image and i == 0:
+            slide.shapes.add_picture(BytesIO(image), Inches(1), Inches(2))
+    file_path = str(path / name)
+    presentation.save(file_path)
+    return file_path
+
+
+def _titles(data):
+    return [slide.shapes.title.text for slide in Presentation(BytesIO(data)).slides]
+
+
+def test_assemble_slides_of_several_presentations(tmp_path):
+    image = _png(255, 0, 0)
+    first = _deck(tmp_path, "first.pptx", ["one", "two", "three"], image)
+    second = _deck(tmp_path, "second.pptx", ["four", "five"], image)
+
+    dest = BytesIO()
+    slides = [(second, 1), (first, 0), (first, 2), (first, 0)]
+    assert SlideBundle.assemble(slides, dest)
+
+    presentation = Presentation(BytesIO(dest.getvalue()))
+    assert [slide.shapes.title.text for slide in presentation.slides] == ["five", "one", "three", "one"]
+    assert [slide.notes_slide.notes_text_frame.text for slide in presentation.slides] == [
+        "notes of five", "notes of one", "notes of three", "notes of one"
+    ]
+    # The same slide added twice is copied twice, its image only once
+    pictures = [
+        shape for slide in presentation.slides for shape in slide.shapes
+        if shape.shape_type == MSO_SHAPE_TYPE.PICTURE
+    ]
+    assert len(pictures) == 2
+    assert all(picture.image.blob == image for picture in pictures)
+    with zipfile.ZipFile(dest) as package:
+        assert len([name for name in package.namelist() if name.startswith("ppt/media/")]) == 1
+    # One master per source presentation, with unique ids
+    assert len(presentation.slide_masters) == 2
+    ids = [slide.slide_id for slide in presentation.slides]
+    assert len(set(ids)) == len(ids)
+
+
+def test_assemble_to_a_path_round_trips(tmp_path):
+    source = _deck(tmp_path, "source.pptx", ["a", "b"])
+    dest = str(tmp_path / "dest.pptx")
+
+    assert SlideBundle.assemble([(source, 1), (source, 0)], dest)
+    with open(dest, "rb") as file:
+        assert _titles(file.read()) == ["b", "a"]
+
+    # An assembled presentation can itself be bundled and assembled
+    again = BytesIO()
+    assert SlideBundle.assemble([(dest, 1)], again)
+    assert _titles(again.getvalue()) == ["a"]
+
+
+def test_assemble_nothing():
+    assert not SlideBundle.assemble([], BytesIO())
+
+
+def test_assemble_stops_when_cancelled(tmp_path):
+    source = _deck(tmp_path, "cancelled.pptx", ["a"])
+    dest = str(tmp_path / "cancelled-dest.pptx")
+    token = CancellationToken("user", "generate")
+    token.cancel("test")
+
+    with pytest.raises(Cancelled):
+        SlideBundle.assemble([(source, 0)], dest, token)
+    assert not (tmp_path / "cancelled-dest.pptx").exists()
+
+
+@pytest.mark.parametrize("error", [RuntimeError("cache full"), Cancelled("test")])
+def test_failed_rebuild_of_evicted_bundles(tmp_path, monkeypatch, error):
+    """Parts of a bundle were evicted from the cache, and rebuilding the bundles fails"""
+    source = _deck(tmp_path, "evicted.pptx", ["a"])
+    dest = tmp_path / "evicted-dest.pptx"
+    dest.write_bytes(b"partial")
+
+    def load(file_path, file_hash, slide_index):
+        raise BundleError(file_hash)
+
+    def build(path_or_file):
+        raise error
+
+    monkeypatch.setattr(SlideBundle, "load", staticmethod(load))
+    monkeypatch.setattr(SlideBundle, "build", staticmethod(build))
+    if isinstance(error, Cancelled):
+        with pytest.raises(Cancelled):
+            SlideBundle.assemble([(source, 0)], str(dest))
+    else:
+        # Slides are then copied with python-pptx
+        assert not SlideBundle.assemble([(source, 0)], str(dest))
+    assert not dest.exists()
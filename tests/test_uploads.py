@@ -0,0 +1,106 @@
+import collections
+import datetime
+
+from io import BytesIO
+
+import pytest
+
+from app.config import Config
+from app.models.mongoClient import MongoClient
+from app.services.myDocumentsService import MyDocumentsService
+from app.services.uploadService import UploadError, UploadService
+from app.utils.blobstore import BlobStore, LocalBlobStore
+from app.utils.messages import Messages
+from fakes import FakeCollection
+
+USER = {"_id": "user"}
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    """Uploads and blobs in fake collections, and a blob store in a temporary folder"""
+    db = collections.defaultdict(FakeCollection)
+    store = LocalBlobStore(str(tmp_path))
+    monkeypatch.setattr(MongoClient, "connect", staticmethod(lambda: db))
+    monkeypatch.setattr(BlobStore, "connect", staticmethod(lambda: store))
+    return db
+
+
+@pytest.fixture
+def upload(db):
+    """A complete upload of 5 bytes"""
+    upload = UploadService.create_upload(USER, "deck.pptx", 5, "/ppt")
+    UploadService.append_chunk(USER, upload["uploadId"], 0, 5, BytesIO(b"hello"))
+    return upload["uploadId"]
+
+
+def _fake_upload_document(monkeypatch, *results):
+    """Uploads documents with the given results in turn, or raises them if they are exceptions"""
+    results = list(results)
+    calls = []
+
+    def upload_document(logged_in_user, file, path, replace=False):
+        calls.append(file.stream.read())
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(MyDocumentsService, "upload_document", staticmethod(upload_document))
+    return calls
+
+
+def test_failed_finalize_can_be_retried(db, upload, monkeypatch):
+    calls = _fake_upload_document(monkeypatch, RuntimeError("database unreachable"), (0, None), (1, "document"))
+    store = BlobStore.connect()
+
+    with pytest.raises(RuntimeError):
+        UploadService.finalize_upload(USER, upload)
+    # The upload is kept with its blob, and can be finalized again at once
+    blob_hash = store.resolve(f"uploads/{upload}")
+    assert blob_hash and store.exists(blob_hash)
+
+    with pytest.raises(UploadError) as e:
+        UploadService.finalize_upload(USER, upload)
+    assert e.value.status == 500
+
+    assert UploadService.finalize_upload(USER, upload) == "document"
+    assert calls == [b"hello"] * 3
+    # Deleted once the document is uploaded
+    assert not db[Config.MONGO_UPLOADS_COLLECTION].documents
+    assert store.resolve(f"uploads/{upload}") is None
+    assert db[Config.MONGO_BLOB_REFS_COLLECTION].documents[blob_hash]["refs"] == 0
+
+
+def test_finalize_is_claimed_until_the_lease_ends(db, upload, monkeypatch):
+    _fake_upload_document(monkeypatch, (1, "document"))
+    document = next(iter(db[Config.MONGO_UPLOADS_COLLECTION].documents.values()))
+
+    # Being finalized by another request, or by a worker that died
+    document["finalizingUntil"] = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+    with pytest.raises(UploadError) as e:
+        UploadService.finalize_upload(USER, upload)
+    assert e.value.status == 409
+    assert e.value.message == Messages.ERROR_UPLOAD_FINALIZING
+
+    document["finalizingUntil"] = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    assert UploadService.finalize_upload(USER, upload) == "document"
+
+
+@pytest.mark.parametrize("size", ["big", None, [1]])
+def test_create_upload_refuses_a_size_that_is_not_a_number(size):
+    from app import app
+
+    response = app.test_client().post("/api/presentation/uploads", json={"filename": "deck.pptx", "size": size})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == Messages.ERROR_UPLOAD_SIZE
+
+
+def test_upload_chunk_refuses_an_offset_that_is_not_a_number():
+    from app import app
+
+    response = app.test_client().put(
+        "/api/presentation/uploads/upload", data=b"chunk", headers={"Upload-Offset": "start"}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["message"] == Messages.ERROR_UPLOAD_OFFSET
@@ -0,0 +1,68 @@
+import zipfile
+
+import pytest
+
+from app.utils.artifactcache import ArtifactCache
+from app.utils.zipmanifest import PackageReader, ZipManifest
+
+PARTS = {
+    "[Content_Types].xml": b"<Types/>",
+    "ppt/slides/slide1.xml": b"<slide>" + b"x" * 10000 + b"</slide>",
+    "ppt/media/image1.png": bytes(range(256)) * 4,
+}
+
+
+def _package(path, name="deck.pptx"):
+    file_path = str(path / name)
+    with zipfile.ZipFile(file_path, "w") as package:
+        for partname, blob in PARTS.items():
+            compression = zipfile.ZIP_STORED if partname.endswith(".png") else zipfile.ZIP_DEFLATED
+            package.writestr(partname, blob, compress_type=compression)
+    return file_path
+
+
+def test_reader_reads_every_part(tmp_path):
+    file_path = _package(tmp_path)
+    manifest = ZipManifest.build(file_path)
+
+    with open(file_path, "rb") as file:
+        assert ZipManifest.build(file.read()) == manifest
+    with PackageReader(file_path, manifest) as reader:
+        for partname, blob in PARTS.items():
+            assert reader.read("/" + partname) == blob
+        with pytest.raises(KeyError):
+            reader.read("/ppt/slides/slide2.xml")
+
+
+def test_reader_refuses_parts_that_do_not_match(tmp_path):
+    file_path = _package(tmp_path)
+    manifest = ZipManifest.build(file_path)
+    # The manifest of another file
+    offset, method, compressed_size, size, crc = manifest["parts"]["/ppt/media/image1.png"]
+    manifest["parts"]["/ppt/media/image1.png"] = [offset, method, compressed_size, size, crc ^ 1]
+    manifest["parts"]["/ppt/slides/slide1.xml"][0] += 1
+
+    with PackageReader(file_path, manifest) as reader:
+        for partname in ("/ppt/media/image1.png", "/ppt/slides/slide1.xml"):
+            with pytest.raises(zipfile.BadZipFile):
+                reader.read(partname)
+
+
+def test_load_rebuilds_a_manifest_of_another_size(tmp_path):
+    file_path = _package(tmp_path, "stale.pptx")
+    file_hash = ZipManifest.file_hash(file_path)
+    ArtifactCache.connect().set_json(file_hash, ArtifactCache.MANIFEST, {"size": 1, "parts": {}})
+
+    manifest = ZipManifest.load(file_path, file_hash)
+    assert manifest == ZipManifest.build(file_path)
+    assert ArtifactCache.connect().get_json(file_hash, ArtifactCache.MANIFEST) == manifest
+
+
+def test_file_hash_is_remembered_until_the_file_changes(tmp_path):
+    file_path = _package(tmp_path, "changed.pptx")
+    file_hash = ZipManifest.file_hash(file_path)
+    assert ZipManifest.file_hash(file_path) == file_hash
+
+    with zipfile.ZipFile(file_path, "a") as package:
+        package.writestr("ppt/slides/slide2.xml", b"<slide/>")
+    assert ZipManifest.file_hash(file_path) != file_hash